@@ -0,0 +1,108 @@
+"""
+Offline benchmark of the artifact digest in the deployment Lambda.
+
+Runs against moto's in-memory S3 (no AWS account needed):
+
+    python benchmark_digest.py --size-mb 64 --repeat 3
+
+The "legacy" scenario reproduces the former handler: one ``get_object`` only
+to print the content type, then a second one whose body is ``read()`` whole
+before hashing. The new path makes a single ``get_object``, streams the body
+through SHA-256 in chunks, or reuses the checksum when the object was
+uploaded with ``ChecksumAlgorithm='SHA256'``. The peak memory includes the
+copy of the object that moto builds for each response, in the same process.
+"""
+
+import argparse
+import hashlib
+import os
+import time
+import tracemalloc
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+
+from moto import mock_aws
+
+BUCKET = "clemapbucket"
+
+
+def legacy_digest(s3_client, bucket, key):
+    response = s3_client.get_object(Bucket=bucket, Key=key)
+    print("CONTENT TYPE: " + response['ContentType'])
+    response = s3_client.get_object(Bucket=bucket, Key=key)
+    file_data = response['Body'].read()
+    return hashlib.sha256(file_data).hexdigest()
+
+
+def streaming_digest(lambda_function, bucket, key):
+    artifact = lambda_function.s3_client.get_object(Bucket=bucket, Key=key, ChecksumMode='ENABLED')
+    print("CONTENT TYPE: " + artifact['ContentType'])
+    return lambda_function.calculate_s3_file_digest(bucket, key, artifact)
+
+
+class CallCounter:
+    def __init__(self, client):
+        self.count = 0
+        client.meta.events.register("before-call.s3.GetObject", self._count)
+
+    def _count(self, **kwargs):
+        self.count += 1
+
+
+def measure(func, repeat):
+    durations = []
+    peak = 0
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        digest = func()
+        durations.append(time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return digest, min(durations), peak / 2**20
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=64, help="Size of the synthetic model.tar.gz")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with mock_aws():
+        # Importe sous moto : les clients du module pointent vers le S3 simule
+        import lambda_function
+
+        s3_client = lambda_function.s3_client
+        s3_client.create_bucket(Bucket=BUCKET)
+        payload = os.urandom(args.size_mb * 2**20)
+        expected = hashlib.sha256(payload).hexdigest()
+        plain_key = "output/job-plain/output/model.tar.gz"
+        checksum_key = "output/job-checksum/output/model.tar.gz"
+        s3_client.put_object(Bucket=BUCKET, Key=plain_key, Body=payload, ContentType="application/x-tar")
+        s3_client.put_object(Bucket=BUCKET, Key=checksum_key, Body=payload, ContentType="application/x-tar",
+                             ChecksumAlgorithm="SHA256")
+        del payload
+        counter = CallCounter(s3_client)
+
+        scenarios = [
+            ("legacy", plain_key, lambda key: legacy_digest(s3_client, BUCKET, key)),
+            ("streaming", plain_key, lambda key: streaming_digest(lambda_function, BUCKET, key)),
+            ("s3 checksum", checksum_key, lambda key: streaming_digest(lambda_function, BUCKET, key)),
+        ]
+        results = []
+        for name, key, func in scenarios:
+            counter.count = 0
+            digest, elapsed, peak = measure(lambda: func(key), args.repeat)
+            assert digest == expected, f"{name}: digest mismatch"
+            results.append((name, elapsed, peak, counter.count // args.repeat))
+
+    print(f"\nmodel.tar.gz of {args.size_mb} MiB, best of {args.repeat}")
+    print(f"{'scenario':<12} {'time s':>8} {'peak MiB':>10} {'get_object':>11}")
+    for name, elapsed, peak, calls in results:
+        print(f"{name:<12} {elapsed:>8.3f} {peak:>10.1f} {calls:>11}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""
+Offline replay of the cloud side: training launcher, deployment Lambda and training script.
+
+    python benchmark_lambdas.py --deployments 5 --data-files 50 --train
+
+S3 and SageMaker run on moto, Greengrass V2 on ``FakeGreengrassV2``; no AWS
+account is needed. The replay mimics a retraining cycle: retrain reports
+land in ``data/``, ``lambda_function_2`` launches the training job, and for
+every simulated job a ``model.tar.gz`` is put in ``output/`` and handed to
+``lambda_function`` as an S3 event. Its ``model.h5`` has the architecture of
+the repo's ``model.tar`` (whose stored weights are NaN) with seeded weights
+moved a little by each job, plus the matching ``model.pack``. The same event
+is then replayed to time the "already deployed" path, and a candidate whose
+``evaluation.json`` scores worse than the deployed model times the rejection
+by the evaluation gate.
+
+Reports handler durations and the S3 / Greengrass calls per invocation;
+``--train`` also times one epoch of ``train_lstm.py`` on the synthetic reports
+(skipped when TensorFlow is missing). ``--save`` and ``--baseline`` work like
+in ``Edge Device/benchmark_pipeline.py``.
+"""
+
+import argparse
+import contextlib
+import gzip
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+import numpy as np
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+
+from moto import mock_aws
+
+from fake_greengrass import FakeGreengrassV2
+
+BUCKET = "clemapbucket"
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+TRAINING_DIR = os.path.join(ROOT, "AWS", "Training")
+REPO_MODEL_TAR = os.path.join(ROOT, "model.tar")
+
+# +1 : une hausse est une regression
+REGRESSION_KEYS = {"launch_p50_ms": 1, "deploy_p50_ms": 1, "redeploy_p50_ms": 1, "reject_p50_ms": 1}
+
+
+class CallCounter:
+    """Counts the requests made by a boto3 client."""
+
+    def __init__(self, client, service):
+        self.count = 0
+        client.meta.events.register(f"before-call.{service}", self._count)
+
+    def _count(self, **kwargs):
+        self.count += 1
+
+
+def make_report_csv(rows, seed):
+    """Gzip CSV in the format of the edge DatasetExporter (time, phases, target)."""
+    rng = np.random.default_rng(seed)
+    phases = 0.1 + 0.05 * np.sin(np.arange(rows)[:, None] / 600 + rng.uniform(0, 6, 3)) + rng.normal(0, 0.002, (rows, 3))
+    lines = ["time,l1_p,l2_p,l3_p,target"]
+    lines += [f"{seed * rows + i},{a:.6f},{b:.6f},{c:.6f},{a + b + c:.6f}" for i, (a, b, c) in enumerate(phases)]
+    return gzip.compress(("\n".join(lines) + "\n").encode("utf-8"), mtime=0)
+
+
+def make_model_tar(work_dir, seed, mse):
+    """model.tar.gz as written by a training job: repo model.h5 with seeded weights, its pack and its holdout score."""
+    import h5py
+    from model_artifact import pack_h5
+
+    job_dir = tempfile.mkdtemp(prefix=f"job-{seed}-", dir=work_dir)
+    h5_path = os.path.join(job_dir, "model.h5")
+    with tarfile.open(REPO_MODEL_TAR) as tar:
+        with tar.extractfile("model.h5") as src, open(h5_path, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+    base, step = np.random.default_rng(0), np.random.default_rng(seed + 1)
+    with h5py.File(h5_path, "r+") as f:
+        # Memes poids de depart pour tous les jobs, puis un petit pas propre a chacun (comme un fine-tuning)
+        f["model_weights"].visititems(
+            lambda name, obj: obj.write_direct(
+                (base.normal(0, 0.1, obj.shape) + step.normal(0, 1e-3, obj.shape)).astype(obj.dtype))
+            if isinstance(obj, h5py.Dataset) else None
+        )
+    with open(os.path.join(job_dir, "model.pack"), "wb") as f:
+        f.write(pack_h5(h5_path))
+    with open(os.path.join(job_dir, "evaluation.json"), "w") as f:
+        json.dump({"holdout_digest": "benchmark", "holdout_windows": 1000,
+                   "candidate": {"mse": mse, "mae": mse ** 0.5}, "baseline": None}, f)
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for name in ("model.h5", "model.pack", "evaluation.json"):
+            tar.add(os.path.join(job_dir, name), arcname=name)
+    return buffer.getvalue()
+
+
+def s3_event(key):
+    return {"Records": [{"s3": {"bucket": {"name": BUCKET}, "object": {"key": key}}}]}
+
+
+def invoke(handler, event, counters, verbose):
+    before = [counter.count for counter in counters]
+    output = None if verbose else io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output) if output is not None else contextlib.nullcontext():
+        response = handler(event, None)
+    elapsed = time.perf_counter() - start
+    return response, elapsed, [counter.count - b for counter, b in zip(counters, before)]
+
+
+def summary(name, durations, calls):
+    durations = np.array(durations) * 1e3
+    return {
+        f"{name}_count": len(durations),
+        f"{name}_p50_ms": float(np.percentile(durations, 50)),
+        f"{name}_max_ms": float(durations.max()),
+        f"{name}_s3_calls": float(np.mean([c[0] for c in calls])),
+        f"{name}_other_calls": float(np.mean([c[1] for c in calls])),
+    }
+
+
+def time_training(work_dir, data_dir):
+    """Runs one epoch of train_lstm.py on the synthetic reports. Returns the seconds, or None when it cannot run."""
+    try:
+        import tensorflow  # noqa: F401
+        import pandas  # noqa: F401
+    except ImportError:
+        return None
+    model_dir = os.path.join(work_dir, "train_model")
+    start = time.perf_counter()
+    subprocess.run([sys.executable, os.path.join(TRAINING_DIR, "train_lstm.py"), "--data", data_dir,
+                    "--epochs", "1", "--model-dir", model_dir], check=True, capture_output=True)
+    return time.perf_counter() - start
+
+
+def run(args):
+    work_dir = tempfile.mkdtemp(prefix="clemap_lambda_bench_")
+    results = {}
+    with mock_aws():
+        # Importes sous moto : les clients des modules pointent vers le S3 et le SageMaker simules
+        import lambda_function
+        import lambda_function_2
+
+        greengrass = lambda_function.gg_clemap = FakeGreengrassV2(lambda_function.gg_clemap.meta.region_name)
+        s3_client = lambda_function.s3_client
+        s3_client.create_bucket(Bucket=BUCKET)
+        with open(os.path.join(TRAINING_DIR, "model_artifact.py"), "rb") as f:
+            s3_client.put_object(Bucket=BUCKET, Key=lambda_function.APPLY_SCRIPT_KEY, Body=f.read())
+        data_dir = os.path.join(work_dir, "data")
+        os.makedirs(data_dir)
+        for i in range(args.data_files):
+            body = make_report_csv(args.rows, i)
+            with open(os.path.join(data_dir, f"Clemap_train_{i}.csv.gz"), "wb") as f:
+                f.write(body)
+            s3_client.put_object(Bucket=BUCKET, Key=f"data/Clemap_train_{i}.csv.gz", Body=body)
+
+        s3_counter = CallCounter(s3_client, "s3")
+        launcher_s3 = CallCounter(lambda_function_2.s3_client, "s3")
+        sagemaker = CallCounter(lambda_function_2.sagemaker_client, "sagemaker")
+        launches, launch_calls = [], []
+        deploys, deploy_calls = [], []
+        redeploys, redeploy_calls = [], []
+        rejects, reject_calls = [], []
+        greengrass_calls = lambda: sum(greengrass.calls.values())
+        for job in range(args.deployments):
+            _, elapsed, calls = invoke(lambda_function_2.lambda_handler, {}, [launcher_s3, sagemaker], args.verbose)
+            launches.append(elapsed)
+            launch_calls.append(calls)
+
+            key = f"output/lstm-training-job-{job}/output/model.tar.gz"
+            # Chaque job fait un peu mieux que le precedent sur le holdout
+            s3_client.put_object(Bucket=BUCKET, Key=key, Body=make_model_tar(work_dir, job, 0.01 / (job + 1)))
+            before = greengrass_calls()
+            response, elapsed, calls = invoke(lambda_function.lambda_handler, s3_event(key), [s3_counter], args.verbose)
+            deploys.append(elapsed)
+            deploy_calls.append(calls + [greengrass_calls() - before])
+            assert "Deployed" in response["body"], response
+
+            before = greengrass_calls()
+            response, elapsed, calls = invoke(lambda_function.lambda_handler, s3_event(key), [s3_counter], args.verbose)
+            redeploys.append(elapsed)
+            redeploy_calls.append(calls + [greengrass_calls() - before])
+            assert "Already deployed" in response["body"], response
+
+            key = f"output/lstm-training-job-{job}-worse/output/model.tar.gz"
+            s3_client.put_object(Bucket=BUCKET, Key=key, Body=make_model_tar(work_dir, args.deployments + job, 1.0))
+            before = greengrass_calls()
+            response, elapsed, calls = invoke(lambda_function.lambda_handler, s3_event(key), [s3_counter], args.verbose)
+            rejects.append(elapsed)
+            reject_calls.append(calls + [greengrass_calls() - before])
+            assert "Rejected" in response["body"], response
+
+        results.update(summary("launch", launches, launch_calls))
+        results.update(summary("deploy", deploys, deploy_calls))
+        results.update(summary("redeploy", redeploys, redeploy_calls))
+        results.update(summary("reject", rejects, reject_calls))
+        results["component_versions"] = len(greengrass.components.get("com.example.clemapModel", {}))
+        results["output_objects"] = len(lambda_function.list_output_objects(BUCKET))
+
+    results["train_epoch_s"] = time_training(work_dir, data_dir) if args.train else None
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Returns the regressions of ``results`` against ``baseline`` beyond ``tolerance`` (a fraction)."""
+    regressions = []
+    for key, direction in REGRESSION_KEYS.items():
+        old, new = baseline.get(key), results.get(key)
+        if not old or new is None:
+            continue
+        if direction * (new - old) / old > tolerance:
+            regressions.append(f"{key}: {old:.3f} -> {new:.3f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--deployments", type=int, default=5, help="Simulated training jobs to deploy")
+    parser.add_argument("--data-files", type=int, default=20, help="Retrain reports already in data/")
+    parser.add_argument("--rows", type=int, default=2000, help="Rows per retrain report")
+    parser.add_argument("--artifact-delta", action="store_true", help="Publish deltas (ARTIFACT_DELTA=1)")
+    parser.add_argument("--train", action="store_true", help="Also time one epoch of train_lstm.py")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of the handlers")
+    parser.add_argument("--save", default=None, help="Write the results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="JSON results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    # Lus a l'import des Lambdas : pas d'attente de regroupement, deltas si demandes
+    os.environ["COALESCE_WINDOW"] = "0"
+    os.environ["ARTIFACT_DELTA"] = "1" if args.artifact_delta else "0"
+    sys.path.insert(0, TRAINING_DIR)
+    results = run(args)
+
+    print(f"\n{args.deployments} training cycles, {args.data_files} reports of {args.rows} rows in data/")
+    print(f"{'handler':<10} {'calls':>6} {'p50 ms':>8} {'max ms':>8} {'s3':>5} {'other':>6}")
+    for name, label in (("launch", "sagemaker"), ("deploy", "greengrass"), ("redeploy", "greengrass"),
+                        ("reject", "greengrass")):
+        print(f"{name:<10} {results[f'{name}_count']:>6} {results[f'{name}_p50_ms']:>8.1f} "
+              f"{results[f'{name}_max_ms']:>8.1f} {results[f'{name}_s3_calls']:>5.1f} "
+              f"{results[f'{name}_other_calls']:>6.1f}  ({label})")
+    print(f"{results['component_versions']} component versions, {results['output_objects']} objects left in output/")
+    if args.train:
+        train = results["train_epoch_s"]
+        print("train_lstm.py: skipped, TensorFlow or pandas missing" if train is None
+              else f"train_lstm.py: one epoch in {train:.1f} s")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        raise SystemExit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
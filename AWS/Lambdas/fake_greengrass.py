@@ -0,0 +1,106 @@
+"""
+In-process stand-in for the ``greengrassv2`` boto3 client.
+
+moto has no Greengrass V2 backend. ``FakeGreengrassV2`` implements the calls
+made by the deployment Lambda (component versions, recipes, deployments of
+a thing group) on in-memory dictionaries, raises the real client's
+``ResourceNotFoundException``, and counts its calls so a benchmark can
+check how many Greengrass requests an invocation makes.
+"""
+
+import itertools
+import json
+import time
+from datetime import datetime, timezone
+
+import boto3
+
+
+class _Paginator:
+    def __init__(self, method):
+        self.method = method
+
+    def paginate(self, **kwargs):
+        yield self.method(**kwargs)
+
+
+class FakeGreengrassV2:
+    def __init__(self, region_name="us-east-1", latency=0.0):
+        # Client reel jamais appele : region et classes d'exceptions identiques a celles du Lambda
+        real = boto3.client("greengrassv2", region_name=region_name)
+        self.meta = real.meta
+        self.exceptions = real.exceptions
+        self.latency = latency
+        self.components = {}
+        self.deployments = []
+        self.calls = {}
+        self._ids = itertools.count(1)
+
+    def _call(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _not_found(self, operation, message):
+        error = {"Error": {"Code": "ResourceNotFoundException", "Message": message}}
+        return self.exceptions.ResourceNotFoundException(error, operation)
+
+    def get_paginator(self, operation_name):
+        if operation_name != "list_component_versions":
+            raise NotImplementedError(operation_name)
+        return _Paginator(self.list_component_versions)
+
+    def create_component_version(self, inlineRecipe):
+        self._call("create_component_version")
+        recipe = json.loads(inlineRecipe)
+        versions = self.components.setdefault(recipe["ComponentName"], {})
+        version = recipe["ComponentVersion"]
+        if version in versions:
+            raise self.exceptions.ConflictException(
+                {"Error": {"Code": "ConflictException", "Message": f"{version} already exists"}},
+                "CreateComponentVersion")
+        versions[version] = inlineRecipe
+        return {"componentName": recipe["ComponentName"], "componentVersion": version}
+
+    def list_component_versions(self, arn, **kwargs):
+        self._call("list_component_versions")
+        name = arn.rsplit(":", 1)[-1]
+        if name not in self.components:
+            raise self._not_found("ListComponentVersions", f"Component {name} not found")
+        return {"componentVersions": [{"componentName": name, "componentVersion": version}
+                                      for version in self.components[name]]}
+
+    def get_component(self, arn, recipeOutputFormat="JSON"):
+        self._call("get_component")
+        component_arn, _, version = arn.rpartition(":versions:")
+        recipe = self.components.get(component_arn.rsplit(":", 1)[-1], {}).get(version)
+        if recipe is None:
+            raise self._not_found("GetComponent", f"{arn} not found")
+        return {"recipeOutputFormat": recipeOutputFormat, "recipe": recipe.encode("utf-8")}
+
+    def create_deployment(self, targetArn, components, deploymentName=None, **kwargs):
+        self._call("create_deployment")
+        deployment = {
+            "deploymentId": f"deployment-{next(self._ids)}",
+            "targetArn": targetArn,
+            "deploymentName": deploymentName,
+            "components": components,
+            "creationTimestamp": datetime.now(timezone.utc),
+        }
+        self.deployments.append(deployment)
+        return {"deploymentId": deployment["deploymentId"]}
+
+    def list_deployments(self, targetArn=None, historyFilter="ALL", **kwargs):
+        self._call("list_deployments")
+        deployments = [d for d in self.deployments if targetArn is None or d["targetArn"] == targetArn]
+        if historyFilter == "LATEST_ONLY" and deployments:
+            deployments = deployments[-1:]
+        return {"deployments": [{k: d[k] for k in ("deploymentId", "targetArn", "creationTimestamp")}
+                                for d in deployments]}
+
+    def get_deployment(self, deploymentId):
+        self._call("get_deployment")
+        for deployment in self.deployments:
+            if deployment["deploymentId"] == deploymentId:
+                return dict(deployment)
+        raise self._not_found("GetDeployment", f"Deployment {deploymentId} not found")
@@ -2,15 +2,66 @@
 # SPDX-License-Identifier: Apache-2.0
 import json
 import urllib.parse
+import base64
 import boto3
+import gzip
 import hashlib
+import os
+import struct
+import tarfile
 import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 
 print('Loading function')
 
+# Clients crees une seule fois par environnement d'execution : reutilises (connexions comprises) d'une invocation a l'autre
 gg_clemap = boto3.client('greengrassv2')
 s3_client = boto3.client('s3')
 
+ACCOUNT_ID = '060795903373'
+THING_GROUP_ARN = f"arn:aws:iot:{gg_clemap.meta.region_name}:{ACCOUNT_ID}:thinggroup/ClemapDummyGroup"
+
+# Les modeles publies a moins de COALESCE_WINDOW s d'intervalle donnent un seul deploiement. L'attente se fait
+# dans le handler (time.sleep) : a n'activer qu'avec un timeout du Lambda superieur a la fenetre (0 : pas d'attente)
+COALESCE_WINDOW = float(os.environ.get('COALESCE_WINDOW', '0'))
+
+# Derniere version connue de chaque composant, gardee entre invocations : {nom: (version, instant de lecture)}
+VERSION_CACHE_TTL = float(os.environ.get('VERSION_CACHE_TTL', '300'))
+_component_versions = {}
+
+# Taille des morceaux lus depuis S3 pour le calcul du SHA-256
+DIGEST_CHUNK_SIZE = 1024 * 1024
+
+# Nettoyage de output/ : nombre de model.tar.gz gardes (le nouveau compris) pour pouvoir revenir en arriere
+OUTPUT_PREFIX = 'output/'
+MODEL_RETENTION = int(os.environ.get('MODEL_RETENTION', '3'))
+DELETE_BATCH_SIZE = 1000  # Maximum accepte par delete_objects
+CLEANUP_WORKERS = int(os.environ.get('CLEANUP_WORKERS', '8'))
+
+# Artefact envoye aux devices : 'pack' publie le model.pack (poids float16/int8) ecrit par train_lstm.py
+# quand il est dans model.tar.gz, 'tar' publie toujours model.tar.gz
+ARTIFACT_FORMAT = os.environ.get('ARTIFACT_FORMAT', 'pack')
+# Delta contre le pack deploye : a n'activer que si tous les devices du groupe ont la version deployee
+ARTIFACT_DELTA = os.environ.get('ARTIFACT_DELTA', '0') == '1'
+PACK_NAME = 'model.pack.gz'
+DELTA_NAME = 'model.delta.gz'
+# Script d'installation cote device (AWS/Training/model_artifact.py), a deposer avec train_lstm.py
+APPLY_SCRIPT_KEY = 'scripts/model_artifact.py'
+# Format des packs, voir model_artifact.py
+PACK_MAGIC = b'CLMPACK1'
+DELTA_MAGIC = b'CLMDELT1'
+
+# Porte d'evaluation : un modele n'est deploye que si sa MSE sur le holdout (evaluation.json ecrit par train_lstm.py)
+# est plus basse que celle du modele deploye, gardee dans sa recette
+EVALUATION_GATE = os.environ.get('EVALUATION_GATE', '1') == '1'
+# Baisse relative de MSE exigee (0 : strictement meilleur)
+MIN_IMPROVEMENT = float(os.environ.get('MIN_IMPROVEMENT', '0'))
+EVALUATION_NAME = 'evaluation.json'
+# Candidats refuses, sortis de output/ pour ne servir ni de base de fine-tuning ni de retour arriere
+REJECTED_PREFIX = 'rejected/'
+
 def lambda_handler(event, context):
     #print("Received event: " + json.dumps(event, indent=2))
 
@@ -22,99 +73,221 @@ def lambda_handler(event, context):
     key = urllib.parse.unquote_plus(event['Records'][0]['s3']['object']['key'], encoding='utf-8')
     print(f"Event triggered from : {bucket}")
     print(f"Key of the triggered event : {key}")
+    if not key.endswith('model.tar.gz'):
+        # Les packs publies par cette fonction dans output/ ne sont pas des modeles a deployer
+        print(f"Ignoring {key}: not a model.tar.gz")
+        return {'statusCode': 200, 'body': json.dumps(f'Ignored {key}')}
     try:
-        response = s3_client.get_object(Bucket=bucket, Key=key)
-        print("CONTENT TYPE: " + response['ContentType'])
-        print(bucket,key)
-        # Create a reusable Paginator
-        paginator = s3_client.get_paginator('list_objects_v2')
-        operation_parameters = {'Bucket': bucket,
-                        'Prefix': 'output'}
-        # Create a PageIterator from the Paginator
-        page_iterator = paginator.paginate(**operation_parameters)
-        
-        for page in page_iterator:
-            #print(page['Contents'])
-            for entry in page['Contents']:
-                if (key != entry['Key']) :
-                    response2 = s3_client.delete_object(Bucket=bucket,Key=entry['Key'])
-                    print(f"Bucket key : {entry['Key']} deleted")
-        # Component configuration
-        component_name = 'com.example.clemapModel'
-        # Get current component version
-        current_version = get_current_component_version(component_name)
-        new_version = increment_version(current_version)
-        print(f"Incrementing version from : {current_version} -> {new_version}")
-
-        # Calculate the digest of the new artifact
-        artifact_digest = calculate_s3_file_digest(bucket, key)
-        print(f"New calculated digest : {artifact_digest}")
-
-        # Update the recipe
-        updated_recipe = update_recipe_with_new_digest(component_name, new_version, artifact_digest, bucket, key)
-        
-        # Register the new component version
-        register_new_component_version(updated_recipe)
-        response = gg_clemap.create_deployment(
-        targetArn = 'arn:aws:iot:us-east-1:060795903373:thinggroup/ClemapDummyGroup',
-        deploymentName = 'DeploymentFromLambda',
-        components = {
-            'com.example.clemapModel': {
-                'componentVersion': new_version
-                },
-            'aws.greengrass.Cli': {
-                'componentVersion': '2.13.0'
-                },
-            'aws.greengrass.DockerApplicationManager': {
-                'componentVersion': '2.0.12'
-                },
-            'aws.greengrass.LambdaLauncher': {
-                'componentVersion': '2.0.13'
-                },
-            'aws.greengrass.LambdaManager': {
-                'componentVersion': '2.3.4'
-                },
-            'aws.greengrass.LambdaRuntimes': {
-                'componentVersion': '2.0.8'},
-            'aws.greengrass.LogManager': {
-                'componentVersion': '2.3.8'},
-            'aws.greengrass.Nucleus': {
-                'componentVersion': '2.13.0'},
-            'aws.greengrass.ShadowManager': {
-                'componentVersion': '2.3.9'},
-            'aws.greengrass.StreamManager': {
-                'componentVersion': '2.1.13'},
-            'aws.greengrass.TokenExchangeService': {
-                'componentVersion': '2.0.3'},
-            'aws.greengrass.clientdevices.IPDetector': {
-                'componentVersion': '2.2.0'},
-            'com.example.HelloWorld': {
-                'componentVersion': '1.0.22'}
-            },
-            iotJobConfiguration = {},
-            deploymentPolicies = {
-                'failureHandlingPolicy': 'ROLLBACK',
-                'componentUpdatePolicy': {'timeoutInSeconds': 60, 'action': 'NOTIFY_COMPONENTS'
-                }
-            }
-        )
+        return deploy_model(bucket, key)
     except Exception as e:
         print(e)
         print('Error getting object {} from bucket {}. Make sure they exist and your bucket is in the same region as this function.'.format(key, bucket))
         raise e
 
 
-def get_current_component_version(component_name):
-    """Fetches the current version of the component from the Greengrass catalog."""
+def deploy_model(bucket, key, coalesce=True):
+    """Deploys the model.tar.gz at `key` unless a newer one supersedes it or the evaluation gate rejects it."""
+    # Un seul get_object par invocation : type de contenu, checksum S3 et corps pour le digest
+    artifact = s3_client.get_object(Bucket=bucket, Key=key, ChecksumMode='ENABLED')
+    print("CONTENT TYPE: " + artifact['ContentType'])
+    print(bucket,key)
+
+    # Calculate the digest of the new artifact
+    # Avant les suppressions : la connexion du get_object n'a pas a rester ouverte
+    evaluation = None
+    if ARTIFACT_FORMAT == 'pack' or EVALUATION_GATE:
+        artifact_digest, pack, evaluation = read_model_tar(artifact)
+        pack = pack if ARTIFACT_FORMAT == 'pack' else None
+    else:
+        artifact_digest, pack = calculate_s3_file_digest(bucket, key, artifact), None
+    print(f"New calculated digest : {artifact_digest}")
+    model_digest = artifact_digest
+    if pack is not None:
+        # gzip sans horodatage : le meme modele donne toujours le meme digest
+        pack_gz = gzip.compress(pack, mtime=0)
+        model_digest = hashlib.sha256(pack_gz).hexdigest()
+        print(f"Model pack : {len(pack_gz)} bytes, digest {model_digest}")
+
+    # Component configuration
+    component_name = 'com.example.clemapModel'
+
+    # Rafale d'evenements : seul le modele le plus recent de la fenetre est deploye
+    newer = wait_for_newer_artifact(bucket, key, artifact['LastModified']) if coalesce else None
+    if newer is not None:
+        print(f"Skipping deployment: superseded by {newer}")
+        return {'statusCode': 200, 'body': json.dumps(f'Superseded by {newer}')}
+
+    # Deployment currently targeting the thing group, whose component set is kept
+    deployment = get_current_deployment()
+    components = dict(deployment['components']) if deployment else {}
+    deployed_version = components.get(component_name, {}).get('componentVersion')
+    deployed_recipe = get_component_recipe(component_name, deployed_version) if deployed_version else None
+    if deployed_recipe and recipe_model_digest(deployed_recipe) == model_digest:
+        print(f"Skipping deployment: {component_name} {deployed_version} already has digest {model_digest}")
+        return {'statusCode': 200, 'body': json.dumps(f'Already deployed: {deployed_version}')}
+
+    # Un reentrainement rate ne doit atteindre aucun device (sa derive relancerait un entrainement)
+    rejection = evaluation_gate(evaluation, deployed_recipe) if EVALUATION_GATE else None
+    if rejection:
+        rejected_key = reject_candidate(bucket, key)
+        print(f"Skipping deployment: {rejection}, moved to {rejected_key}")
+        # Les modeles plus anciens de la rafale ont ete ignores au profit de celui-ci : le plus recent est essaye
+        fallback = superseded_candidate(bucket, artifact['LastModified'], deployed_recipe)
+        if fallback is not None:
+            print(f"Trying {fallback}, superseded by the rejected model")
+            return deploy_model(bucket, fallback, coalesce=False)
+        return {'statusCode': 200, 'body': json.dumps(f'Rejected: {rejection}')}
+
+    # Remove old training outputs, keeping the last MODEL_RETENTION models
+    cleanup_old_outputs(bucket, key)
+
+    # Publish the compact artifact next to model.tar.gz (full pack, or delta against the deployed one)
+    pack_key = None
+    if pack is not None:
+        pack_key, artifact_key, artifact_digest = publish_pack(bucket, key, pack, pack_gz, deployed_recipe)
+    else:
+        artifact_key = key
+    # Get current component version
+    current_version = get_current_component_version(component_name)
+    new_version = increment_version(current_version)
+    print(f"Incrementing version from : {current_version} -> {new_version}")
+
+    # Update the recipe
+    updated_recipe = update_recipe_with_new_digest(component_name, new_version, artifact_digest, bucket, artifact_key,
+                                                   model_digest, pack_key, evaluation)
+
+    # Register the new component version
+    if not register_new_component_version(updated_recipe):
+        # Version en cache perimee (publiee ailleurs entre-temps) : on relit le catalogue et on reessaie une fois
+        current_version = get_current_component_version(component_name, max_age=0)
+        new_version = increment_version(current_version)
+        print(f"Retrying with version : {current_version} -> {new_version}")
+        updated_recipe = update_recipe_with_new_digest(component_name, new_version, artifact_digest, bucket, artifact_key,
+                                                       model_digest, pack_key, evaluation)
+        if not register_new_component_version(updated_recipe):
+            raise RuntimeError(f"Unable to register {component_name} {new_version}")
+    remember_component_version(component_name, new_version)
+
+    # Seule la version du modele change ; les autres composants restent ceux du deploiement en cours
+    components[component_name] = {'componentVersion': new_version}
+    response = gg_clemap.create_deployment(
+        targetArn=THING_GROUP_ARN,
+        deploymentName='DeploymentFromLambda',
+        components=components,
+        iotJobConfiguration={},
+        deploymentPolicies={
+            'failureHandlingPolicy': 'ROLLBACK',
+            'componentUpdatePolicy': {'timeoutInSeconds': 60, 'action': 'NOTIFY_COMPONENTS'}
+        }
+    )
+    print(f"Deployment {response['deploymentId']} created with {component_name} {new_version}")
+    return {'statusCode': 200, 'body': json.dumps(f"Deployed {component_name} {new_version}")}
+
+
+def wait_for_newer_artifact(bucket_name, key, last_modified, window=COALESCE_WINDOW, prefix=OUTPUT_PREFIX):
+    """Waits until `key` is `window` s old, then returns the key of a newer model.tar.gz, or None."""
+    age = (datetime.now(timezone.utc) - last_modified).total_seconds()
+    if age < window:
+        time.sleep(window - age)
+    newer = [obj for obj in list_output_objects(bucket_name, prefix)
+             if obj['Key'].endswith('model.tar.gz') and obj['Key'] != key and obj['LastModified'] > last_modified]
+    return max(newer, key=lambda obj: obj['LastModified'])['Key'] if newer else None
+
+
+def recipe_model_directory(recipe):
+    """Directory of output/ holding the model deployed by a recipe (its pack, or its artifact), or None."""
+    key = recipe_configuration(recipe).get('packKey')
+    if not key:
+        uri = next((a.get('Uri', '') for m in recipe.get('Manifests', []) for a in m.get('Artifacts', [])), '')
+        key = uri.split('/', 3)[3] if uri.startswith('s3://') and uri.count('/') >= 3 else None
+    return os.path.dirname(key) if key else None
+
+
+def superseded_candidate(bucket_name, last_modified, deployed_recipe=None, prefix=OUTPUT_PREFIX):
+    """Newest model.tar.gz older than `last_modified` but newer than the deployed model, or None."""
+    models = [obj for obj in list_output_objects(bucket_name, prefix) if obj['Key'].endswith('model.tar.gz')]
+    deployed_directory = recipe_model_directory(deployed_recipe) if deployed_recipe else None
+    floor = max((obj['LastModified'] for obj in models if os.path.dirname(obj['Key']) == deployed_directory),
+                default=None)
+    older = [obj for obj in models
+             if obj['LastModified'] < last_modified and (floor is None or obj['LastModified'] > floor)]
+    return max(older, key=lambda obj: obj['LastModified'])['Key'] if older else None
+
+
+def get_current_deployment(target_arn=THING_GROUP_ARN):
+    """Returns the latest deployment of the thing group (with its components), or None."""
+    response = gg_clemap.list_deployments(targetArn=target_arn, historyFilter='LATEST_ONLY')
+    deployments = response.get('deployments', [])
+    if not deployments:
+        return None
+    latest = max(deployments, key=lambda d: d['creationTimestamp'])
+    return gg_clemap.get_deployment(deploymentId=latest['deploymentId'])
+
+
+def get_component_recipe(component_name, version):
+    """Returns the recipe of a registered component version, or None."""
     try:
-        response = gg_clemap.list_components()
-        for component in response['components']:
-            if component['componentName'] == component_name:
-                print(component['latestVersion']['componentVersion'])
-                return component['latestVersion']['componentVersion']
-    except Exception as e:
-        print(f"Error fetching component version: {e}")
+        response = gg_clemap.get_component(arn=f"{component_arn(component_name)}:versions:{version}",
+                                           recipeOutputFormat='JSON')
+    except gg_clemap.exceptions.ResourceNotFoundException:
+        return None
+    return json.loads(response['recipe'])
+
+
+def recipe_configuration(recipe):
+    return recipe.get('ComponentConfiguration', {}).get('DefaultConfiguration', {})
+
+
+def recipe_model_digest(recipe):
+    """Digest of the model deployed by a recipe: its modelDigest, or the digest of its first artifact."""
+    digest = recipe_configuration(recipe).get('modelDigest')
+    if digest:
+        return digest
+    for manifest in recipe.get('Manifests', []):
+        for artifact in manifest.get('Artifacts', []):
+            return artifact.get('Digest')
+    return None
+
+
+def component_arn(component_name):
+    region = gg_clemap.meta.region_name
+    return f"arn:aws:greengrass:{region}:{ACCOUNT_ID}:components:{component_name}"
+
+
+def get_current_component_version(component_name, max_age=VERSION_CACHE_TTL):
+    """Returns the latest version of the component, from the cache if it was read less than `max_age` s ago."""
+    cached = _component_versions.get(component_name)
+    if cached is not None and time.monotonic() - cached[1] < max_age:
+        print(f"Cached component version : {cached[0]}")
+        return cached[0]
+    version = fetch_latest_component_version(component_name)
+    remember_component_version(component_name, version)
+    print(version)
+    return version
+
+
+def remember_component_version(component_name, version):
+    _component_versions[component_name] = (version, time.monotonic())
+
+
+def fetch_latest_component_version(component_name):
+    """Reads every version of the component from the Greengrass catalog and returns the highest one."""
+    paginator = gg_clemap.get_paginator('list_component_versions')
+    versions = []
+    try:
+        for page in paginator.paginate(arn=component_arn(component_name)):
+            versions.extend(v['componentVersion'] for v in page.get('componentVersions', []))
+    except gg_clemap.exceptions.ResourceNotFoundException:
+        pass
+    if not versions:
+        # Composant jamais publie : la premiere version sera 0.0.1
         return '0.0.0'
+    return max(versions, key=version_key)
+
+
+def version_key(version):
+    return tuple(int(part) for part in version.split('.'))
+
 
 def increment_version(version):
     """Increments a semantic version string (e.g., 1.0.3 -> 1.0.4)."""
@@ -122,21 +295,239 @@ def increment_version(version):
     return f"{major}.{minor}.{patch + 1}"
 
 
-def calculate_s3_file_digest(bucket_name, key):
-    """Calculates the SHA-256 digest of an S3 object."""
-    response = s3_client.get_object(Bucket=bucket_name, Key=key)
-    file_data = response['Body'].read()
-    return hashlib.sha256(file_data).hexdigest()
+def list_output_objects(bucket_name, prefix=OUTPUT_PREFIX):
+    """Lists every object under the training output prefix."""
+    paginator = s3_client.get_paginator('list_objects_v2')
+    objects = []
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        # Une page vide n'a pas de 'Contents'
+        objects.extend(page.get('Contents', []))
+    return objects
+
+
+def select_retained_keys(objects, current_key, keep=MODEL_RETENTION):
+    """Returns the keys to keep: the current artifact and the most recent other model.tar.gz (`keep` in total)."""
+    models = sorted(
+        (obj for obj in objects if obj['Key'].endswith('model.tar.gz') and obj['Key'] != current_key),
+        key=lambda obj: obj['LastModified'], reverse=True,
+    )
+    retained = {current_key} | {obj['Key'] for obj in models[:max(keep - 1, 0)]}
+    # Les packs et deltas publies a cote d'un modele garde sont gardes avec lui
+    directories = {os.path.dirname(k) for k in retained}
+    return retained | {
+        obj['Key'] for obj in objects
+        if os.path.dirname(obj['Key']) in directories and os.path.basename(obj['Key']) in (PACK_NAME, DELTA_NAME)
+    }
+
+
+def delete_keys(bucket_name, keys):
+    """Deletes up to DELETE_BATCH_SIZE keys in one request. Returns the number of keys deleted."""
+    response = s3_client.delete_objects(
+        Bucket=bucket_name,
+        Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True},
+    )
+    errors = response.get('Errors', [])
+    for error in errors:
+        print(f"Unable to delete {error['Key']}: {error.get('Code')} {error.get('Message')}")
+    return len(keys) - len(errors)
+
+
+def cleanup_old_outputs(bucket_name, current_key, keep=MODEL_RETENTION, prefix=OUTPUT_PREFIX):
+    """Deletes the training outputs except the retained models, in parallel batches of delete_objects."""
+    objects = list_output_objects(bucket_name, prefix)
+    retained = select_retained_keys(objects, current_key, keep)
+    to_delete = [obj['Key'] for obj in objects if obj['Key'] not in retained]
+    print(f"Keeping {sorted(retained)}, deleting {len(to_delete)} of {len(objects)} objects under {prefix}")
+    if not to_delete:
+        return 0
+    batches = [to_delete[i:i + DELETE_BATCH_SIZE] for i in range(0, len(to_delete), DELETE_BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=min(CLEANUP_WORKERS, len(batches))) as pool:
+        deleted = sum(pool.map(lambda batch: delete_keys(bucket_name, batch), batches))
+    print(f"Deleted {deleted} objects in {len(batches)} delete_objects calls")
+    return deleted
+
+
+def calculate_s3_file_digest(bucket_name, key, response=None):
+    """Calculates the SHA-256 digest of an S3 object, reusing the checksum stored by S3 when there is one."""
+    if response is None:
+        response = s3_client.get_object(Bucket=bucket_name, Key=key, ChecksumMode='ENABLED')
+    digest = stored_sha256(response)
+    if digest is not None:
+        response['Body'].close()
+        print("Reusing the SHA-256 checksum stored by S3")
+        return digest
+    # Lecture par morceaux : la memoire reste constante quelle que soit la taille du modele
+    sha256 = hashlib.sha256()
+    for chunk in response['Body'].iter_chunks(chunk_size=DIGEST_CHUNK_SIZE):
+        sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def stored_sha256(response):
+    """Returns the hex SHA-256 of the whole object from a get/head_object response, or None."""
+    checksum = response.get('ChecksumSHA256')
+    # Upload multipart : checksum composite "<base64>-<parts>", ce n'est pas le SHA-256 du fichier
+    if not checksum or '-' in checksum or response.get('ChecksumType', 'FULL_OBJECT') != 'FULL_OBJECT':
+        return None
+    return base64.b64decode(checksum).hex()
 
 
-def update_recipe_with_new_digest(component_name, new_version, artifact_digest, bucket_name, artifact_key):
+class _HashingReader:
+    """File-like wrapper hashing what tarfile reads from the S3 body."""
+
+    def __init__(self, body):
+        self.body = body
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.body.read(size)
+        self.sha256.update(data)
+        return data
+
+
+def read_model_tar(response):
+    """Reads model.tar.gz once: returns (SHA-256 of the tar.gz, its model.pack or None, its evaluation.json or None)."""
+    reader = _HashingReader(response['Body'])
+    pack = evaluation = None
+    with tarfile.open(fileobj=reader, mode='r|gz') as tar:
+        for member in tar:
+            if member.isfile() and os.path.basename(member.name) == 'model.pack':
+                pack = tar.extractfile(member).read()
+            elif member.isfile() and os.path.basename(member.name) == EVALUATION_NAME:
+                evaluation = json.loads(tar.extractfile(member).read())
+    # Fin du flux (remplissage tar/gzip) : le digest couvre tout l'objet
+    while reader.read(DIGEST_CHUNK_SIZE):
+        pass
+    return reader.sha256.hexdigest(), pack, evaluation
+
+
+def deployed_holdout_mse(evaluation, deployed_recipe):
+    """MSE of the deployed model on the candidate's holdout: cached in its recipe, else scored by the training job."""
+    configuration = recipe_configuration(deployed_recipe) if deployed_recipe else {}
+    if configuration.get('holdoutDigest') == evaluation.get('holdout_digest'):
+        return configuration.get('holdoutMse')
+    # Holdout renouvele depuis le deploiement : le job a aussi evalue le modele deploye sur le nouveau
+    return (evaluation.get('baseline') or {}).get('mse')
+
+
+def evaluation_gate(evaluation, deployed_recipe):
+    """Returns why the candidate must not be deployed, or None if it may be."""
+    if evaluation is None:
+        if deployed_recipe and recipe_configuration(deployed_recipe).get('holdoutDigest'):
+            return f"no {EVALUATION_NAME} while the deployed model was evaluated"
+        # Pas encore de holdout (aucun rapport que le modele deploye n'a pas vu) : rien a comparer
+        print(f"No {EVALUATION_NAME} in the model, deploying without evaluation")
+        return None
+    mse = evaluation['candidate'].get('mse')
+    if mse is None:
+        return "non-finite holdout MSE"
+    reference = deployed_holdout_mse(evaluation, deployed_recipe)
+    print(f"Holdout MSE over {evaluation.get('holdout_windows')} windows: candidate {mse:.6g}, deployed {reference}")
+    if reference is not None and mse >= reference * (1 - MIN_IMPROVEMENT):
+        return f"holdout MSE {mse:.6g} not better than {reference:.6g} for the deployed model"
+    return None
+
+
+def reject_candidate(bucket_name, key):
+    """Moves a rejected model.tar.gz to rejected/, keeping the MODEL_RETENTION most recent there. Returns its key."""
+    rejected_key = REJECTED_PREFIX + key[len(OUTPUT_PREFIX):] if key.startswith(OUTPUT_PREFIX) else REJECTED_PREFIX + key
+    s3_client.copy_object(Bucket=bucket_name, Key=rejected_key, CopySource={'Bucket': bucket_name, 'Key': key})
+    s3_client.delete_object(Bucket=bucket_name, Key=key)
+    cleanup_old_outputs(bucket_name, rejected_key, prefix=REJECTED_PREFIX)
+    return rejected_key
+
+
+def _split_pack(data):
+    (length,) = struct.unpack_from('<I', data, len(PACK_MAGIC))
+    start = len(PACK_MAGIC) + 4
+    return json.loads(data[start:start + length]), data[start:start + length], data[start + length:]
+
+
+def make_pack_delta(base, target):
+    """Same delta as model_artifact.make_delta (XOR of the weights), without NumPy. None if the layouts differ."""
+    if base[:len(PACK_MAGIC)] != PACK_MAGIC or target[:len(PACK_MAGIC)] != PACK_MAGIC:
+        return None
+    base_header, _, base_payload = _split_pack(base)
+    target_header, target_header_bytes, target_payload = _split_pack(target)
+    if len(base_payload) != len(target_payload) or base_header['dtype'] != target_header['dtype']:
+        return None
+    xor = int.from_bytes(base_payload, 'little') ^ int.from_bytes(target_payload, 'little')
+    meta = json.dumps({
+        'base_sha256': hashlib.sha256(base).hexdigest(),
+        'target_sha256': hashlib.sha256(target).hexdigest(),
+        'header': target_header_bytes.decode('utf-8'),
+    }).encode('utf-8')
+    return DELTA_MAGIC + struct.pack('<I', len(meta)) + meta + xor.to_bytes(len(target_payload), 'little')
+
+
+def publish_pack(bucket_name, key, pack, pack_gz, deployed_recipe=None):
+    """Uploads model.pack.gz (and model.delta.gz if smaller). Returns (pack_key, artifact_key, artifact_digest)."""
+    directory = os.path.dirname(key)
+    pack_key = f"{directory}/{PACK_NAME}"
+    s3_client.put_object(Bucket=bucket_name, Key=pack_key, Body=pack_gz, ContentType='application/gzip')
+    artifact_key, artifact_digest = pack_key, hashlib.sha256(pack_gz).hexdigest()
+    base_key = recipe_configuration(deployed_recipe).get('packKey') if deployed_recipe else None
+    if ARTIFACT_DELTA and base_key and base_key != pack_key:
+        try:
+            base = gzip.decompress(s3_client.get_object(Bucket=bucket_name, Key=base_key)['Body'].read())
+            delta = make_pack_delta(base, pack)
+        except Exception as e:
+            print(f"No delta against {base_key}: {e}")
+            delta = None
+        delta_gz = gzip.compress(delta, mtime=0) if delta is not None else None
+        if delta_gz is not None and len(delta_gz) < len(pack_gz):
+            artifact_key = f"{directory}/{DELTA_NAME}"
+            s3_client.put_object(Bucket=bucket_name, Key=artifact_key, Body=delta_gz, ContentType='application/gzip')
+            artifact_digest = hashlib.sha256(delta_gz).hexdigest()
+            print(f"Publishing delta against {base_key} : {len(delta_gz)} bytes instead of {len(pack_gz)}")
+    print(f"Published s3://{bucket_name}/{artifact_key}")
+    return pack_key, artifact_key, artifact_digest
+
+
+def update_recipe_with_new_digest(component_name, new_version, artifact_digest, bucket_name, artifact_key,
+                                  model_digest=None, pack_key=None, evaluation=None):
     """Creates an updated recipe with the new digest and artifact version."""
+    artifact_name = os.path.basename(artifact_key)
+    artifacts = [
+        {
+            "Uri": f"s3://{bucket_name}/{artifact_key}",
+            "Digest": artifact_digest,
+            "Algorithm": "SHA-256",
+            "Unarchive": "NONE",
+            "Permission": {"Read": "OWNER", "Execute": "ALL"}
+        }
+    ]
+    if artifact_name == 'model.tar.gz':
+        # Extraction dans un dossier temporaire puis rename : le device ne lit jamais un model.h5 a moitie ecrit
+        script = ("mkdir -p /tmp/clemap_model_new && "
+                  f"tar --overwrite -xzf {{artifacts:path}}/{artifact_name} -C /tmp/clemap_model_new && "
+                  "mv -f /tmp/clemap_model_new/model.h5 /tmp/model.h5")
+    else:
+        # Pack ou delta : verifie et installe par model_artifact.py, qui garde le pack courant dans {work:path}
+        script = (f"python3 {{artifacts:path}}/model_artifact.py apply {{artifacts:path}}/{artifact_name} "
+                  "--state-dir {work:path} --output /tmp/model.h5")
+        artifacts.append({
+            "Uri": f"s3://{bucket_name}/{APPLY_SCRIPT_KEY}",
+            "Unarchive": "NONE",
+            "Permission": {"Read": "OWNER", "Execute": "ALL"}
+        })
     recipe = {
         "RecipeFormatVersion": "2020-01-25",
         "ComponentName": component_name,
         "ComponentVersion": new_version,
         "ComponentType": "aws.greengrass.generic",
         "ComponentDescription": "Updated component with new artifact",
+        "ComponentConfiguration": {
+            "DefaultConfiguration": {
+                # Modele deploye (digest du pack complet, meme si l'artefact est un delta) et base du prochain delta
+                "modelDigest": model_digest or artifact_digest,
+                "packKey": pack_key or "",
+                # Scores du modele sur le holdout : reference de la porte d'evaluation pour le prochain candidat
+                "holdoutDigest": (evaluation or {}).get('holdout_digest', ""),
+                "holdoutMse": (evaluation or {}).get('candidate', {}).get('mse'),
+                "holdoutMae": (evaluation or {}).get('candidate', {}).get('mae')
+            }
+        },
         "Manifests": [
             {
                 "Platform": {"os": "linux"},
@@ -144,19 +535,11 @@ def update_recipe_with_new_digest(component_name, new_version, artifact_digest,
                 "Lifecycle": {
                     "run": 
                     {
-                        "script" : "tar --overwrite -xvzf {artifacts:path}/model.tar.gz -C /tmp/",
+                        "script" : script,
                         "RequiresPrivilege" : "true"
                     }
                 },
-                "Artifacts": [
-                    {
-                        "Uri": f"s3://{bucket_name}/{artifact_key}",
-                        "Digest": artifact_digest,
-                        "Algorithm": "SHA-256",
-                        "Unarchive": "NONE",
-                        "Permission": {"Read": "OWNER", "Execute": "ALL"}
-                    }
-                ]
+                "Artifacts": artifacts
             }
         ]
     }
@@ -164,10 +547,12 @@ def update_recipe_with_new_digest(component_name, new_version, artifact_digest,
 
 
 def register_new_component_version(recipe):
-    """Registers the new component version in the Greengrass catalog."""
+    """Registers the new component version in the Greengrass catalog. Returns False if it failed."""
     try:
         gg_clemap.create_component_version(inlineRecipe=json.dumps(recipe))
         print("New component version registered successfully.")
+        return True
     except Exception as e:
         print(f"Error creating component version: {e}")
+        return False
     """Registers the new component version in the Greengrass catalog."""
\ No newline at end of file
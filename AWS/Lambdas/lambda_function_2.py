@@ -1,6 +1,8 @@
+import io
 import json
 import boto3
 import os
+import tarfile
 import uuid
 import time
 
@@ -15,13 +17,270 @@ MODEL_OUTPUT_PATH = 's3://clemapbucket/output/'  # Emplacement de sortie pour le
 SOURCE_INPUT_PATH = 's3://clemapbucket/scripts/train_lstm.py'
 TRAINING_IMAGE = '763104351884.dkr.ecr.us-east-1.amazonaws.com/tensorflow-training:2.16.2-cpu-py310'  # Image Docker pour l'entraînement
 KEY = 'data/Clemap_train.csv'  # Corrected key to point to the file directly
+DATA_PREFIX = 'data/'
+MODEL_OUTPUT_PREFIX = 'output/'
+MANIFEST_PREFIX = 'manifests/'
+
+# Ajustement fin du modele deploye sur les nouvelles donnees seulement
+FINE_TUNE_EPOCHS = 10
+FINE_TUNE_MAX_SECONDS = 900  # Plafond de fit() sous MaxRuntimeInSeconds
+SCRATCH_EPOCHS = 30
+
+INSTANCE_TYPE = os.environ.get('INSTANCE_TYPE', 'ml.m5.large')
+# Plusieurs instances : fichiers repartis par cle S3 (ShardedByS3Key), un worker TensorFlow par instance
+INSTANCE_COUNT = int(os.environ.get('INSTANCE_COUNT', '1'))
+# Au-dela, les donnees sont lues dans S3 a la demande (FastFile) au lieu d'etre copiees sur le volume avant le debut
+FAST_FILE_MIN_BYTES = int(os.environ.get('FAST_FILE_MIN_BYTES', str(1024 ** 3)))
+
+# Recherche d'hyperparametres a chaque lancement (TUNE=1) ou sur event {"tune": true} ; essais au total et en parallele
+TUNE = os.environ.get('TUNE', '0') == '1'
+TUNING_MAX_JOBS = int(os.environ.get('TUNING_MAX_JOBS', '12'))
+TUNING_PARALLEL_JOBS = int(os.environ.get('TUNING_PARALLEL_JOBS', '3'))
+# Longueurs de fenetre essayees : le device doit utiliser la meme (CLEMAP_TIMESTEPS), 10 par defaut
+TUNING_TIMESTEPS = os.environ.get('TUNING_TIMESTEPS', '10').split(',')
+# Hors de output/ : les essais ne declenchent pas de deploiement, seul le meilleur y est copie
+TUNING_OUTPUT_PREFIX = 'tuning/'
+TUNING_EVENT = 'SageMaker HyperParameter Tuning Job State Change'
+OBJECTIVE_METRIC = 'validation:loss'
+# Archive du script mode (sagemaker_submit_directory) des essais, construite depuis scripts/
+SOURCE_DIR_KEY = 'scripts/sourcedir.tar.gz'
+SCRIPT_KEYS = ('scripts/train_lstm.py', 'scripts/model_artifact.py')
+
+# Jeu d'evaluation fixe, hors de data/ : un rapport recent y est deplace, puis remplace apres HOLDOUT_MAX_AGE
+HOLDOUT_PREFIX = 'holdout/'
+# Anciens fichiers de holdout : ni dans data/ (declencheur S3 de ce Lambda) ni dans output/
+RETIRED_HOLDOUT_PREFIX = 'holdout-retired/'
+HOLDOUT_MAX_AGE = float(os.environ.get('HOLDOUT_MAX_AGE_DAYS', '7')) * 86400
+
+
+def list_objects(prefix):
+    """Lists every object under a prefix of the bucket (pages without 'Contents' are empty)."""
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=prefix):
+        yield from page.get('Contents', [])
+
+
+def list_data_files():
+    return [obj for obj in list_objects(DATA_PREFIX) if not obj['Key'].endswith('/')]
+
+
+def find_base_model():
+    """Returns the most recent model.tar.gz of output/ (the deployment Lambda moves rejected ones out), or None."""
+    models = [obj for obj in list_objects(MODEL_OUTPUT_PREFIX) if obj['Key'].endswith('/model.tar.gz')]
+    return max(models, key=lambda obj: obj['LastModified'], default=None)
+
+
+def move_object(source_key, target_key):
+    s3_client.copy_object(Bucket=BUCKET_NAME, Key=target_key, CopySource={'Bucket': BUCKET_NAME, 'Key': source_key})
+    s3_client.delete_object(Bucket=BUCKET_NAME, Key=source_key)
+
+
+def refresh_holdout(data_files, since=None):
+    """Keeps the evaluation set of holdout/ out of the training data. Returns the data files left for training.
+
+    The set stays the same from one job to the next so their scores compare. Once older than HOLDOUT_MAX_AGE,
+    it is retired and replaced by a recent report the deployed model (trained at `since`) has not seen. The
+    newest report, usually the one that triggered the job, always stays in data/. A report the deployed model
+    was trained on never becomes the holdout: until an unseen one exists there is none, and no evaluation gate.
+    """
+    holdout = [obj for obj in list_objects(HOLDOUT_PREFIX) if not obj['Key'].endswith('/')]
+    now = time.time()
+    if holdout and all(now - obj['LastModified'].timestamp() < HOLDOUT_MAX_AGE for obj in holdout):
+        return data_files
+    candidates = sorted(data_files, key=lambda obj: obj['LastModified'])[:-1]
+    unseen = [obj for obj in candidates if since is None or obj['LastModified'] > since]
+    if not unseen:
+        # Pas de rapport recent hors du declencheur : l'ancien holdout reste en place, ou il n'y en a pas encore
+        # (un rapport deja vu par le modele deploye donnerait a celui-ci un score trop optimiste)
+        return data_files
+    chosen = unseen[-1]
+    for obj in holdout:
+        # Hors de data/ : ne relance pas d'entrainement et ne passe pas pour une donnee nouvelle
+        move_object(obj['Key'], RETIRED_HOLDOUT_PREFIX + obj['Key'][len(HOLDOUT_PREFIX):])
+    move_object(chosen['Key'], HOLDOUT_PREFIX + chosen['Key'][len(DATA_PREFIX):])
+    print(f"Holdout set is now s3://{BUCKET_NAME}/{HOLDOUT_PREFIX}{chosen['Key'][len(DATA_PREFIX):]}"
+          f" ({len(holdout)} previous files retired to {RETIRED_HOLDOUT_PREFIX})")
+    return [obj for obj in data_files if obj is not chosen]
+
+
+def write_data_manifest(job_name, objects):
+    """Writes a SageMaker manifest listing the given data files. Returns its key, or None if there are none."""
+    keys = [obj['Key'][len(DATA_PREFIX):] for obj in objects]
+    if not keys:
+        return None
+    manifest_key = f"{MANIFEST_PREFIX}{job_name}.json"
+    manifest = [{'prefix': f's3://{BUCKET_NAME}/{DATA_PREFIX}'}] + keys
+    s3_client.put_object(Bucket=BUCKET_NAME, Key=manifest_key, Body=json.dumps(manifest).encode('utf-8'))
+    print(f"Fine-tuning on {len(keys)} new data files listed in s3://{BUCKET_NAME}/{manifest_key}")
+    return manifest_key
+
+
+def s3_channel(name, data_type, uri, content_type, input_mode=None, distribution='FullyReplicated'):
+    channel = {
+        'ChannelName': name,
+        'DataSource': {
+            'S3DataSource': {
+                'S3DataType': data_type,
+                'S3Uri': uri,
+                'S3DataDistributionType': distribution
+            }
+        },
+        'ContentType': content_type,
+    }
+    if input_mode:
+        channel['InputMode'] = input_mode
+    return channel
+
+
+def training_channel(manifest_key, objects, instance_count):
+    """'training' channel over `objects`: FastFile for large datasets, sharded by S3 key over several instances."""
+    size = sum(obj['Size'] for obj in objects)
+    if manifest_key:
+        data_type, uri = 'ManifestFile', f's3://{BUCKET_NAME}/{manifest_key}'
+    else:
+        data_type, uri = 'S3Prefix', f's3://{BUCKET_NAME}/{DATA_PREFIX}'
+    # FastFile n'accepte que S3Prefix ; un manifeste ne liste que les nouveaux fichiers, copies en mode File
+    input_mode = 'FastFile' if data_type == 'S3Prefix' and size >= FAST_FILE_MIN_BYTES else None
+    distribution = 'ShardedByS3Key' if instance_count > 1 else 'FullyReplicated'
+    print(f"Training on {len(objects)} files ({size} bytes) in {input_mode or 'File'} mode, "
+          f"{distribution} over {instance_count} instance(s)")
+    return s3_channel('training', data_type, uri, 'csv', input_mode, distribution)
+
+
+def upload_source_dir():
+    """Packs the training scripts of scripts/ into the archive run by the tuning jobs in script mode."""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+        for key in SCRIPT_KEYS:
+            body = s3_client.get_object(Bucket=BUCKET_NAME, Key=key)['Body'].read()
+            info = tarfile.TarInfo(os.path.basename(key))
+            info.size = len(body)
+            tar.addfile(info, io.BytesIO(body))
+    s3_client.put_object(Bucket=BUCKET_NAME, Key=SOURCE_DIR_KEY, Body=buffer.getvalue())
+    return f's3://{BUCKET_NAME}/{SOURCE_DIR_KEY}'
+
+
+def tuning_ranges():
+    return {
+        'CategoricalParameterRanges': [{'Name': 'timesteps', 'Values': TUNING_TIMESTEPS}],
+        'IntegerParameterRanges': [
+            {'Name': 'units', 'MinValue': '16', 'MaxValue': '128', 'ScalingType': 'Logarithmic'},
+            {'Name': 'epochs', 'MinValue': '10', 'MaxValue': '50', 'ScalingType': 'Linear'},
+        ],
+    }
+
+
+def start_tuning_job(tuning_job_name, channels, instance_count):
+    """Starts a parallel search over window length, hidden units and epochs, trials written under tuning/."""
+    source_dir = upload_source_dir()
+    sagemaker_client.create_hyper_parameter_tuning_job(
+        HyperParameterTuningJobName=tuning_job_name,
+        HyperParameterTuningJobConfig={
+            'Strategy': 'Bayesian',
+            'HyperParameterTuningJobObjective': {'Type': 'Minimize', 'MetricName': OBJECTIVE_METRIC},
+            'ResourceLimits': {
+                'MaxNumberOfTrainingJobs': TUNING_MAX_JOBS,
+                'MaxParallelTrainingJobs': min(TUNING_PARALLEL_JOBS, TUNING_MAX_JOBS),
+            },
+            'ParameterRanges': tuning_ranges(),
+        },
+        TrainingJobDefinition={
+            # Script mode : le toolkit SageMaker de l'image lance train_lstm.py avec --timesteps, --units et --epochs
+            # et renseigne SM_CHANNEL_TRAINING et SM_MODEL_DIR
+            'StaticHyperParameters': {
+                'sagemaker_program': 'train_lstm.py',
+                'sagemaker_submit_directory': source_dir,
+            },
+            'AlgorithmSpecification': {
+                'TrainingImage': TRAINING_IMAGE,
+                'TrainingInputMode': 'File',
+                'MetricDefinitions': [{'Name': OBJECTIVE_METRIC, 'Regex': 'validation:loss=([0-9.eE+-]+)'}],
+            },
+            'RoleArn': ROLE,
+            'InputDataConfig': channels,
+            'OutputDataConfig': {'S3OutputPath': f's3://{BUCKET_NAME}/{TUNING_OUTPUT_PREFIX}'},
+            'ResourceConfig': {'InstanceType': INSTANCE_TYPE, 'InstanceCount': instance_count, 'VolumeSizeInGB': 1},
+            'StoppingCondition': {'MaxRuntimeInSeconds': 3600},
+        },
+    )
+    print(f"Tuning job started: {tuning_job_name} ({TUNING_MAX_JOBS} trials, {TUNING_PARALLEL_JOBS} in parallel)")
+
+
+def publish_best_model(tuning_job_name):
+    """Copies the model of the best trial of a finished tuning job to output/, which triggers its deployment."""
+    tuning_job = sagemaker_client.describe_hyper_parameter_tuning_job(HyperParameterTuningJobName=tuning_job_name)
+    status = tuning_job['HyperParameterTuningJobStatus']
+    best = tuning_job.get('BestTrainingJob')
+    if status != 'Completed' or not best:
+        print(f"Tuning job {tuning_job_name} is {status}, nothing to publish")
+        return {'statusCode': 200, 'body': json.dumps(f'{tuning_job_name} {status}')}
+    training_job = sagemaker_client.describe_training_job(TrainingJobName=best['TrainingJobName'])
+    source_key = training_job['ModelArtifacts']['S3ModelArtifacts'][len(f's3://{BUCKET_NAME}/'):]
+    target_key = f"{MODEL_OUTPUT_PREFIX}{best['TrainingJobName']}/output/model.tar.gz"
+    s3_client.copy_object(Bucket=BUCKET_NAME, Key=target_key, CopySource={'Bucket': BUCKET_NAME, 'Key': source_key})
+    objective = best.get('FinalHyperParameterTuningJobObjectiveMetric', {}).get('Value')
+    print(f"Best trial {best['TrainingJobName']} ({OBJECTIVE_METRIC} {objective}, "
+          f"{best.get('TunedHyperParameters')}) published to s3://{BUCKET_NAME}/{target_key}")
+    return {'statusCode': 200, 'body': json.dumps(f"Published {best['TrainingJobName']}")}
+
 
 def lambda_handler(event, context):
+    event = event or {}
+    # Fin d'une recherche d'hyperparametres (regle EventBridge sur son changement d'etat) : publication du meilleur essai
+    if event.get('detail-type') == TUNING_EVENT:
+        return publish_best_model(event['detail']['HyperParameterTuningJobName'])
+
     # Créer un job d'entraînement SageMaker
     timestamp = str(int(time.time()))
     unique_suffix = str(uuid.uuid4())[:8]  # Limite à 8 caractères
     job_name = f"lstm-training-job-{timestamp}-{unique_suffix}"
-    
+
+    # Recherche d'hyperparametres toujours de zero : la forme du modele change d'un essai a l'autre
+    tune = event.get('tune', TUNE)
+    # Mode 'fine-tune' par defaut des qu'un modele a deja ete entraine ; event {"mode": "scratch"} pour repartir de zero
+    mode = 'scratch' if tune else event.get('mode', 'fine-tune')
+    # Modele deploye : base du fine-tuning et reference evaluee sur le holdout dans tous les modes
+    deployed_model = find_base_model()
+    data_files = refresh_holdout(list_data_files(), deployed_model['LastModified'] if deployed_model else None)
+    base_model = deployed_model if mode == 'fine-tune' else None
+    new_files = [obj for obj in data_files if obj['LastModified'] > base_model['LastModified']] if base_model else []
+    manifest_key = write_data_manifest(job_name, new_files)
+    training_files = new_files if manifest_key else data_files
+    # ShardedByS3Key : une instance sans fichier n'aurait rien a lire
+    instance_count = max(1, min(INSTANCE_COUNT, len(training_files)))
+    training = training_channel(manifest_key, training_files, instance_count)
+    # Scores du candidat et du modele deploye sur le holdout (evaluation.json), pour la porte de deploiement
+    # (les essais en script mode recoivent les chemins du toolkit, SM_CHANNEL_HOLDOUT et SM_CHANNEL_BASELINE)
+    evaluation_channels, evaluation_arguments = [], []
+    if any(True for _ in list_objects(HOLDOUT_PREFIX)):
+        evaluation_channels.append(s3_channel('holdout', 'S3Prefix', f's3://{BUCKET_NAME}/{HOLDOUT_PREFIX}', 'csv'))
+        evaluation_arguments += ["--holdout", "/opt/ml/input/data/holdout"]
+    # En fine-tuning, le canal 'model' (--base-model) sert aussi de reference
+    if deployed_model and not manifest_key:
+        evaluation_channels.append(s3_channel('baseline', 'S3Prefix', f"s3://{BUCKET_NAME}/{deployed_model['Key']}",
+                                              'application/x-tar'))
+        evaluation_arguments += ["--baseline-model", "/opt/ml/input/data/baseline"]
+
+    if tune:
+        tuning_job_name = f"lstm-hpo-{timestamp}-{unique_suffix}"[:32]
+        start_tuning_job(tuning_job_name, [training] + evaluation_channels, instance_count)
+        return {
+            'statusCode': 200,
+            'body': json.dumps(f'Tuning job started: {tuning_job_name}')
+        }
+
+    channels = [s3_channel('scripts', 'S3Prefix', f's3://{BUCKET_NAME}/scripts', 'py'), training] + evaluation_channels
+    arguments = ["/opt/ml/input/data/scripts/train_lstm.py", "--data", "/opt/ml/input/data/training"]
+    arguments += evaluation_arguments
+    if manifest_key:
+        base_uri = f"s3://{BUCKET_NAME}/{base_model['Key']}"
+        print(f"Warm start from {base_uri}")
+        channels.append(s3_channel('model', 'S3Prefix', base_uri, 'application/x-tar'))
+        arguments += ["--base-model", "/opt/ml/input/data/model", "--epochs", str(FINE_TUNE_EPOCHS),
+                      "--max-train-seconds", str(FINE_TUNE_MAX_SECONDS)]
+    else:
+        arguments += ["--epochs", str(SCRATCH_EPOCHS)]
+
     # Configurer le job d'entraînement
     response = sagemaker_client.create_training_job(
         TrainingJobName=job_name,
@@ -29,37 +288,17 @@ def lambda_handler(event, context):
             'TrainingImage': TRAINING_IMAGE,
             'TrainingInputMode': 'File',
             "ContainerEntrypoint": ["/usr/local/bin/python3.10"],
-            "ContainerArguments": ["/opt/ml/input/data/scripts/train_lstm.py"]
+            "ContainerArguments": arguments
         },
         RoleArn=ROLE,
-        InputDataConfig=[
-            {
-                'ChannelName': 'training',
-                'DataSource': {
-                    'S3DataSource': {
-                        'S3DataType': 'S3Prefix',
-                        'S3Uri': f's3://{BUCKET_NAME}/data',  # Use dynamic bucket and key from event
-                        'S3DataDistributionType': 'FullyReplicated'
-                    }
-                },
-                'ContentType': 'csv',
-                'ChannelName': 'scripts',
-                'DataSource': {
-                    'S3DataSource': {
-                        'S3DataType': 'S3Prefix',
-                        'S3Uri': f's3://{BUCKET_NAME}/scripts',  # Use dynamic bucket and key from event
-                        'S3DataDistributionType': 'FullyReplicated'
-                    }
-                },
-                'ContentType': 'py',
-            }
-        ],
+        InputDataConfig=channels,
+        HyperParameters={'mode': 'fine-tune' if manifest_key else 'scratch'},
         OutputDataConfig={
             'S3OutputPath': MODEL_OUTPUT_PATH
         },
         ResourceConfig={
-            'InstanceType' : 'ml.m5.large',
-            'InstanceCount': 1,
+            'InstanceType' : INSTANCE_TYPE,
+            'InstanceCount': instance_count,
             'VolumeSizeInGB': 1
         },
         StoppingCondition={
@@ -0,0 +1,232 @@
+"""
+Compact model artifacts for the edge component.
+
+``model.tar.gz`` from SageMaker carries the whole ``model.h5``, optimizer state
+and HDF5 overhead included. A *pack* only keeps the ``model_weights`` of the
+``.h5``, stored as float16 or int8 (symmetric, one scale per tensor), after a
+JSON header holding the Keras model config and the layout:
+
+    MAGIC | uint32 header length | header JSON | raw weights
+
+The raw layout only depends on the architecture, so two packs of the same
+model can be XOR-diffed into a *delta* that compresses well after a
+fine-tuning run:
+
+    DELTA_MAGIC | uint32 meta length | meta JSON | base payload XOR target payload
+
+``train_lstm.py`` writes ``model.pack`` next to ``model.h5``; the deployment
+Lambda publishes it gzip-compressed (or a delta against the deployed pack) and
+the Greengrass component applies it on the device:
+
+    python3 model_artifact.py apply model.pack.gz --state-dir {work:path} --output /tmp/model.h5
+
+``apply`` verifies the result, keeps the full pack in ``--state-dir`` as the
+base of the next delta, and writes ``model.h5`` to a temporary file that is
+renamed over the old one, so the edge never loads a half-written model.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import struct
+import sys
+
+import h5py
+import numpy as np
+
+MAGIC = b"CLMPACK1"
+DELTA_MAGIC = b"CLMDELT1"
+DTYPES = ("float16", "int8")
+STATE_NAME = "model.pack"
+
+_LENGTH = struct.Struct("<I")
+_FLOAT16_MAX = float(np.finfo(np.float16).max)
+
+
+def _decode(value):
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+def _quantize(weights, dtype):
+    weights = np.asarray(weights, dtype=np.float32)
+    if dtype == "float16":
+        if np.nanmax(np.abs(weights), initial=0) > _FLOAT16_MAX:
+            raise ValueError("Weights overflow float16")
+        return weights.astype(np.float16), None
+    if not np.isfinite(weights).all():
+        raise ValueError("int8 packs need finite weights")
+    peak = float(np.abs(weights).max(initial=0))
+    scale = peak / 127 if peak else 1.0
+    return np.clip(np.rint(weights / scale), -127, 127).astype(np.int8), scale
+
+
+def pack_h5(h5_path, dtype="float16"):
+    """Returns the pack bytes of the weights of a Keras ``.h5`` model."""
+    if dtype not in DTYPES:
+        raise ValueError(f"Unknown pack dtype '{dtype}', expected one of {DTYPES}")
+    layers = []
+    chunks = []
+    offset = 0
+    with h5py.File(h5_path, "r") as f:
+        weights_group = f["model_weights"] if "model_weights" in f else f
+        for layer_name in (_decode(n) for n in weights_group.attrs["layer_names"]):
+            group = weights_group[layer_name]
+            tensors = []
+            for name in (_decode(n) for n in group.attrs["weight_names"]):
+                values, scale = _quantize(group[name][()], dtype)
+                data = values.tobytes()
+                tensors.append({"name": name, "shape": list(values.shape), "offset": offset,
+                                "nbytes": len(data), "scale": scale})
+                chunks.append(data)
+                offset += len(data)
+            layers.append({"name": layer_name, "weights": tensors})
+        header = {
+            "dtype": dtype,
+            # Attributs necessaires a Keras (et a read_h5_layers) pour relire le .h5 reconstruit
+            "attrs": {k: _decode(v) for k, v in f.attrs.items() if k in ("model_config", "keras_version", "backend")},
+            "layers": layers,
+        }
+    header = json.dumps(header, sort_keys=True).encode("utf-8")
+    return MAGIC + _LENGTH.pack(len(header)) + header + b"".join(chunks)
+
+
+def split_pack(data):
+    """Returns ``(header, payload)`` of a pack."""
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not a model pack")
+    start = len(MAGIC) + _LENGTH.size
+    (length,) = _LENGTH.unpack_from(data, len(MAGIC))
+    header = json.loads(bytes(data[start:start + length]))
+    payload = data[start + length:]
+    expected = sum(w["nbytes"] for layer in header["layers"] for w in layer["weights"])
+    if len(payload) != expected:
+        raise ValueError(f"Truncated model pack: {len(payload)} bytes of weights, expected {expected}")
+    return header, payload
+
+
+def unpack(data):
+    """Returns ``(header, {layer: [(weight_name, float32 array), ...]})``."""
+    header, payload = split_pack(data)
+    layers = {}
+    for layer in header["layers"]:
+        weights = []
+        for w in layer["weights"]:
+            values = np.frombuffer(payload, dtype=header["dtype"], count=int(np.prod(w["shape"], dtype=np.int64)),
+                                   offset=w["offset"]).reshape(w["shape"]).astype(np.float32)
+            if w["scale"] is not None:
+                values *= w["scale"]
+            weights.append((w["name"], values))
+        layers[layer["name"]] = weights
+    return header, layers
+
+
+def make_delta(base, target):
+    """Returns the delta turning pack ``base`` into pack ``target``, or None if their layouts differ."""
+    base_header, base_payload = split_pack(base)
+    target_header, target_payload = split_pack(target)
+    if len(base_payload) != len(target_payload) or base_header["dtype"] != target_header["dtype"]:
+        return None
+    meta = json.dumps({
+        "base_sha256": hashlib.sha256(base).hexdigest(),
+        "target_sha256": hashlib.sha256(target).hexdigest(),
+        "header": target[len(MAGIC) + _LENGTH.size:len(target) - len(target_payload)].decode("utf-8"),
+    }).encode("utf-8")
+    xor = np.bitwise_xor(np.frombuffer(base_payload, np.uint8), np.frombuffer(target_payload, np.uint8))
+    return DELTA_MAGIC + _LENGTH.pack(len(meta)) + meta + xor.tobytes()
+
+
+def apply_delta(base, delta):
+    """Rebuilds the target pack from ``base`` and checks it against the SHA-256 recorded in the delta."""
+    (length,) = _LENGTH.unpack_from(delta, len(DELTA_MAGIC))
+    start = len(DELTA_MAGIC) + _LENGTH.size
+    meta = json.loads(delta[start:start + length])
+    if hashlib.sha256(base).hexdigest() != meta["base_sha256"]:
+        raise ValueError("The delta was made against another model than the one installed on this device")
+    _, base_payload = split_pack(base)
+    xor = np.frombuffer(delta, np.uint8, offset=start + length)
+    header = meta["header"].encode("utf-8")
+    payload = np.bitwise_xor(np.frombuffer(base_payload, np.uint8), xor).tobytes()
+    target = MAGIC + _LENGTH.pack(len(header)) + header + payload
+    if hashlib.sha256(target).hexdigest() != meta["target_sha256"]:
+        raise ValueError("Model pack rebuilt from the delta does not match its SHA-256")
+    return target
+
+
+def write_h5(data, h5_path):
+    """Writes the Keras ``.h5`` of a pack (weights in float32, no optimizer state)."""
+    header, layers = unpack(data)
+    with h5py.File(h5_path, "w") as f:
+        for key, value in header["attrs"].items():
+            f.attrs[key] = value
+        weights_group = f.create_group("model_weights")
+        weights_group.attrs["layer_names"] = np.array([name.encode("utf-8") for name in layers])
+        for key in ("backend", "keras_version"):
+            if key in header["attrs"]:
+                weights_group.attrs[key] = header["attrs"][key]
+        for layer_name, weights in layers.items():
+            group = weights_group.create_group(layer_name)
+            group.attrs["weight_names"] = np.array([name.encode("utf-8") for name, _ in weights])
+            for name, values in weights:
+                group.create_dataset(name, data=values)
+
+
+def _replace(path, write):
+    # Ecriture dans un fichier temporaire du meme dossier puis rename : le remplacement est atomique
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _write_bytes(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def apply(artifact_path, output, state_dir):
+    """Installs a pack or a delta (gzip or not) as ``output`` (a ``.h5``)."""
+    with open(artifact_path, "rb") as f:
+        data = f.read()
+    if data[:2] == b"\x1f\x8b":
+        data = gzip.decompress(data)
+    state_path = os.path.join(state_dir, STATE_NAME)
+    if data[:len(DELTA_MAGIC)] == DELTA_MAGIC:
+        with open(state_path, "rb") as f:
+            data = apply_delta(f.read(), data)
+    else:
+        split_pack(data)
+    os.makedirs(state_dir, exist_ok=True)
+    _replace(state_path, lambda path: _write_bytes(path, data))
+    _replace(output, lambda path: write_h5(data, path))
+    return data
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    pack_cmd = commands.add_parser("pack", help="Write the pack of a Keras .h5 model")
+    pack_cmd.add_argument("h5")
+    pack_cmd.add_argument("output")
+    pack_cmd.add_argument("--dtype", choices=DTYPES, default="float16")
+    apply_cmd = commands.add_parser("apply", help="Install a pack or a delta as a .h5 model")
+    apply_cmd.add_argument("artifact")
+    apply_cmd.add_argument("--output", default="/tmp/model.h5")
+    apply_cmd.add_argument("--state-dir", default=".")
+    args = parser.parse_args(argv)
+
+    if args.command == "pack":
+        data = pack_h5(args.h5, args.dtype)
+        _replace(args.output, lambda path: _write_bytes(path, data))
+        print(f"{args.h5} ({os.path.getsize(args.h5)} bytes) -> {args.output} ({len(data)} bytes, {args.dtype})")
+    else:
+        data = apply(args.artifact, args.output, args.state_dir)
+        print(f"Installed {args.artifact} as {args.output} (pack sha256 {hashlib.sha256(data).hexdigest()})")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,58 +1,474 @@
 import argparse
+import contextlib
+import hashlib
+import json
 import os
+import tarfile
+import tempfile
+import time
+import tracemalloc
 import numpy as np
 import pandas as pd
 import tensorflow as tf
+from numpy.lib.stride_tricks import sliding_window_view
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import LSTM, Dense, Input
 
-def prepare_data(file_path):
-    """Load and prepare data for training."""
-    df = pd.read_csv(file_path)
-    data = df['target'].values
+from model_artifact import DTYPES, pack_h5
 
-    # Create sequences for 10 timesteps to predict the next value
-    timesteps = 10
-    X, y = [], []
-    for i in range(len(data) - timesteps):
-        X.append(data[i:i + timesteps])  # 10 previous values
-        y.append(data[i + timesteps])   # Next value (target)
-    
-    # Convert to numpy arrays and reshape for LSTM input
-    X = np.array(X).reshape((-1, timesteps, 1))
-    y = np.array(y).reshape((-1, 1))
-    print(f"Input shape: {X.shape}, Target shape: {y.shape}")
+# Colonnes par phase exportees par le device ; 'target' est l'ancienne somme l1_p + l2_p + l3_p
+PHASE_COLUMNS = ['l1_p', 'l2_p', 'l3_p']
+
+# Ecrit par SageMaker sur chaque instance (hotes du cluster et hote courant), meme sans le toolkit d'entrainement
+RESOURCE_CONFIG = '/opt/ml/input/config/resourceconfig.json'
+
+# Formats ecrits par l'exportateur du device (dataset.py) ; l'ancien Clemap_train.csv reste lisible
+DATA_EXTENSIONS = ('.csv', '.csv.gz', '.parquet')
+
+# Lignes lues par morceau : seules les colonnes utiles sont gardees, en float32
+CSV_CHUNK_ROWS = 1_000_000
+
+# Resultat de l'evaluation sur le holdout, lu par la Lambda de deploiement dans model.tar.gz
+EVALUATION_NAME = 'evaluation.json'
+
+def list_data_files(path):
+    """Returns the data files under a directory (or the path itself for a single file or URL)."""
+    if not os.path.isdir(path):
+        return [path]
+    files = []
+    for root, _, names in os.walk(path):
+        files.extend(os.path.join(root, name) for name in names if name.endswith(DATA_EXTENSIONS))
+    return sorted(files)
+
+def read_frame(file_path):
+    if file_path.endswith('.parquet'):
+        return pd.read_parquet(file_path)
+    # read_csv decompresse .csv.gz d'apres l'extension
+    return pd.read_csv(file_path)
+
+def series_columns(columns, features='sum'):
+    """Columns of the file needed to build the requested features."""
+    if features == 'phases' or 'target' not in columns:
+        return PHASE_COLUMNS
+    return ['target']
+
+def parquet_file(file_path):
+    # pyarrow est deja le moteur de pd.read_parquet ; importe seulement pour les fichiers .parquet
+    import pyarrow.parquet as pq
+    return pq.ParquetFile(file_path)
+
+def load_series(file_path, features='sum', chunk_rows=CSV_CHUNK_ROWS):
+    """Returns a (n_samples, n_features) float32 array: the phase sum, or one column per phase."""
+    if file_path.endswith('.parquet'):
+        # Noms de colonnes lus dans le schema : le fichier n'est lu qu'une fois, colonnes utiles seulement
+        columns = series_columns(parquet_file(file_path).schema_arrow.names, features)
+        return frame_to_series(pd.read_parquet(file_path, columns=columns), features)
+    columns = series_columns(pd.read_csv(file_path, nrows=0).columns, features)
+    reader = pd.read_csv(file_path, usecols=columns, dtype={c: np.float32 for c in columns}, chunksize=chunk_rows)
+    return np.concatenate([frame_to_series(chunk, features) for chunk in reader])
+
+def frame_to_series(df, features='sum'):
+    if features == 'phases':
+        return df[PHASE_COLUMNS].to_numpy(dtype=np.float32)
+    if 'target' in df.columns:
+        return df[['target']].to_numpy(dtype=np.float32)
+    return df[PHASE_COLUMNS].sum(axis=1).to_numpy(dtype=np.float32).reshape((-1, 1))
+
+def first_time(file_path):
+    """First 'time' value of a file, or None when the file has no time column."""
+    if file_path.endswith('.parquet'):
+        parquet = parquet_file(file_path)
+        if 'time' not in parquet.schema_arrow.names:
+            return None
+        # Colonne time du premier groupe de lignes non vide seulement
+        groups = [i for i in range(parquet.num_row_groups) if parquet.metadata.row_group(i).num_rows]
+        if not groups:
+            return None
+        df = parquet.read_row_group(groups[0], columns=['time']).to_pandas()
+    else:
+        df = pd.read_csv(file_path, nrows=1)
+    if 'time' not in df.columns or not len(df):
+        return None
+    return df['time'].iloc[0]
+
+def load_segments(path, features='sum'):
+    """Loads every exported file as its own chronological segment."""
+    files = list_data_files(path)
+    if not files:
+        raise FileNotFoundError(f"No {', '.join(DATA_EXTENSIONS)} file in {path}, check the input channel")
+    # Les exports incrementaux sont ordonnes par leur premier horodatage ; une fenetre ne chevauche jamais deux fichiers
+    starts = [first_time(f) for f in files]
+    if all(start is not None for start in starts):
+        files = [f for _, f in sorted(zip(starts, files), key=lambda pair: pair[0])]
+    return [load_series(f, features) for f in files]
+
+def make_windows(data, timesteps=10, horizon=1):
+    """Returns (X, y) views of shape (n, timesteps, features) and (n, horizon, features), without copying data."""
+    n = len(data) - timesteps - horizon + 1
+    n_features = data.shape[1]
+    if n <= 0:
+        return np.empty((0, timesteps, n_features), data.dtype), np.empty((0, horizon, n_features), data.dtype)
+    X = sliding_window_view(data, timesteps, axis=0)[:n].transpose(0, 2, 1)
+    y = sliding_window_view(data[timesteps:], horizon, axis=0)[:n].transpose(0, 2, 1)
     return X, y
 
-def create_model(timesteps):
+def split_validation(segments, fraction=0.1, timesteps=10):
+    """Holds out the most recent `fraction` of the samples as (train_segments, validation_segments)."""
+    remaining = int(sum(len(data) for data in segments) * fraction)
+    if remaining <= 0:
+        return segments, []
+    train, validation = list(segments), []
+    while remaining > 0 and train:
+        data = train.pop()
+        if len(data) <= remaining:
+            validation.insert(0, data)
+            remaining -= len(data)
+            continue
+        cut = len(data) - remaining
+        # La validation garde `timesteps` valeurs de contexte ; ses cibles restent toutes apres la coupure
+        train.append(data[:cut])
+        validation.insert(0, data[max(cut - timesteps, 0):])
+        remaining = 0
+    return train, validation
+
+def make_dataset(segments, timesteps=10, horizon=1, batch_size=256, shuffle=True, seed=None):
+    """Streams (X, y) batches; windows are only materialized one batch at a time.
+
+    Returns (dataset, n_windows). Batch order is reshuffled at every epoch.
+    """
+    windows = [make_windows(data, timesteps, horizon) for data in segments]
+    n_features = segments[0].shape[1]
+    batches = [(s, start) for s, (X, _) in enumerate(windows) for start in range(0, len(X), batch_size)]
+    n_windows = sum(len(X) for X, _ in windows)
+    rng = np.random.default_rng(seed)
+
+    def generate():
+        order = rng.permutation(len(batches)) if shuffle else range(len(batches))
+        for b in order:
+            s, start = batches[b]
+            X, y = windows[s]
+            yield (np.ascontiguousarray(X[start:start + batch_size]),
+                   y[start:start + batch_size].reshape((-1, horizon * n_features)))
+
+    dataset = tf.data.Dataset.from_generator(
+        generate,
+        output_signature=(
+            tf.TensorSpec(shape=(None, timesteps, n_features), dtype=tf.float32),
+            tf.TensorSpec(shape=(None, horizon * n_features), dtype=tf.float32),
+        ),
+    ).prefetch(tf.data.AUTOTUNE)
+    return dataset, n_windows
+
+def create_model(timesteps, n_features=1, n_outputs=1, units=32):
     """Create and compile the LSTM model."""
     model = Sequential()
-    model.add(Input(shape=(timesteps, 1)))
-    model.add(LSTM(32, activation='relu'))
-    model.add(Dense(1))
+    model.add(Input(shape=(timesteps, n_features)))
+    model.add(LSTM(units, activation='relu'))
+    model.add(Dense(n_outputs))
     model.compile(optimizer='adam', loss='mse', metrics=['accuracy'])
     return model
 
-def train_and_save_model(X, y, epochs, save_path):
-    """Train the LSTM model and save it as H5."""
-    model = create_model(X.shape[1])  # timesteps
-    model.fit(X, y, epochs=epochs, verbose=1)
-    
+def find_model_h5(path):
+    """Returns the model.h5 of a .h5 file, a SageMaker model.tar.gz or a directory holding either."""
+    if os.path.isdir(path):
+        for name in ('model.h5', 'model.tar.gz', 'model.tar'):
+            if os.path.exists(os.path.join(path, name)):
+                return find_model_h5(os.path.join(path, name))
+        raise FileNotFoundError(f"No model.h5 or model.tar.gz in {path}")
+    if path.endswith('.h5'):
+        return path
+    # Artefact de sortie SageMaker : model.h5 a la racine de l'archive
+    with tarfile.open(path) as tar:
+        member = next(m for m in tar.getmembers() if os.path.basename(m.name) == 'model.h5')
+        target = tempfile.mkdtemp(prefix='base_model_')
+        with tar.extractfile(member) as src, open(os.path.join(target, 'model.h5'), 'wb') as dst:
+            dst.write(src.read())
+    return os.path.join(target, 'model.h5')
+
+def load_base_model(path, timesteps, n_features, n_outputs, learning_rate=1e-4):
+    """Loads the previously deployed model for fine-tuning, or returns None if it does not fit the data."""
+    model = tf.keras.models.load_model(find_model_h5(path), compile=False)
+    expected = ((None, timesteps, n_features), (None, n_outputs))
+    if (tuple(model.input_shape), tuple(model.output_shape)) != expected:
+        print(f"Base model shapes {model.input_shape} -> {model.output_shape} do not match {expected}, training from scratch")
+        return None
+    if not all(np.isfinite(w).all() for w in model.get_weights()):
+        print("Base model has non-finite weights, training from scratch")
+        return None
+    # Pas d'apprentissage reduit : on ajuste le modele deploye sans effacer ce qu'il a appris
+    model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate), loss='mse', metrics=['accuracy'])
+    return model
+
+class TimeLimit(tf.keras.callbacks.Callback):
+    """Stops training once `seconds` of wall-clock time have been spent in fit()."""
+
+    def __init__(self, seconds):
+        super().__init__()
+        self.seconds = seconds
+        self.deadline = None
+
+    def on_train_begin(self, logs=None):
+        self.deadline = time.monotonic() + self.seconds
+
+    def on_train_batch_end(self, batch, logs=None):
+        if time.monotonic() >= self.deadline:
+            print(f"Training time limit of {self.seconds} s reached, stopping")
+            self.model.stop_training = True
+
+def cluster_hosts():
+    """Returns (hosts, current_host) of the SageMaker training cluster, or ([], None) outside SageMaker."""
+    if 'SM_HOSTS' in os.environ:
+        return sorted(json.loads(os.environ['SM_HOSTS'])), os.environ.get('SM_CURRENT_HOST')
+    try:
+        with open(RESOURCE_CONFIG) as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        return [], None
+    return sorted(config['hosts']), config['current_host']
+
+def distribution_strategy(hosts, current_host, port=2222):
+    """MultiWorkerMirroredStrategy with one worker per SageMaker host, or None on a single host."""
+    if len(hosts) < 2:
+        return None
+    os.environ['TF_CONFIG'] = json.dumps({
+        'cluster': {'worker': [f"{host}:{port}" for host in hosts]},
+        'task': {'type': 'worker', 'index': hosts.index(current_host)},
+    })
+    return tf.distribute.MultiWorkerMirroredStrategy()
+
+def agreed_steps(strategy, steps):
+    """Smallest step count of all workers: with ShardedByS3Key each one holds a different share of the windows."""
+    # Chaque worker doit faire le meme nombre de pas, sinon les all-reduce de l'un attendent l'autre
+    local = strategy.run(lambda: tf.constant([steps], dtype=tf.int64))
+    return int(tf.reduce_min(strategy.gather(local, axis=0)))
+
+def train_and_save_streaming(segments, timesteps, horizon, epochs, save_path, batch_size=256,
+                             validation_segments=None, base_model=None, patience=3,
+                             max_train_seconds=None, learning_rate=1e-4, units=32, strategy=None):
+    """Trains the LSTM model batch by batch from the segments and saves it as H5.
+
+    With `base_model` the deployed model is fine-tuned instead of trained from scratch. With a
+    multi-worker `strategy`, every worker trains on its own shard of the files. Returns the
+    best validation loss (the training loss without validation data).
+    """
+    dataset, n_windows = make_dataset(segments, timesteps, horizon, batch_size)
+    n_features = segments[0].shape[1]
+    print(f"Streaming {n_windows} windows of shape ({timesteps}, {n_features}) in batches of {batch_size}")
+    with strategy.scope() if strategy else contextlib.nullcontext():
+        model = None
+        if base_model:
+            model = load_base_model(base_model, timesteps, n_features, horizon * n_features, learning_rate)
+            if model is not None:
+                print(f"Fine-tuning base model from {base_model}")
+        if model is None:
+            model = create_model(timesteps, n_features, horizon * n_features, units)
+
+    callbacks = []
+    validation = None
+    if validation_segments:
+        validation, n_validation = make_dataset(validation_segments, timesteps, horizon, batch_size, shuffle=False)
+        if n_validation:
+            print(f"Validating on the {n_validation} most recent windows")
+            callbacks.append(tf.keras.callbacks.EarlyStopping(monitor='val_loss', patience=patience,
+                                                              restore_best_weights=True))
+        else:
+            validation = None
+    fit_args = {}
+    if strategy:
+        # Les fichiers sont deja repartis par cle S3 : pas de second decoupage par tf.data
+        options = tf.data.Options()
+        options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+        steps = agreed_steps(strategy, -(-n_windows // batch_size))
+        if not steps:
+            raise ValueError("A worker has no training windows, use fewer instances")
+        dataset = dataset.with_options(options).repeat()
+        fit_args['steps_per_epoch'] = steps
+        if validation is not None:
+            validation_steps = agreed_steps(strategy, -(-n_validation // batch_size))
+            if validation_steps:
+                validation = validation.with_options(options).repeat()
+                fit_args['validation_steps'] = validation_steps
+            else:
+                validation = None
+                callbacks = []
+        if max_train_seconds:
+            # Une horloge par worker : un arret a des pas differents bloquerait les autres
+            print("--max-train-seconds is ignored with several instances")
+    elif max_train_seconds:
+        callbacks.append(TimeLimit(max_train_seconds))
+    history = model.fit(dataset, epochs=epochs, validation_data=validation, callbacks=callbacks, verbose=1,
+                        **fit_args)
+
     # Save the model as H5
     model.save(save_path)
     print(f"Model successfully saved as H5 at: {save_path}")
+    losses = history.history.get('val_loss') or history.history['loss']
+    return float(np.nanmin(losses))
+
+def file_digest(files):
+    """SHA-256 of the names and contents of `files`: identifies the holdout set a model was scored on."""
+    sha256 = hashlib.sha256()
+    for file_path in files:
+        sha256.update(os.path.basename(file_path).encode('utf-8'))
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha256.update(chunk)
+    return sha256.hexdigest()
+
+def load_holdout(path, timesteps=10, horizon=1, features='sum'):
+    """Returns the (X, y) windows of every holdout file, built once for all the models scored on them."""
+    windows = [make_windows(data, timesteps, horizon) for data in load_segments(path, features)]
+    X = np.concatenate([w[0] for w in windows])
+    y = np.concatenate([w[1] for w in windows]).reshape((len(X), -1))
+    return X, y
+
+def score_model(model, X, y, batch_size=4096):
+    """MSE and MAE of `model` on the holdout windows (None when not finite), predicted in large batches."""
+    predictions = model.predict(X, batch_size=batch_size, verbose=0).reshape(y.shape)
+    errors = predictions - y
+    mse, mae = float(np.mean(np.square(errors))), float(np.mean(np.abs(errors)))
+    return {'mse': mse if np.isfinite(mse) else None, 'mae': mae if np.isfinite(mae) else None}
+
+def evaluate_on_holdout(h5_path, holdout_path, baseline_path=None, timesteps=10, horizon=1, features='sum',
+                        batch_size=4096):
+    """Scores the trained model, and the deployed one when given, on the same holdout windows."""
+    files = list_data_files(holdout_path)
+    X, y = load_holdout(holdout_path, timesteps, horizon, features) if files else ([], [])
+    if not len(X):
+        print(f"No holdout windows of {timesteps} steps in {holdout_path}, model not evaluated")
+        return None
+    evaluation = {
+        'holdout_digest': file_digest(files),
+        'holdout_windows': len(X),
+        'candidate': score_model(tf.keras.models.load_model(h5_path, compile=False), X, y, batch_size),
+        'baseline': None,
+    }
+    if baseline_path:
+        baseline = tf.keras.models.load_model(find_model_h5(baseline_path), compile=False)
+        if (tuple(baseline.input_shape), tuple(baseline.output_shape)) == ((None,) + X.shape[1:], (None, y.shape[1])):
+            evaluation['baseline'] = score_model(baseline, X, y, batch_size)
+        else:
+            # Autre longueur de fenetre ou autres features : pas comparable sur ces fenetres
+            print(f"Deployed model shapes {baseline.input_shape} -> {baseline.output_shape} do not match the holdout")
+    print(f"Holdout of {len(X)} windows: candidate {evaluation['candidate']}, deployed {evaluation['baseline']}")
+    return evaluation
+
+def save_model_pack(h5_path, dtype='float16'):
+    """Writes model.pack (weights only, float16 or int8) next to the .h5 for the compact edge artifact."""
+    pack_path = os.path.join(os.path.dirname(h5_path), 'model.pack')
+    data = pack_h5(h5_path, dtype)
+    with open(pack_path, 'wb') as f:
+        f.write(data)
+    print(f"Model pack ({dtype}, {len(data)} bytes vs {os.path.getsize(h5_path)} for the H5) saved at: {pack_path}")
+
+def _windows_loop(data, timesteps, horizon):
+    # Ancienne construction par boucle Python, gardee uniquement pour la comparaison
+    X, y = [], []
+    for i in range(len(data) - timesteps - horizon + 1):
+        X.append(data[i:i + timesteps])
+        y.append(data[i + timesteps:i + timesteps + horizon])
+    return np.array(X), np.array(y).reshape((len(X), -1))
+
+def _measure(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak / 2**20
+
+def benchmark_windowing(n_samples, timesteps=10, horizon=1, n_features=1, batch_size=256):
+    """Compares the former Python loop with the strided views on a synthetic series."""
+    data = np.random.default_rng(0).normal(size=(n_samples, n_features)).astype(np.float32)
+
+    def loop():
+        return _windows_loop(data, timesteps, horizon)
+
+    def vectorized():
+        X, y = make_windows(data, timesteps, horizon)
+        return np.ascontiguousarray(X), y.reshape((len(y), -1))
+
+    def streaming():
+        X, y = make_windows(data, timesteps, horizon)
+        count = 0
+        for start in range(0, len(X), batch_size):
+            count += len(np.ascontiguousarray(X[start:start + batch_size]))
+        return count
+
+    print(f"Synthetic series: {n_samples} samples x {n_features} features ({data.nbytes / 2**20:.1f} MiB)")
+    print(f"{'method':<12} {'time s':>8} {'peak MiB':>10}")
+    for name, func in (("loop", loop), ("vectorized", vectorized), ("streaming", streaming)):
+        _, elapsed, peak = _measure(func)
+        print(f"{name:<12} {elapsed:>8.2f} {peak:>10.1f}")
 
 if __name__ == "__main__":
     # Parse hyperparameters
     parser = argparse.ArgumentParser()
     parser.add_argument("--epochs", type=int, default=30, help="Number of training epochs")
-    args = parser.parse_args()
-    
-    # Load and prepare data
-    train_data, train_labels = prepare_data("s3://clemapbucket/data/Clemap_train.csv")
-    
+    parser.add_argument("--data", default=os.environ.get("SM_CHANNEL_TRAINING", "/opt/ml/input/data/training"),
+                        help="Training file or directory of exported files (the 'training' channel by default)")
+    parser.add_argument("--timesteps", type=int, default=10, help="Length of the input window")
+    parser.add_argument("--horizon", type=int, default=1, help="Number of future steps predicted at once")
+    parser.add_argument("--features", choices=["sum", "phases"], default="sum",
+                        help="Train on l1_p + l2_p + l3_p or on the three phases separately")
+    parser.add_argument("--batch-size", type=int, default=256, help="Windows materialized per training batch")
+    parser.add_argument("--base-model", default=os.environ.get("SM_CHANNEL_MODEL"),
+                        help="Deployed model.h5, model.tar.gz or channel directory to fine-tune instead of training from scratch")
+    parser.add_argument("--units", type=int, default=32, help="Hidden units of the LSTM layer")
+    parser.add_argument("--learning-rate", type=float, default=1e-4, help="Adam learning rate when fine-tuning")
+    parser.add_argument("--validation-split", type=float, default=0.1,
+                        help="Most recent fraction of the samples held out for early stopping")
+    parser.add_argument("--patience", type=int, default=3, help="Epochs without validation improvement before stopping")
+    parser.add_argument("--max-train-seconds", type=float, default=0, help="Wall-clock cap on fit(), 0 for none")
+    parser.add_argument("--model-dir", default=os.environ.get("SM_MODEL_DIR", "/opt/ml/model"),
+                        help="Directory where model.h5 (and model.pack) are written")
+    parser.add_argument("--pack-dtype", choices=DTYPES + ("none",), default="float16",
+                        help="Precision of the compact model.pack published to the devices, 'none' to skip it")
+    parser.add_argument("--holdout", default=os.environ.get("SM_CHANNEL_HOLDOUT"),
+                        help="Fixed evaluation files (the 'holdout' channel) scored into evaluation.json")
+    parser.add_argument("--baseline-model", default=os.environ.get("SM_CHANNEL_BASELINE"),
+                        help="Deployed model scored on the holdout too (--base-model by default)")
+    parser.add_argument("--eval-batch-size", type=int, default=4096, help="Windows per predict() call on the holdout")
+    parser.add_argument("--benchmark-windowing", type=int, default=0, metavar="N_SAMPLES",
+                        help="Only compare windowing methods on N_SAMPLES synthetic samples and exit")
+    # Le toolkit TensorFlow de SageMaker ajoute --model_dir (S3) aux hyperparametres en script mode
+    args, _ = parser.parse_known_args()
+
+    if args.benchmark_windowing:
+        benchmark_windowing(args.benchmark_windowing, args.timesteps, args.horizon,
+                            3 if args.features == "phases" else 1, args.batch_size)
+        raise SystemExit(0)
+
+    # Load and prepare data (float32, colonnes utiles seulement ; les fenetres sont des vues)
+    segments = load_segments(args.data, args.features)
+    segments, validation_segments = split_validation(segments, args.validation_split, args.timesteps)
+
+    # Plusieurs instances : donnees reparties par cle S3, un worker TensorFlow par instance
+    hosts, current_host = cluster_hosts()
+    strategy = distribution_strategy(hosts, current_host)
+    chief = strategy is None or current_host == hosts[0]
+
     # Define path for saving the model
-    h5_model_path = "/opt/ml/model/model.h5"
-    
+    # Tous les workers sauvegardent (operation collective) ; seul le premier ecrit dans le dossier publie
+    model_dir = args.model_dir if chief else tempfile.mkdtemp(prefix="worker_model_")
+    h5_model_path = os.path.join(model_dir, "model.h5")
+
     # Train and save model
-    train_and_save_model(train_data, train_labels, args.epochs, h5_model_path)
\ No newline at end of file
+    best_loss = train_and_save_streaming(segments, args.timesteps, args.horizon, args.epochs, h5_model_path,
+                                         args.batch_size, validation_segments, args.base_model, args.patience,
+                                         args.max_train_seconds, args.learning_rate, args.units, strategy)
+    # Metrique objectif de la recherche d'hyperparametres (MetricDefinitions du Lambda de lancement)
+    print(f"validation:loss={best_loss:.8g}")
+    if args.pack_dtype != "none" and chief:
+        try:
+            save_model_pack(h5_model_path, args.pack_dtype)
+        except ValueError as e:
+            # La Lambda de deploiement publie alors le model.tar.gz complet
+            print(f"No model pack written: {e}")
+    if args.holdout and chief:
+        evaluation = evaluate_on_holdout(h5_model_path, args.holdout, args.baseline_model or args.base_model,
+                                         args.timesteps, args.horizon, args.features, args.eval_batch_size)
+        if evaluation is not None:
+            with open(os.path.join(model_dir, EVALUATION_NAME), "w") as f:
+                json.dump(evaluation, f)
\ No newline at end of file
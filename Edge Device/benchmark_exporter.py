@@ -0,0 +1,92 @@
+"""
+Offline throughput / latency benchmark of ``S3Exporter``.
+
+Runs against ``FakeStreamManagerClient`` (no Greengrass Nucleus needed):
+
+    python benchmark_exporter.py --uploads 200 --latency 0.2 --parallel 4
+
+The "legacy" scenario reproduces the former ``send_data_to_cloud()`` pattern:
+a new client per upload, both streams deleted and recreated, and the next
+upload only starting once the previous one has finished.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from exporter import S3Exporter
+from fake_stream_manager import FakeStreamManagerClient
+
+
+def make_files(count, size):
+    directory = tempfile.mkdtemp(prefix="clemap_export_bench_")
+    payload = os.urandom(size)
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"Clemap_train_{i}.csv.gz")
+        with open(path, "wb") as f:
+            f.write(payload)
+        paths.append(path)
+    return paths
+
+
+def run_exporter(paths, fake):
+    latencies = []
+    start = time.perf_counter()
+    with S3Exporter(client_factory=lambda: fake, read_timeout_millis=100) as exporter:
+        submitted = []
+        for path in paths:
+            t0 = time.perf_counter()
+            future = exporter.submit(path, "data/" + os.path.basename(path))
+            future.add_done_callback(lambda f, t0=t0: latencies.append(time.perf_counter() - t0))
+            submitted.append(future)
+        ok = sum(future.result() for future in submitted)
+    return ok, time.perf_counter() - start, latencies
+
+
+def run_legacy(paths, fake):
+    latencies = []
+    start = time.perf_counter()
+    ok = 0
+    for path in paths:
+        t0 = time.perf_counter()
+        # Ancien schema : client, flux de statuts et flux d'export recrees a chaque upload
+        exporter = S3Exporter(client_factory=lambda: fake, read_timeout_millis=100)
+        try:
+            fake.delete_message_stream(exporter.stream_name)
+        except Exception:
+            pass
+        with exporter:
+            ok += exporter.submit(path, "data/" + os.path.basename(path)).result()
+        latencies.append(time.perf_counter() - t0)
+    return ok, time.perf_counter() - start, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--uploads", type=int, default=100)
+    parser.add_argument("--size", type=int, default=64 * 1024, help="Size of each file in bytes")
+    parser.add_argument("--latency", type=float, default=0.1, help="Simulated S3 upload latency in seconds")
+    parser.add_argument("--parallel", type=int, default=4, help="Simulated parallel uploads of the server")
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args()
+
+    paths = make_files(args.uploads, args.size)
+    scenarios = {"exporter": run_exporter}
+    if not args.skip_legacy:
+        scenarios["legacy"] = run_legacy
+
+    print(f"{'scenario':<10} {'ok':>5} {'total s':>8} {'uploads/s':>10} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, run in scenarios.items():
+        fake = FakeStreamManagerClient(upload_latency=args.latency, max_parallel_uploads=args.parallel)
+        ok, elapsed, latencies = run(paths, fake)
+        latencies = np.array(latencies) * 1e3
+        print(f"{name:<10} {ok:>5} {elapsed:>8.2f} {len(paths) / elapsed:>10.1f} "
+              f"{np.percentile(latencies, 50):>8.1f} {np.percentile(latencies, 95):>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Latency / RSS benchmark and Keras parity check for the inference backends.
+
+Each backend runs in its own process so that the peak RSS of the NumPy backend
+is not polluted by a TensorFlow import:
+
+    python benchmark_inference.py --model /tmp/model.h5 --backends numpy keras
+
+The NumPy (and TFLite) predictions are compared with the Keras ones on the same
+seeded inputs; the script exits with status 1 if they differ by more than
+``--atol``.
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+
+def run_worker(args):
+    from inference import load_backend
+
+    start = time.perf_counter()
+    model = load_backend(args.model, args.worker)
+    load_seconds = time.perf_counter() - start
+
+    rng = np.random.default_rng(args.seed)
+    parity_input = rng.uniform(0.0, args.scale, size=(args.parity_samples, args.timesteps, 1)).astype(np.float32)
+    parity_output = model.predict(parity_input)
+
+    sample = parity_input[:args.batch]
+    for _ in range(args.warmup):
+        model.predict(sample)
+    latencies = np.empty(args.iterations)
+    for i in range(args.iterations):
+        t0 = time.perf_counter()
+        model.predict(sample)
+        latencies[i] = time.perf_counter() - t0
+
+    print(json.dumps({
+        "backend": args.worker,
+        "load_ms": load_seconds * 1e3,
+        "p50_ms": float(np.percentile(latencies, 50) * 1e3),
+        "p95_ms": float(np.percentile(latencies, 95) * 1e3),
+        "p99_ms": float(np.percentile(latencies, 99) * 1e3),
+        # ru_maxrss est en kilo-octets sous Linux
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "parity_output": np.asarray(parity_output, dtype=np.float64).tolist(),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="/tmp/model.h5")
+    parser.add_argument("--backends", nargs="+", default=["numpy", "keras"])
+    parser.add_argument("--timesteps", type=int, default=10)
+    parser.add_argument("--batch", type=int, default=1)
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--parity-samples", type=int, default=64)
+    parser.add_argument("--scale", type=float, default=1.0, help="Amplitude of the random parity inputs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--atol", type=float, default=1e-4)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    results = {}
+    for backend in args.backends:
+        cmd = [
+            sys.executable, __file__, "--worker", backend,
+            "--model", args.model,
+            "--timesteps", str(args.timesteps),
+            "--batch", str(args.batch),
+            "--iterations", str(args.iterations),
+            "--warmup", str(args.warmup),
+            "--parity-samples", str(args.parity_samples),
+            "--scale", str(args.scale),
+            "--seed", str(args.seed),
+        ]
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(f"{backend}: failed\n{proc.stderr.strip()}")
+            continue
+        results[backend] = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    print(f"{'backend':<8} {'load ms':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'RSS MB':>8}")
+    for backend, r in results.items():
+        print(f"{backend:<8} {r['load_ms']:>9.1f} {r['p50_ms']:>8.3f} {r['p95_ms']:>8.3f} "
+              f"{r['p99_ms']:>8.3f} {r['max_rss_mb']:>8.1f}")
+
+    if "keras" not in results:
+        return
+    reference = np.array(results["keras"]["parity_output"])
+    ok = True
+    for backend, r in results.items():
+        if backend == "keras":
+            continue
+        # equal_nan : un modele aux poids NaN doit donner NaN partout, quel que soit le backend
+        diff = np.abs(np.array(r["parity_output"]) - reference)
+        max_diff = float(np.nanmax(diff)) if np.isfinite(diff).any() else 0.0
+        match = np.allclose(r["parity_output"], reference, atol=args.atol, equal_nan=True)
+        print(f"parity {backend} vs keras: max abs diff {max_diff:.2e} -> {'OK' if match else 'MISMATCH'}")
+        ok = ok and match
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+Offline end-to-end replay of the edge pipeline, faster than real time.
+
+    python benchmark_pipeline.py --meters 2 --history 20000 --live 30000 --speedup 2000 --drift-at 0.5
+
+Builds synthetic meter databases (``synthetic_db.py``), keeps appending rows to
+them at ``--speedup`` times the real rate, and runs the ``EdgeRuntime`` of
+``main.py`` on them: tailing, batched inference, drift monitor, retrain report
+and upload through ``S3Exporter`` on ``FakeStreamManagerClient``. No device
+database, Greengrass Nucleus or AWS account is needed.
+
+Reports ingestion throughput, the lag left when the writers stop, inference
+latency percentiles, drift triggers and uploads. ``--save`` writes the
+results as JSON; ``--baseline`` compares with a saved run and exits with
+status 1 when throughput or latency regressed by more than ``--tolerance``.
+The Lambdas have their own replay in ``AWS/Lambdas/benchmark_lambdas.py``.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tarfile
+import tempfile
+import threading
+import time
+
+import h5py
+import numpy as np
+
+import main
+import metrics
+from drift import DriftMonitor
+from exporter import S3Exporter
+from fake_stream_manager import FakeStreamManagerClient
+from inference import load_backend
+from meters import Meter, MeterBank
+from model_manager import ModelManager
+from reader import MeterReader
+from runtime import EdgeRuntime
+from synthetic_db import create_meter_db
+
+REPO_MODEL_TAR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "model.tar")
+
+# +1 : une hausse est une regression ; -1 : une baisse est une regression
+REGRESSION_KEYS = {"ingest_rows_per_s": -1, "inference_p50_ms": 1, "inference_p95_ms": 1}
+
+
+class CountingReader(MeterReader):
+    """``MeterReader`` counting the rows handed to the runtime."""
+
+    rows = 0
+
+    def fetch_new(self):
+        rows = super().fetch_new()
+        self.rows += len(rows)
+        return rows
+
+
+class TimedModel:
+    """Records the latency of every ``predict`` call of the wrapped backend."""
+
+    def __init__(self, model):
+        self.model = model
+        self.name = getattr(model, "name", type(model).__name__)
+        self.latencies = []
+
+    def predict(self, x, verbose=0):
+        start = time.perf_counter()
+        output = self.model.predict(x)
+        self.latencies.append(time.perf_counter() - start)
+        return output
+
+
+def extract_repo_model(work_dir, seed=0):
+    """model.h5 of the repo's model.tar with seeded weights: its stored weights are NaN."""
+    with tarfile.open(REPO_MODEL_TAR) as tar:
+        tar.extract("model.h5", work_dir)
+    path = os.path.join(work_dir, "model.h5")
+    rng = np.random.default_rng(seed)
+    with h5py.File(path, "r+") as f:
+        f["model_weights"].visititems(
+            lambda name, obj: obj.write_direct(rng.normal(0, 0.1, obj.shape).astype(obj.dtype))
+            if isinstance(obj, h5py.Dataset) else None
+        )
+    return path
+
+
+def feed(meters, rows, rate, stop, tick=0.02):
+    """Appends ``rows`` rows to every meter at ``rate`` rows per second and per meter."""
+    per_tick = max(1, int(round(rate * tick)))
+    end = meters[0].written + rows
+    deadline = time.perf_counter()
+    while meters[0].written < end and not stop.is_set():
+        count = min(per_tick, end - meters[0].written)
+        for meter in meters:
+            meter.append(count)
+        deadline += count / rate
+        delay = deadline - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+
+async def replay(runtime, meters, feeder, exporter, timeout):
+    """Runs the runtime until the feeder is done and every row, report and upload has been processed.
+
+    Returns the seconds needed to catch up once the feeder stopped.
+    """
+    async def drain():
+        while feeder.is_alive():
+            await asyncio.sleep(0.01)
+        start = time.perf_counter()
+        # Rattrapage : toutes les lignes ecrites ont ete lues, predites et evaluees, et les uploads sont finis
+        while time.perf_counter() - start < timeout:
+            caught_up = all(meter.reader.last_time == synthetic.last_time
+                            for meter, synthetic in zip(runtime.bank, meters))
+            idle = runtime.samples.empty() and runtime.evaluations.empty() and runtime.exports.empty()
+            if caught_up and idle and exporter.in_flight == 0:
+                break
+            await asyncio.sleep(0.005)
+        runtime.stop()
+        return time.perf_counter() - start
+
+    _, drain_seconds = await asyncio.gather(runtime.run(), drain())
+    return drain_seconds
+
+
+def percentile_ms(values, q):
+    return float(np.percentile(values, q) * 1e3) if len(values) else float("nan")
+
+
+def run(args):
+    work_dir = tempfile.mkdtemp(prefix="clemap_pipeline_bench_")
+    model_path = args.model or extract_repo_model(work_dir, args.seed)
+    live_rate = args.speedup / args.period
+
+    meters = []
+    for i in range(args.meters):
+        drift_at = None if args.drift_at is None else args.history + int(args.drift_at * args.live)
+        meter = create_meter_db(os.path.join(work_dir, f"meter_{i}.db"), args.history, period=args.period,
+                                seed=args.seed + i, drift_at=drift_at)
+        meters.append(meter)
+
+    # Meme branchement que run_runtime() : rapports et uploads passent par les fonctions de main.py
+    main.export_dir = os.path.join(work_dir, "exports")
+    os.makedirs(main.export_dir)
+    main.dataset_exporters.clear()
+    fake = FakeStreamManagerClient(bucket_dir=os.path.join(work_dir, "s3"), upload_latency=args.upload_latency)
+    main.s3_exporter = S3Exporter(client_factory=lambda: fake, read_timeout_millis=100).open()
+
+    bank = MeterBank([Meter(f"meter_{i}", CountingReader(meter.db_path), args.timesteps, args.features)
+                      for i, meter in enumerate(meters)])
+    manager = ModelManager(model_path, lambda path: TimedModel(load_backend(path, args.backend)),
+                           timesteps=args.timesteps, features=bank.n_features)
+    manager.load_initial()
+    drift = DriftMonitor()
+    manager.add_listener(drift.reset)
+    runtime = EdgeRuntime(
+        bank=bank,
+        model_manager=manager,
+        report_fn=lambda meter: main.create_error_report(meter.reader.db_path, "Clemap_train_" + meter.name),
+        export_fn=lambda report: main.request_retrain(report, manager),
+        should_retrain=drift,
+        poll_interval=min(args.period / args.speedup, 0.05),
+    )
+    retrains_before = metrics.RETRAIN_REQUESTS.value
+    failures_before = metrics.UPLOAD_FAILURES.value
+
+    stop = threading.Event()
+    feeder = threading.Thread(target=feed, args=(meters, args.live, live_rate, stop), name="synthetic-feed")
+    start = time.perf_counter()
+    feeder.start()
+    try:
+        drain_seconds = asyncio.run(replay(runtime, meters, feeder, main.s3_exporter, args.timeout))
+    finally:
+        stop.set()
+        feeder.join()
+        main.s3_exporter.close()
+        main.s3_exporter = None
+        for meter in meters:
+            meter.close()
+    elapsed = time.perf_counter() - start
+
+    model = manager.current
+    ingested = sum(meter.reader.rows for meter in bank)
+    uploaded = sum(len(files) for _, _, files in os.walk(fake.bucket_dir))
+    return {
+        "meters": args.meters,
+        "live_rows": args.live * args.meters,
+        "backend": model.name,
+        "elapsed_s": elapsed,
+        "simulated_s": args.live * args.period,
+        "ingested_rows": ingested,
+        "ingest_rows_per_s": ingested / elapsed,
+        "drain_seconds": drain_seconds,
+        "predictions": len(model.latencies),
+        "inference_p50_ms": percentile_ms(model.latencies, 50),
+        "inference_p95_ms": percentile_ms(model.latencies, 95),
+        "inference_p99_ms": percentile_ms(model.latencies, 99),
+        "drift_triggers": metrics.RETRAIN_REQUESTS.value - retrains_before,
+        "uploads": uploaded,
+        "upload_failures": metrics.UPLOAD_FAILURES.value - failures_before,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Returns the regressions of ``results`` against ``baseline`` beyond ``tolerance`` (a fraction)."""
+    regressions = []
+    for key, direction in REGRESSION_KEYS.items():
+        old, new = baseline.get(key), results.get(key)
+        if not old or new is None:
+            continue
+        if direction * (new - old) / old > tolerance:
+            regressions.append(f"{key}: {old:.3f} -> {new:.3f}")
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--meters", type=int, default=1)
+    parser.add_argument("--history", type=int, default=20000, help="Rows already in each database at start")
+    parser.add_argument("--live", type=int, default=20000, help="Rows appended to each database during the replay")
+    parser.add_argument("--period", type=float, default=1.0, help="Simulated seconds between two rows")
+    parser.add_argument("--speedup", type=float, default=1000.0, help="Replay speed relative to real time")
+    parser.add_argument("--drift-at", type=float, default=0.5, help="Fraction of the live rows after which the load drifts")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--model", default=None, help="Keras .h5 model (architecture of the repo's model.tar by default)")
+    parser.add_argument("--backend", default=None, help="Inference backend (CLEMAP_INFERENCE_BACKEND by default)")
+    parser.add_argument("--timesteps", type=int, default=10)
+    parser.add_argument("--features", choices=["sum", "phases"], default="sum")
+    parser.add_argument("--upload-latency", type=float, default=0.05, help="Simulated S3 upload latency in seconds")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Seconds allowed to drain after the last row")
+    parser.add_argument("--save", default=None, help="Write the results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="JSON results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    # main.py configure le logging en INFO : une ligne par prediction fausserait la mesure
+    logging.getLogger().setLevel(args.log_level)
+    results = run(args)
+
+    print(f"\n{results['meters']} meter(s), {results['live_rows']} live rows "
+          f"({results['simulated_s']:.0f} simulated s in {results['elapsed_s']:.2f} s), backend {results['backend']}")
+    print(f"ingestion      {results['ingest_rows_per_s']:>10.0f} rows/s, lag {results['drain_seconds'] * 1e3:.0f} ms "
+          f"when the writers stop")
+    print(f"inference      {results['predictions']:>10} calls, p50 {results['inference_p50_ms']:.3f} ms, "
+          f"p95 {results['inference_p95_ms']:.3f} ms, p99 {results['inference_p99_ms']:.3f} ms")
+    print(f"drift          {results['drift_triggers']:>10} retrain requests, {results['uploads']} uploads, "
+          f"{results['upload_failures']} failures")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        raise SystemExit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main_cli()
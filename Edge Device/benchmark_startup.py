@@ -0,0 +1,73 @@
+"""
+Cold-start benchmark for the edge predictor.
+
+Every scenario runs in a fresh interpreter and measures the wall time from
+process start until the model is loaded and has produced a first prediction:
+
+    python benchmark_startup.py --model /tmp/model.h5 --runs 5
+
+Scenarios: ``numpy-cold`` (empty weight cache, parses the ``.h5``),
+``numpy-warm`` (SHA-256 keyed ``.npz`` cache hit) and ``keras`` (original
+``load_model`` path, skipped when TensorFlow is not installed).
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+WORKER = """
+import numpy as np
+from inference import load_backend
+model = load_backend({model!r}, {backend!r})
+model.predict(np.zeros((1, {timesteps}, 1), dtype=np.float32))
+"""
+
+
+def run_once(model, backend, timesteps, cache_dir):
+    env = dict(os.environ, CLEMAP_MODEL_CACHE=cache_dir, PYTHONPATH=HERE)
+    code = WORKER.format(model=model, backend=backend, timesteps=timesteps)
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="/tmp/model.h5")
+    parser.add_argument("--timesteps", type=int, default=10)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    cache_dir = tempfile.mkdtemp(prefix="clemap_cache_")
+    results = {}
+    try:
+        cold = []
+        for _ in range(args.runs):
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            cold.append(run_once(args.model, "numpy", args.timesteps, cache_dir))
+        results["numpy-cold"] = cold
+        results["numpy-warm"] = [run_once(args.model, "numpy", args.timesteps, cache_dir) for _ in range(args.runs)]
+        try:
+            results["keras"] = [run_once(args.model, "keras", args.timesteps, cache_dir) for _ in range(args.runs)]
+        except RuntimeError as e:
+            print(f"keras: skipped ({e})")
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    print(f"{'scenario':<12} {'median s':>9} {'min s':>8} {'max s':>8}")
+    for name, times in results.items():
+        print(f"{name:<12} {statistics.median(times):>9.3f} {min(times):>8.3f} {max(times):>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
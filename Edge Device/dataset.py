@@ -0,0 +1,195 @@
+"""
+Incremental training-set export from ``meter_data``.
+
+``DatasetExporter`` streams the rows of a time range with ``fetchmany`` and
+writes them to a compressed file (gzip CSV, or Parquet when ``pyarrow`` is
+installed) with the timestamp, the three phases and their sum in ``target``.
+Only rows newer than the watermark of the last successful upload are exported;
+the watermark is moved by ``commit()`` once the upload has succeeded.
+"""
+
+import csv
+import gzip
+import json
+import logging
+import os
+import sqlite3
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - optional on the device
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ["time", "l1_p", "l2_p", "l3_p", "target"]
+
+FORMATS = {"csv.gz": ".csv.gz", "parquet": ".parquet"}
+
+
+class ExportResult:
+    def __init__(self, db_path, path, rows, first_time, last_time):
+        self.db_path = db_path
+        self.path = path
+        self.rows = rows
+        self.first_time = first_time
+        self.last_time = last_time
+
+    def __repr__(self):
+        return f"ExportResult({self.path!r}, rows={self.rows}, {self.first_time!r} -> {self.last_time!r})"
+
+
+class DatasetExporter:
+    """Exports the rows added since the last successful upload of one meter database."""
+
+    RANGE_QUERY = """
+    SELECT time, l1_p, l2_p, l3_p
+    FROM meter_data
+    WHERE time > ? AND time <= ?
+    ORDER BY time ASC
+    """
+
+    # Borne de depart de la premiere exportation : les `initial_rows` lignes les plus recentes
+    START_QUERY = """
+    SELECT time
+    FROM meter_data
+    ORDER BY time DESC
+    LIMIT 1 OFFSET ?
+    """
+
+    BOUNDS_QUERY = "SELECT MIN(time), MAX(time) FROM meter_data"
+
+    def __init__(self, db_path, output_dir="/tmp", name="Clemap_train", watermark_path=None,
+                 fmt="csv.gz", chunk_size=10000, initial_rows=100000):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown export format '{fmt}', expected one of {sorted(FORMATS)}")
+        if fmt == "parquet" and pa is None:
+            raise ValueError("The parquet export format needs pyarrow")
+        self.db_path = db_path
+        self.output_dir = output_dir
+        self.name = _slug(name)
+        self.watermark_path = watermark_path or os.path.join(output_dir, f"{self.name}.watermark.json")
+        self.fmt = fmt
+        self.chunk_size = chunk_size
+        self.initial_rows = initial_rows
+
+    @property
+    def watermark(self):
+        """``time`` of the last row of the last successful upload, or None."""
+        try:
+            with open(self.watermark_path) as f:
+                return json.load(f)["time"]
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+
+    def commit(self, result):
+        """Records ``result`` as uploaded: the next export starts after its last row."""
+        watermark = self.watermark
+        # Plusieurs uploads peuvent etre en vol : un upload plus ancien ne doit pas faire reculer le watermark
+        if watermark is None or result.last_time > watermark:
+            tmp_path = f"{self.watermark_path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"time": result.last_time, "rows": result.rows, "path": result.path}, f)
+            os.replace(tmp_path, self.watermark_path)
+        # Le fichier est dans S3, inutile de le garder dans /tmp
+        try:
+            os.remove(result.path)
+        except FileNotFoundError:
+            pass
+
+    def export(self, start=None, end=None):
+        """Writes rows with ``start < time <= end`` (defaults: watermark, newest row). Returns None if empty."""
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+        try:
+            lowest, newest = conn.execute(self.BOUNDS_QUERY).fetchone()
+            if newest is None:
+                return None
+            if start is None:
+                start = self.watermark
+            if start is None:
+                row = conn.execute(self.START_QUERY, (self.initial_rows,)).fetchone()
+                # Moins de `initial_rows` lignes en base : tout exporter
+                start = row[0] if row else _before(lowest)
+            if end is None:
+                end = newest
+            cursor = conn.execute(self.RANGE_QUERY, (start, end))
+            return self._write(cursor)
+        finally:
+            conn.close()
+
+    def _write(self, cursor):
+        path = os.path.join(self.output_dir, f"{self.name}.partial{FORMATS[self.fmt]}")
+        writer = _ParquetWriter(path) if self.fmt == "parquet" else _CsvGzWriter(path)
+        rows = 0
+        first_time = last_time = None
+        try:
+            while True:
+                chunk = cursor.fetchmany(self.chunk_size)
+                if not chunk:
+                    break
+                if first_time is None:
+                    first_time = chunk[0][0]
+                last_time = chunk[-1][0]
+                rows += len(chunk)
+                writer.write(chunk)
+        finally:
+            writer.close()
+        if not rows:
+            os.remove(path)
+            return None
+        # Nom unique par plage exportee : les uploads successifs ne s'ecrasent pas dans S3
+        final_path = os.path.join(
+            self.output_dir, f"{self.name}_{_slug(first_time)}_{_slug(last_time)}{FORMATS[self.fmt]}"
+        )
+        os.replace(path, final_path)
+        logger.info("Exported %d rows (%s -> %s) to %s", rows, first_time, last_time, final_path)
+        return ExportResult(self.db_path, final_path, rows, first_time, last_time)
+
+
+def _before(value):
+    # Valeur strictement inferieure a `value` pour inclure la premiere ligne avec `time > ?`
+    return value - 1 if isinstance(value, (int, float)) else ""
+
+
+def _slug(value):
+    return "".join(c if c.isalnum() or c in "_-" else "-" for c in str(value))
+
+
+class _CsvGzWriter:
+    def __init__(self, path):
+        self._file = gzip.open(path, "wt", newline="", compresslevel=6)
+        self._csv = csv.writer(self._file)
+        self._csv.writerow(COLUMNS)
+
+    def write(self, chunk):
+        # target = l1_p + l2_p + l3_p, la colonne lue par train_lstm.py
+        self._csv.writerows((t, l1, l2, l3, l1 + l2 + l3) for t, l1, l2, l3 in chunk)
+
+    def close(self):
+        self._file.close()
+
+
+class _ParquetWriter:
+    def __init__(self, path):
+        self._path = path
+        self._writer = None
+
+    def write(self, chunk):
+        times, l1, l2, l3 = zip(*chunk)
+        table = pa.table({
+            "time": list(times),
+            "l1_p": pa.array(l1, pa.float32()),
+            "l2_p": pa.array(l2, pa.float32()),
+            "l3_p": pa.array(l3, pa.float32()),
+            "target": pa.array([a + b + c for a, b, c in zip(l1, l2, l3)], pa.float32()),
+        })
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self._path, table.schema, compression="zstd")
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        elif not os.path.exists(self._path):
+            open(self._path, "wb").close()
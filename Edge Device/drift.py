@@ -0,0 +1,170 @@
+"""
+Streaming drift detection on prediction errors.
+
+The edge loop used to request a full retrain as soon as one prediction was
+NaN or off by more than 0.05. ``DriftDetector`` keeps O(1) state per meter
+(EWMA of the absolute error, a Page-Hinkley test on that error and NaN
+counters) and only fires when a condition holds for ``persistence``
+consecutive samples, with a cooldown and hysteresis between two triggers.
+A detector that stays disarmed until its cooldown runs out re-arms, so a
+retrain that never arrived (failed upload, rejected model) is requested again.
+"""
+
+import logging
+import math
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def _env_float(name, default):
+    return float(os.environ.get(name, default))
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+class DriftConfig:
+    """Thresholds of the detector, overridable with ``CLEMAP_DRIFT_*`` environment variables."""
+
+    def __init__(self, mae_threshold=0.05, rearm_threshold=None, ewma_alpha=0.1, ph_delta=0.005,
+                 ph_lambda=1.0, nan_limit=5, persistence=10, min_samples=30, cooldown=600):
+        self.mae_threshold = mae_threshold
+        # Hysteresis : apres un declenchement, l'EWMA doit repasser sous ce seuil avant de pouvoir redeclencher
+        self.rearm_threshold = mae_threshold / 2 if rearm_threshold is None else rearm_threshold
+        self.ewma_alpha = ewma_alpha
+        self.ph_delta = ph_delta
+        self.ph_lambda = ph_lambda
+        self.nan_limit = nan_limit
+        self.persistence = persistence
+        self.min_samples = min_samples
+        # Nombre d'echantillons ignores apres un declenchement ; a son terme le detecteur se rearme
+        # meme si l'erreur est restee haute (0 : seule l'hysteresis rearme)
+        self.cooldown = cooldown
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            mae_threshold=_env_float("CLEMAP_DRIFT_MAE", 0.05),
+            rearm_threshold=float(os.environ["CLEMAP_DRIFT_REARM"]) if "CLEMAP_DRIFT_REARM" in os.environ else None,
+            ewma_alpha=_env_float("CLEMAP_DRIFT_ALPHA", 0.1),
+            ph_delta=_env_float("CLEMAP_DRIFT_PH_DELTA", 0.005),
+            ph_lambda=_env_float("CLEMAP_DRIFT_PH_LAMBDA", 1.0),
+            nan_limit=_env_int("CLEMAP_DRIFT_NAN_LIMIT", 5),
+            persistence=_env_int("CLEMAP_DRIFT_PERSISTENCE", 10),
+            min_samples=_env_int("CLEMAP_DRIFT_MIN_SAMPLES", 30),
+            cooldown=_env_int("CLEMAP_DRIFT_COOLDOWN", 600),
+        )
+
+
+class DriftDetector:
+    """Rolling error statistics and retrain decision for one meter."""
+
+    def __init__(self, config=None):
+        self.config = config or DriftConfig()
+        self.samples = 0
+        self.ewma_mae = 0.0
+        self.nan_count = 0
+        self.nan_run = 0
+        self.triggers = 0
+        self.last_reason = None
+        self._breach_run = 0
+        self._cooldown_left = 0
+        self._armed = True
+        self._reset_page_hinkley()
+
+    def _reset_page_hinkley(self):
+        self._ph_n = 0
+        self._ph_mean = 0.0
+        self._ph_sum = 0.0
+        self._ph_min = 0.0
+
+    @property
+    def page_hinkley(self):
+        return self._ph_sum - self._ph_min
+
+    def update(self, predicted, actual):
+        """Feeds one (prediction, real value) pair. Returns True when a retrain should be requested."""
+        cfg = self.config
+        if self._cooldown_left:
+            self._cooldown_left -= 1
+            if not self._cooldown_left:
+                # Toujours au-dessus du seuil apres le cooldown : le reentrainement demande n'a rien corrige
+                self._armed = True
+
+        if predicted is None or math.isnan(predicted) or math.isnan(actual):
+            self.nan_count += 1
+            self.nan_run += 1
+            if self.nan_run >= cfg.nan_limit:
+                return self._trigger(f"{self.nan_run} consecutive NaN predictions")
+            return False
+        self.nan_run = 0
+
+        error = abs(predicted - actual)
+        self.samples += 1
+        if self.samples == 1:
+            self.ewma_mae = error
+        else:
+            self.ewma_mae += cfg.ewma_alpha * (error - self.ewma_mae)
+
+        # Page-Hinkley sur l'erreur absolue : detecte une hausse durable de l'erreur moyenne
+        self._ph_n += 1
+        self._ph_mean += (error - self._ph_mean) / self._ph_n
+        self._ph_sum += error - self._ph_mean - cfg.ph_delta
+        self._ph_min = min(self._ph_min, self._ph_sum)
+
+        if not self._armed and self.ewma_mae < cfg.rearm_threshold:
+            self._armed = True
+        if self.samples < cfg.min_samples:
+            return False
+
+        self._breach_run = self._breach_run + 1 if self.ewma_mae > cfg.mae_threshold else 0
+        if self._breach_run >= cfg.persistence:
+            return self._trigger(f"EWMA MAE {self.ewma_mae:.4f} above {cfg.mae_threshold} for {self._breach_run} samples")
+        if self.page_hinkley > cfg.ph_lambda:
+            return self._trigger(f"Page-Hinkley {self.page_hinkley:.4f} above {cfg.ph_lambda}")
+        return False
+
+    def _trigger(self, reason):
+        if self._cooldown_left or not self._armed:
+            return False
+        self.triggers += 1
+        self.last_reason = reason
+        self._cooldown_left = self.config.cooldown
+        self._armed = False
+        self._breach_run = 0
+        self.nan_run = 0
+        self._reset_page_hinkley()
+        logger.info("Drift detected: %s", reason)
+        return True
+
+    def state(self):
+        return {
+            "samples": self.samples,
+            "ewma_mae": self.ewma_mae,
+            "page_hinkley": self.page_hinkley,
+            "nan_count": self.nan_count,
+            "triggers": self.triggers,
+        }
+
+
+class DriftMonitor:
+    """One ``DriftDetector`` per meter, usable as the runtime's ``should_retrain(meter, predicted, actual)``."""
+
+    def __init__(self, config=None):
+        self.config = config or DriftConfig.from_env()
+        self.detectors = {}
+
+    def detector(self, meter):
+        detector = self.detectors.get(meter)
+        if detector is None:
+            detector = self.detectors[meter] = DriftDetector(self.config)
+        return detector
+
+    def __call__(self, meter, predicted, actual):
+        return self.detector(meter).update(predicted, actual)
+
+    def reset(self, *args):
+        """Forgets all statistics, e.g. after a model swap (accepts the ModelManager listener arguments)."""
+        self.detectors = {}
@@ -0,0 +1,200 @@
+"""
+Long-lived S3 exporter on top of Stream Manager.
+
+``send_data_to_cloud()`` used to build a new ``StreamManagerClient``, delete and
+recreate both streams, append one task and busy-poll the status stream for
+every upload. ``S3Exporter`` opens the client and the streams once, appends
+export tasks without waiting, and resolves one ``concurrent.futures.Future``
+per S3 key from a background thread that follows the status stream, so
+several uploads can be in flight at the same time.
+"""
+
+import logging
+import threading
+import uuid
+from concurrent.futures import Future
+
+from stream_manager import (
+    ExportDefinition,
+    MessageStreamDefinition,
+    NotEnoughMessagesException,
+    ReadMessagesOptions,
+    ResourceNotFoundException,
+    S3ExportTaskDefinition,
+    S3ExportTaskExecutorConfig,
+    Status,
+    StatusConfig,
+    StatusLevel,
+    StatusMessage,
+    StrategyOnFull,
+    StreamManagerClient,
+    StreamManagerException,
+)
+from stream_manager.util import Util
+
+logger = logging.getLogger(__name__)
+
+
+class S3Exporter:
+    """Keeps one Stream Manager client and its streams alive and tracks S3 export tasks."""
+
+    def __init__(self, bucket_name="clemapbucket", stream_name="SomeStream",
+                 status_stream_name="SomeStatusStreamName", client_factory=StreamManagerClient,
+                 read_timeout_millis=1000, error_backoff=5.0):
+        self.bucket_name = bucket_name
+        self.stream_name = stream_name
+        self.status_stream_name = status_stream_name
+        self.client_factory = client_factory
+        self.read_timeout_millis = read_timeout_millis
+        # Pause apres une erreur de lecture (Stream Manager redemarre, flux supprime...) avant de reessayer
+        self.error_backoff = error_backoff
+        self.client = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._next_seq = 0
+
+    def open(self):
+        """Creates the client and the streams (once) and starts following the status stream."""
+        if self.client is not None:
+            return self
+        client = self.client_factory()
+        try:
+            self._create_streams(client)
+        except Exception:
+            # Pas d'exporteur a moitie ouvert : le prochain open() recommence depuis le debut
+            client.close()
+            raise
+        self.client = client
+
+        self._stop.clear()
+        self._next_seq = 0
+        self._thread = threading.Thread(target=self._follow_statuses, name="s3-exporter-status", daemon=True)
+        self._thread.start()
+        return self
+
+    def _create_streams(self, client):
+        """Recreates the status stream and creates (or updates) the export stream on ``client``."""
+        # Le flux de statuts repart de zero a chaque demarrage du process, pas a chaque upload
+        try:
+            client.delete_message_stream(stream_name=self.status_stream_name)
+        except ResourceNotFoundException:
+            pass
+        client.create_message_stream(
+            MessageStreamDefinition(name=self.status_stream_name, strategy_on_full=StrategyOnFull.OverwriteOldestData)
+        )
+
+        exports = ExportDefinition(
+            s3_task_executor=[
+                S3ExportTaskExecutorConfig(
+                    identifier="S3TaskExecutor" + self.stream_name,
+                    status_config=StatusConfig(
+                        status_level=StatusLevel.INFO,
+                        status_stream_name=self.status_stream_name,
+                    ),
+                )
+            ]
+        )
+        definition = MessageStreamDefinition(
+            name=self.stream_name, strategy_on_full=StrategyOnFull.OverwriteOldestData, export_definition=exports
+        )
+        try:
+            client.create_message_stream(definition)
+        except StreamManagerException:
+            # Le flux existe deja (redemarrage) : on le met a jour pour pointer sur le nouveau flux de statuts
+            client.update_message_stream(definition)
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(RuntimeError("S3 exporter closed before the upload finished"))
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def in_flight(self):
+        return len(self._pending)
+
+    def submit(self, file_path, key_name=None):
+        """Appends an S3 export task. Returns a Future resolved with True (uploaded) or False (failed/cancelled)."""
+        self.open()
+        key_name = key_name or f"data/{uuid.uuid4().hex}"
+        with self._lock:
+            future = self._pending.get(key_name)
+            if future is not None:
+                # Meme cle deja en cours d'envoi : on partage le resultat
+                return future
+            future = self._pending[key_name] = Future()
+            future.set_running_or_notify_cancel()
+        task = S3ExportTaskDefinition(input_url="file:" + file_path, bucket=self.bucket_name, key=key_name)
+        try:
+            sequence_number = self.client.append_message(
+                self.stream_name, Util.validate_and_serialize_to_json_bytes(task)
+            )
+        except Exception as e:
+            with self._lock:
+                self._pending.pop(key_name, None)
+            future.set_exception(e)
+            return future
+        logger.info("Appended S3 export task for %s -> s3://%s/%s (sequence number %d)",
+                    file_path, self.bucket_name, key_name, sequence_number)
+        return future
+
+    def _follow_statuses(self):
+        while not self._stop.is_set():
+            try:
+                messages = self.client.read_messages(
+                    self.status_stream_name,
+                    ReadMessagesOptions(
+                        desired_start_sequence_number=self._next_seq,
+                        min_message_count=1,
+                        read_timeout_millis=self.read_timeout_millis,
+                    ),
+                )
+            except NotEnoughMessagesException:
+                # Timeout de lecture sans nouveau statut
+                continue
+            except Exception:
+                if self._stop.is_set():
+                    break
+                logger.exception("Error while reading the export status stream, retrying in %.0f s",
+                                 self.error_backoff)
+                self._stop.wait(self.error_backoff)
+                continue
+            for message in messages:
+                self._next_seq = message.sequence_number + 1
+                self._handle_status(Util.deserialize_json_bytes_to_obj(message.payload, StatusMessage))
+
+    def _handle_status(self, status_message):
+        context = status_message.status_context
+        task = context.s3_export_task_definition if context is not None else None
+        if task is None:
+            return
+        if status_message.status == Status.InProgress:
+            logger.info("File upload is in Progress: %s", task.input_url)
+            return
+        if status_message.status == Status.Success:
+            logger.info("Successfully uploaded file at path %s to S3.", task.input_url)
+            result = True
+        elif status_message.status in (Status.Failure, Status.Canceled):
+            logger.info("Unable to upload file at path %s to S3. Message: %s", task.input_url, status_message.message)
+            result = False
+        else:
+            return
+        with self._lock:
+            future = self._pending.pop(task.key, None)
+        if future is not None:
+            future.set_result(result)
@@ -0,0 +1,132 @@
+"""
+In-process stand-in for ``StreamManagerClient``.
+
+Implements the calls used by ``S3Exporter`` with the real ``stream_manager``
+data classes, so exports can be benchmarked without a Greengrass Nucleus.
+An S3 export task appended to a stream with an S3 export definition is
+"uploaded" by copying the file into ``bucket_dir/<bucket>/<key>`` after
+``upload_latency`` seconds, with at most ``max_parallel_uploads`` uploads at a
+time, and its InProgress/Success/Failure statuses are appended to the status
+stream exactly like the real server does.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from stream_manager import (
+    EventType,
+    InvalidRequestException,
+    NotEnoughMessagesException,
+    ResourceNotFoundException,
+    S3ExportTaskDefinition,
+    Status,
+    StatusContext,
+    StatusLevel,
+    StatusMessage,
+)
+from stream_manager.data import Message
+from stream_manager.util import Util
+
+
+class FakeStreamManagerClient:
+    def __init__(self, bucket_dir=None, upload_latency=0.05, max_parallel_uploads=4, fail_keys=()):
+        self.bucket_dir = bucket_dir or tempfile.mkdtemp(prefix="fake_s3_")
+        self.upload_latency = upload_latency
+        self.fail_keys = set(fail_keys)
+        self._streams = {}
+        self._definitions = {}
+        self._cond = threading.Condition()
+        self._uploads = ThreadPoolExecutor(max_workers=max_parallel_uploads, thread_name_prefix="fake-s3")
+        self.closed = False
+        self.calls = {"create_message_stream": 0, "delete_message_stream": 0, "append_message": 0, "read_messages": 0}
+
+    def create_message_stream(self, definition):
+        self.calls["create_message_stream"] += 1
+        with self._cond:
+            if definition.name in self._streams:
+                raise InvalidRequestException(f"Message stream {definition.name} already exists")
+            self._streams[definition.name] = []
+            self._definitions[definition.name] = definition
+
+    def update_message_stream(self, definition):
+        with self._cond:
+            if definition.name not in self._streams:
+                raise ResourceNotFoundException(f"Message stream {definition.name} not found")
+            self._definitions[definition.name] = definition
+
+    def delete_message_stream(self, stream_name):
+        self.calls["delete_message_stream"] += 1
+        with self._cond:
+            if stream_name not in self._streams:
+                raise ResourceNotFoundException(f"Message stream {stream_name} not found")
+            del self._streams[stream_name]
+            del self._definitions[stream_name]
+
+    def append_message(self, stream_name, data):
+        self.calls["append_message"] += 1
+        sequence_number = self._append(stream_name, data)
+        definition = self._definitions[stream_name]
+        executors = definition.export_definition.s3_task_executor if definition.export_definition else None
+        if executors:
+            task = Util.deserialize_json_bytes_to_obj(data, S3ExportTaskDefinition)
+            status_stream = executors[0].status_config.status_stream_name
+            self._uploads.submit(self._upload, stream_name, status_stream, sequence_number, task)
+        return sequence_number
+
+    def read_messages(self, stream_name, options=None):
+        self.calls["read_messages"] += 1
+        start = options.desired_start_sequence_number or 0
+        min_count = options.min_message_count or 1
+        max_count = options.max_message_count
+        timeout = (options.read_timeout_millis or 0) / 1000
+        with self._cond:
+            if stream_name not in self._streams:
+                raise ResourceNotFoundException(f"Message stream {stream_name} not found")
+            self._cond.wait_for(lambda: len(self._streams.get(stream_name, ())) - start >= min_count, timeout)
+            messages = self._streams.get(stream_name, [])[start:]
+            if len(messages) < min_count:
+                raise NotEnoughMessagesException("Not enough messages")
+            return messages[:max_count] if max_count else list(messages)
+
+    def close(self):
+        # Comme le vrai client : fermer la connexion ne detruit ni les flux ni les exports en cours
+        self.closed = True
+
+    def _append(self, stream_name, payload):
+        with self._cond:
+            if stream_name not in self._streams:
+                raise ResourceNotFoundException(f"Message stream {stream_name} not found")
+            messages = self._streams[stream_name]
+            sequence_number = len(messages)
+            messages.append(Message(stream_name=stream_name, sequence_number=sequence_number,
+                                    ingest_time=int(time.time() * 1000), payload=payload))
+            self._cond.notify_all()
+        return sequence_number
+
+    def _status(self, status_stream, stream_name, sequence_number, task, status, message=None):
+        status_message = StatusMessage(
+            event_type=EventType.S3Task,
+            status_level=StatusLevel.INFO,
+            status=status,
+            status_context=StatusContext(s3_export_task_definition=task, stream_name=stream_name,
+                                         sequence_number=sequence_number),
+            message=message,
+            timestamp_epoch_ms=int(time.time() * 1000),
+        )
+        self._append(status_stream, Util.validate_and_serialize_to_json_bytes(status_message))
+
+    def _upload(self, stream_name, status_stream, sequence_number, task):
+        self._status(status_stream, stream_name, sequence_number, task, Status.InProgress)
+        time.sleep(self.upload_latency)
+        source = task.input_url[len("file:"):] if task.input_url.startswith("file:") else task.input_url
+        if task.key in self.fail_keys or not os.path.exists(source):
+            self._status(status_stream, stream_name, sequence_number, task, Status.Failure, "Simulated failure")
+            return
+        destination = os.path.join(self.bucket_dir, task.bucket, task.key)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.copyfile(source, destination)
+        self._status(status_stream, stream_name, sequence_number, task, Status.Success)
@@ -0,0 +1,335 @@
+"""
+Pluggable inference backends for the edge predictor.
+
+``model.predict`` on a single ``(1, 10, 1)`` window goes through the whole Keras
+graph machinery. The default ``numpy`` backend replays the LSTM + Dense forward
+pass of the model trained by ``train_lstm.py`` with plain NumPy, reading the
+weights straight from ``model.h5``. ``tflite`` and ``keras`` backends stay
+available and are selected with ``CLEMAP_INFERENCE_BACKEND``; TensorFlow is only
+imported when one of them is actually chosen.
+
+The weights parsed from an ``.h5`` file are cached as an uncompressed ``.npz``
+named after the SHA-256 of the source file, so later starts and hot-swaps of the
+same model skip ``h5py`` entirely.
+
+Every backend exposes ``predict(x)`` with ``x`` of shape
+``(batch, timesteps, features)`` and returns a ``(batch, outputs)`` array, so it
+is a drop-in replacement for the Keras model object.
+"""
+
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BACKEND = "numpy"
+
+# Cache des poids convertis, une entree .npz par SHA-256 de model.h5
+CACHE_DIR = os.environ.get("CLEMAP_MODEL_CACHE", "/tmp/clemap_model_cache")
+# Nombre de modeles gardes en cache (le courant et quelques precedents pour un retour arriere)
+CACHE_KEEP = 3
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def _hard_sigmoid(x):
+    return np.clip(0.2 * x + 0.5, 0.0, 1.0)
+
+
+def _relu(x):
+    return np.maximum(x, 0.0)
+
+
+def _linear(x):
+    return x
+
+
+ACTIVATIONS = {
+    "sigmoid": _sigmoid,
+    "hard_sigmoid": _hard_sigmoid,
+    "relu": _relu,
+    "tanh": np.tanh,
+    "linear": _linear,
+    None: _linear,
+}
+
+
+def _activation(name):
+    try:
+        return ACTIVATIONS[name]
+    except KeyError:
+        raise ValueError(f"Unsupported activation for the NumPy backend: {name}") from None
+
+
+class LSTMLayer:
+    """Keras LSTM forward pass (gate order i, f, c, o)."""
+
+    def __init__(self, kernel, recurrent_kernel, bias, activation="tanh",
+                 recurrent_activation="sigmoid", return_sequences=False):
+        self.kernel = np.ascontiguousarray(kernel, dtype=np.float32)
+        self.recurrent_kernel = np.ascontiguousarray(recurrent_kernel, dtype=np.float32)
+        self.bias = np.ascontiguousarray(bias, dtype=np.float32)
+        self.units = self.recurrent_kernel.shape[0]
+        self.activation = _activation(activation)
+        self.recurrent_activation = _activation(recurrent_activation)
+        self.return_sequences = return_sequences
+
+    def __call__(self, x):
+        batch, steps, _ = x.shape
+        units = self.units
+        # Projection des entrees pour tous les pas de temps en un seul produit matriciel
+        projected = x @ self.kernel + self.bias
+        h = np.zeros((batch, units), dtype=np.float32)
+        c = np.zeros((batch, units), dtype=np.float32)
+        outputs = np.empty((batch, steps, units), dtype=np.float32) if self.return_sequences else None
+        for t in range(steps):
+            z = projected[:, t, :] + h @ self.recurrent_kernel
+            i = self.recurrent_activation(z[:, :units])
+            f = self.recurrent_activation(z[:, units:2 * units])
+            g = self.activation(z[:, 2 * units:3 * units])
+            o = self.recurrent_activation(z[:, 3 * units:])
+            c = f * c + i * g
+            h = o * self.activation(c)
+            if outputs is not None:
+                outputs[:, t, :] = h
+        return outputs if outputs is not None else h
+
+
+class DenseLayer:
+    def __init__(self, kernel, bias, activation="linear"):
+        self.kernel = np.ascontiguousarray(kernel, dtype=np.float32)
+        self.bias = np.ascontiguousarray(bias, dtype=np.float32)
+        self.activation = _activation(activation)
+
+    def __call__(self, x):
+        return self.activation(x @ self.kernel + self.bias)
+
+
+def _decode(value):
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+def read_h5_layers(path):
+    """Returns ``[(class_name, config, [weights...]), ...]`` for each LSTM/Dense layer of a Keras ``.h5`` model."""
+    import h5py
+
+    with h5py.File(path, "r") as f:
+        model_config = json.loads(_decode(f.attrs["model_config"]))
+        weights_group = f["model_weights"] if "model_weights" in f else f
+        layers = []
+        for layer in model_config["config"]["layers"]:
+            class_name = layer["class_name"]
+            if class_name not in ("LSTM", "Dense"):
+                continue
+            config = layer["config"]
+            group = weights_group[config["name"]]
+            names = [_decode(n) for n in group.attrs["weight_names"]]
+            layers.append((class_name, config, [np.asarray(group[n]) for n in names]))
+    return layers
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """Streams ``path`` through SHA-256 and returns the hex digest."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def save_layer_cache(cache_path, layer_specs):
+    """Writes ``layer_specs`` to an uncompressed ``.npz`` (temp file + rename)."""
+    arrays = {}
+    header = []
+    for n, (class_name, config, weights) in enumerate(layer_specs):
+        header.append({"class_name": class_name, "config": config, "n_weights": len(weights)})
+        for k, w in enumerate(weights):
+            arrays[f"layer{n}_w{k}"] = w
+    arrays["header"] = np.array(json.dumps(header))
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, cache_path)
+
+
+def load_layer_cache(cache_path):
+    with np.load(cache_path, allow_pickle=False) as data:
+        header = json.loads(str(data["header"]))
+        return [
+            (layer["class_name"], layer["config"], [data[f"layer{n}_w{k}"] for k in range(layer["n_weights"])])
+            for n, layer in enumerate(header)
+        ]
+
+
+def prune_layer_cache(cache_dir, keep=CACHE_KEEP):
+    entries = sorted(
+        (os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith(".npz")),
+        key=os.path.getmtime,
+        reverse=True,
+    )
+    for path in entries[keep:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def load_layers(h5_path, cache_dir=CACHE_DIR):
+    """Returns ``(layer_specs, sha256)`` for ``h5_path``, converting it only on a cache miss."""
+    digest = file_sha256(h5_path)
+    cache_path = os.path.join(cache_dir, f"{digest}.npz")
+    if os.path.exists(cache_path):
+        try:
+            layer_specs = load_layer_cache(cache_path)
+            # Rafraichir le mtime pour que la purge garde les modeles recemment utilises
+            os.utime(cache_path)
+            return layer_specs, digest
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Ignoring unreadable model cache %s: %s", cache_path, e)
+    layer_specs = read_h5_layers(h5_path)
+    try:
+        save_layer_cache(cache_path, layer_specs)
+        prune_layer_cache(cache_dir)
+    except OSError as e:
+        logger.warning("Could not write model cache %s: %s", cache_path, e)
+    return layer_specs, digest
+
+
+def build_layers(layer_specs):
+    layers = []
+    for class_name, config, weights in layer_specs:
+        if class_name == "LSTM":
+            layers.append(LSTMLayer(
+                *weights,
+                activation=config.get("activation", "tanh"),
+                recurrent_activation=config.get("recurrent_activation", "sigmoid"),
+                return_sequences=config.get("return_sequences", False),
+            ))
+        elif class_name == "Dense":
+            layers.append(DenseLayer(*weights, activation=config.get("activation", "linear")))
+        else:
+            raise ValueError(f"Unsupported layer for the NumPy backend: {class_name}")
+    return layers
+
+
+class NumpyBackend:
+    """Pure NumPy LSTM + Dense forward pass, no TensorFlow required."""
+
+    name = "numpy"
+
+    def __init__(self, layer_specs, source=None, digest=None):
+        self.layer_specs = layer_specs
+        self.layers = build_layers(layer_specs)
+        self.source = source
+        self.digest = digest
+
+    @classmethod
+    def from_h5(cls, path, cache_dir=CACHE_DIR):
+        layer_specs, digest = load_layers(path, cache_dir)
+        return cls(layer_specs, source=path, digest=digest)
+
+    def predict(self, x, verbose=0):
+        out = np.asarray(x, dtype=np.float32)
+        for layer in self.layers:
+            out = layer(out)
+        return out
+
+    __call__ = predict
+
+
+class TFLiteBackend:
+    """TFLite interpreter backend (``tflite_runtime`` if installed, ``tf.lite`` otherwise)."""
+
+    name = "tflite"
+
+    def __init__(self, tflite_path):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+        self.interpreter = Interpreter(model_path=tflite_path)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self.source = tflite_path
+
+    @classmethod
+    def from_h5(cls, path):
+        tflite_path = os.path.splitext(path)[0] + ".tflite"
+        if not os.path.exists(tflite_path) or os.path.getmtime(tflite_path) < os.path.getmtime(path):
+            convert_to_tflite(path, tflite_path)
+        return cls(tflite_path)
+
+    def predict(self, x, verbose=0):
+        x = np.asarray(x, dtype=self._input["dtype"])
+        if tuple(self._input["shape"]) != x.shape:
+            self.interpreter.resize_tensor_input(self._input["index"], x.shape)
+            self.interpreter.allocate_tensors()
+            self._input = self.interpreter.get_input_details()[0]
+            self._output = self.interpreter.get_output_details()[0]
+        self.interpreter.set_tensor(self._input["index"], x)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self._output["index"])
+
+    __call__ = predict
+
+
+def convert_to_tflite(h5_path, tflite_path):
+    """Converts a Keras ``.h5`` model into a ``.tflite`` flatbuffer (needs TensorFlow)."""
+    import tensorflow as tf
+
+    model = KerasBackend.from_h5(h5_path).model
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    # Les LSTM Keras ont besoin des ops TF selectionnees si la fusion echoue
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS, tf.lite.OpsSet.SELECT_TF_OPS]
+    with open(tflite_path, "wb") as f:
+        f.write(converter.convert())
+    logger.info("Converted %s to %s", h5_path, tflite_path)
+
+
+class KerasBackend:
+    """Original ``tensorflow.keras`` path, kept for comparison and as a fallback."""
+
+    name = "keras"
+
+    def __init__(self, model, source=None):
+        self.model = model
+        self.source = source
+
+    @classmethod
+    def from_h5(cls, path):
+        from tensorflow.keras.models import load_model
+        from keras.losses import MeanSquaredError
+
+        # Define the custom object mapping
+        custom_objects = {'mse': MeanSquaredError()}
+        return cls(load_model(path, custom_objects=custom_objects, compile=False), source=path)
+
+    def predict(self, x, verbose=0):
+        return self.model.predict(x, verbose=verbose)
+
+    __call__ = predict
+
+
+BACKENDS = {
+    NumpyBackend.name: NumpyBackend,
+    TFLiteBackend.name: TFLiteBackend,
+    KerasBackend.name: KerasBackend,
+}
+
+
+def load_backend(model_path, backend=None):
+    """Loads ``model_path`` with the configured backend (``CLEMAP_INFERENCE_BACKEND``, ``numpy`` by default)."""
+    backend = backend or os.environ.get("CLEMAP_INFERENCE_BACKEND", DEFAULT_BACKEND)
+    try:
+        backend_cls = BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown inference backend '{backend}', expected one of {sorted(BACKENDS)}") from None
+    return backend_cls.from_h5(model_path)
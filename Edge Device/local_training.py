@@ -0,0 +1,227 @@
+"""
+On-device fine-tuning fallback for retrain requests.
+
+A retrain request normally goes through S3, the SageMaker launcher, a training
+job and a Greengrass deployment, and never completes while the device is
+offline. ``LocalTrainer`` exports the most recent ``meter_data`` rows and runs
+``train_lstm.py --base-model <current model.h5>`` on them in a child process
+at the lowest CPU priority, capped in epochs and wall-clock time. The result is
+renamed over ``model.h5``, where ``ModelManager`` validates and hot-swaps it
+exactly like a model deployed from the cloud.
+
+``CLEMAP_LOCAL_RETRAIN`` selects when it runs:
+
+* ``off`` (default): cloud retraining only;
+* ``offline``: when the upload of the retrain report fails, or when no new
+  model has arrived ``CLEMAP_LOCAL_RETRAIN_AFTER`` seconds after the request;
+* ``always``: immediately, while the report is still sent for a full cloud retrain.
+"""
+
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+from dataset import DatasetExporter
+
+logger = logging.getLogger(__name__)
+
+MODES = ("off", "offline", "always")
+
+# train_lstm.py du depot par defaut ; CLEMAP_TRAIN_SCRIPT sur un device ou il est installe ailleurs
+DEFAULT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "AWS", "Training", "train_lstm.py")
+
+# Marge laissee au process pour demarrer (import de TensorFlow) et sauver le modele en plus de max_seconds
+STARTUP_GRACE = 120
+
+
+def _lower_priority(nice):
+    def preexec():
+        os.nice(nice)
+        # SCHED_IDLE : le fine-tuning ne prend que le CPU laisse libre par la lecture et la prediction
+        try:
+            os.sched_setscheduler(0, os.SCHED_IDLE, os.sched_param(0))
+        except (AttributeError, OSError):
+            pass
+    return preexec
+
+
+class LocalTrainer:
+    """Fine-tunes the current model on recent rows in a low-priority child process, one run at a time."""
+
+    def __init__(self, model_path, mode="offline", script_path=DEFAULT_SCRIPT, work_dir=None, timesteps=10,
+                 features="sum", rows=20000, epochs=5, max_seconds=300, fallback_after=1800, nice=19):
+        if mode not in MODES:
+            raise ValueError(f"Unknown local retrain mode '{mode}', expected one of {MODES}")
+        self.model_path = model_path
+        self.mode = mode
+        self.script_path = script_path
+        # Meme systeme de fichiers que model.h5 pour que le remplacement soit un simple rename
+        self.work_dir = work_dir or os.path.join(os.path.dirname(os.path.abspath(model_path)), "clemap_local_training")
+        self.timesteps = timesteps
+        self.features = features
+        self.rows = rows
+        self.epochs = epochs
+        self.max_seconds = max_seconds
+        self.fallback_after = fallback_after
+        self.nice = nice
+        self.runs = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._process = None
+        self._timer = None
+
+    @classmethod
+    def from_env(cls, model_path, timesteps=10, features="sum"):
+        env = os.environ
+        return cls(
+            model_path,
+            mode=env.get("CLEMAP_LOCAL_RETRAIN", "off"),
+            script_path=env.get("CLEMAP_TRAIN_SCRIPT", DEFAULT_SCRIPT),
+            work_dir=env.get("CLEMAP_LOCAL_RETRAIN_DIR"),
+            timesteps=timesteps,
+            features=features,
+            rows=int(env.get("CLEMAP_LOCAL_RETRAIN_ROWS", "20000")),
+            epochs=int(env.get("CLEMAP_LOCAL_RETRAIN_EPOCHS", "5")),
+            max_seconds=float(env.get("CLEMAP_LOCAL_RETRAIN_SECONDS", "300")),
+            fallback_after=float(env.get("CLEMAP_LOCAL_RETRAIN_AFTER", "1800")),
+        )
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def request(self, db_path, model_manager, cloud_future=None):
+        """Handles a retrain request sent (or not) to the cloud, according to ``mode``."""
+        if self.mode == "always":
+            return self.start(db_path)
+        if self.mode != "offline":
+            return False
+        version = model_manager.version
+
+        def fallback(reason):
+            # Un modele est arrive entre-temps (cloud ou run local precedent) : rien a faire
+            if model_manager.version == version:
+                logger.info("%s, fine-tuning locally", reason)
+                self.start(db_path)
+
+        if cloud_future is None:
+            fallback("Retrain report not sent")
+            return True
+        cloud_future.add_done_callback(
+            lambda done: None if done.exception() is None and done.result()
+            else fallback("Upload of the retrain report failed")
+        )
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(
+            self.fallback_after, fallback, args=(f"No new model {self.fallback_after:.0f} s after the request",)
+        )
+        self._timer.daemon = True
+        self._timer.start()
+        return True
+
+    def start(self, db_path):
+        """Starts one fine-tuning run in the background. Returns False if one is already running."""
+        with self._lock:
+            if self.running:
+                logger.info("Local fine-tuning already running")
+                return False
+            if not os.path.exists(self.script_path) or not os.path.exists(self.model_path):
+                logger.warning("Local fine-tuning needs %s and %s", self.script_path, self.model_path)
+                return False
+            self._thread = threading.Thread(target=self._run, args=(db_path,), name="local-training", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        process = self._process
+        if process is not None and process.poll() is None:
+            process.kill()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self, db_path):
+        started = time.monotonic()
+        os.makedirs(self.work_dir, exist_ok=True)
+        model_dir = os.path.join(self.work_dir, "model")
+        shutil.rmtree(model_dir, ignore_errors=True)
+        os.makedirs(model_dir)
+        # Watermark jamais commite : chaque run prend simplement les `rows` lignes les plus recentes
+        exporter = DatasetExporter(
+            db_path, output_dir=self.work_dir, name="local_train",
+            watermark_path=os.path.join(self.work_dir, "local_train.watermark.json"), initial_rows=self.rows,
+        )
+        report = None
+        try:
+            report = exporter.export()
+            if report is None:
+                logger.info("No rows to fine-tune on in %s", db_path)
+                return
+            base_signature = _signature(self.model_path)
+            if not self._train(report.path, model_dir):
+                return
+            candidate = os.path.join(model_dir, "model.h5")
+            # Un modele du cloud est arrive pendant l'entrainement : il est prioritaire sur le fine-tuning local
+            if _signature(self.model_path) != base_signature:
+                logger.info("Model replaced during local fine-tuning, discarding the local result")
+                return
+            os.replace(candidate, self.model_path)
+            self.runs += 1
+            logger.info("Local fine-tuning on %d rows done in %.0f s, model swapped in",
+                        report.rows, time.monotonic() - started)
+        except Exception:
+            logger.exception("Local fine-tuning failed")
+        finally:
+            if report is not None and os.path.exists(report.path):
+                os.remove(report.path)
+            self._process = None
+
+    def _train(self, data_path, model_dir):
+        args = [
+            sys.executable, self.script_path,
+            "--data", data_path,
+            "--base-model", self.model_path,
+            "--model-dir", model_dir,
+            "--epochs", str(self.epochs),
+            "--max-train-seconds", str(self.max_seconds),
+            "--timesteps", str(self.timesteps),
+            "--features", self.features,
+            "--pack-dtype", "none",
+        ]
+        # Un seul thread de calcul : les coeurs restent a la lecture et a la prediction
+        env = dict(os.environ, CUDA_VISIBLE_DEVICES="", OMP_NUM_THREADS="1",
+                   TF_NUM_INTRAOP_THREADS="1", TF_NUM_INTEROP_THREADS="1", TF_CPP_MIN_LOG_LEVEL="2")
+        log_path = os.path.join(self.work_dir, "train.log")
+        with open(log_path, "wb") as log:
+            self._process = subprocess.Popen(args, stdout=log, stderr=subprocess.STDOUT, env=env,
+                                             preexec_fn=_lower_priority(self.nice))
+            try:
+                code = self._process.wait(timeout=self.max_seconds + STARTUP_GRACE)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+                self._process.wait()
+                logger.warning("Local fine-tuning killed after %.0f s, see %s",
+                               self.max_seconds + STARTUP_GRACE, log_path)
+                return False
+        if code != 0 or not os.path.exists(os.path.join(model_dir, "model.h5")):
+            logger.warning("Local fine-tuning exited with code %s, see %s", code, log_path)
+            return False
+        return True
+
+
+def _signature(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
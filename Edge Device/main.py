@@ -7,28 +7,22 @@ SPDX-License-Identifier: Apache-2.0
 import asyncio
 import logging
 import time
-import sqlite3
 import numpy as np
 import os
 import time
-from tensorflow.keras.models import load_model
-from stream_manager import (
-    ExportDefinition,
-    MessageStreamDefinition,
-    ReadMessagesOptions,
-    ResourceNotFoundException,
-    S3ExportTaskDefinition,
-    S3ExportTaskExecutorConfig,
-    Status,
-    StatusConfig,
-    StatusLevel,
-    StatusMessage,
-    StrategyOnFull,
-    StreamManagerClient,
-    StreamManagerException,
-)
-from stream_manager.util import Util
-from keras.losses import MeanSquaredError
+
+from dataset import DatasetExporter
+from drift import DriftDetector, DriftConfig, DriftMonitor
+from exporter import S3Exporter
+from inference import load_backend
+from local_training import LocalTrainer
+import metrics
+from meters import MeterBank
+from model_manager import ModelManager
+from reader import MeterReader
+from runtime import EdgeRuntime
+from ring_buffer import RingBuffer
+from scheduler import PredictionSchedule
 
 # Azy on regarde si Ã§a marche
 # Chemin vers la base de donnÃƒÂ©es
@@ -36,62 +30,58 @@ db_path = "/home/sens/sens_docker/clemap_db/data_gathering.db"
 
 # Chemin vers le modÃƒÂ¨le TensorFlow (format .h5)
 model_path = "/tmp/model.h5"
-# Fonction pour lire les donnÃƒÂ©es de la base SQLite
-def read_data():
-    print("Database exists:", os.path.exists(db_path))
-    print("Database permissions:", oct(os.stat(db_path).st_mode))
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    query = """
-    SELECT time, l1_p, l2_p, l3_p
-    FROM meter_data
-    ORDER BY time DESC
-    LIMIT 10
-    """
-    cursor.execute(query)
-    rows = cursor.fetchall()
-    conn.close()
-
-    # Somme des puissances des trois phases
-    data = [row[1] + row[2] + row[3] for row in rows]  # l1_p + l2_p + l3_p
-    return data
-
-def read_next_val():
-    print("Database exists:", os.path.exists(db_path))
-    print("Database permissions:", oct(os.stat(db_path).st_mode))
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    query = """
-    SELECT time, l1_p, l2_p, l3_p
-    FROM meter_data
-    ORDER BY time DESC
-    LIMIT 1
-    """
-    cursor.execute(query)
-    rows = cursor.fetchall()
-    conn.close()
 
-    # Somme des puissances des trois phases
-    data = [row[1] + row[2] + row[3] for row in rows]  # l1_p + l2_p + l3_p
-    return data
+# Longueur de la fenetre d'entree du LSTM (doit correspondre aux timesteps de l'entrainement)
+timesteps = int(os.environ.get("CLEMAP_TIMESTEPS", "10"))
+# Entree du modele : "sum" (l1_p + l2_p + l3_p) ou "phases" (une colonne par phase)
+features = os.environ.get("CLEMAP_FEATURES", "sum")
+# Une base par compteur Clemap, separees par ":" (format "nom=chemin" accepte)
+db_paths = os.environ.get("CLEMAP_DB_PATHS", db_path).split(":")
+
+# Exportation des donnees de reentrainement (gzip CSV par defaut, parquet si pyarrow est installe)
+export_dir = os.environ.get("CLEMAP_EXPORT_DIR", "/tmp")
+export_format = os.environ.get("CLEMAP_EXPORT_FORMAT", "csv.gz")
+
+# Attente de nouvelles lignes : PRAGMA data_version verifie toutes les `poll_interval` secondes
+poll_interval = float(os.environ.get("CLEMAP_POLL_INTERVAL", "0.5"))
+# Sans nouveau modele apres ce delai (upload perdu, modele refuse), une nouvelle demande de reentrainement est permise
+retrain_timeout = float(os.environ.get("CLEMAP_RETRAIN_TIMEOUT", "3600"))
+
+# Fine-tuning sur le device (CLEMAP_LOCAL_RETRAIN=offline|always), en plus du reentrainement dans le cloud
+local_trainer = LocalTrainer.from_env(model_path, timesteps=timesteps, features=features)
+
+# Lecteur partage : une seule connexion SQLite ouverte et un curseur sur la colonne time
+reader = None
+# Fenetre glissante des dernieres sommes l1_p + l2_p + l3_p (ordre chronologique)
+window = RingBuffer(timesteps)
+
+def get_reader():
+    global reader
+    if reader is None:
+        reader = MeterReader(db_path)
+        for row in reader.latest(window.capacity):
+            window.append(row[1] + row[2] + row[3])
+    return reader
+
+def wait_for_rows(timeout=5.0):
+    """Waits for the rows committed since the last read (PRAGMA data_version, no blind sleep)."""
+    return get_reader().wait_for_rows(timeout, poll_interval)
 
 # PrÃƒÂ©paration des donnÃƒÂ©es pour le modÃƒÂ¨le
 def prepare_data(data):
-    # RÃƒÂ©ordonner les donnÃƒÂ©es dans l'ordre chronologique
-    data = data[::-1]
+    # La fenetre est deja dans l'ordre chronologique et en float32 : simple vue, sans copie
     # Reshape pour que le modÃƒÂ¨le puisse lire (batch_size, time_steps, features)
-    data = np.array(data, dtype=np.float32).reshape((1, len(data), 1))
-    return data
+    return data.as_input()
 
-def download_model():
-    if not os.path.exists(model_path):
-        print(f"Le fichier '{model_path}' est introuvable. Assurez-vous que le modÃƒÂ¨le TensorFlow existe.")
+def download_model(path=model_path):
+    if not os.path.exists(path):
+        print(f"Le fichier '{path}' est introuvable. Assurez-vous que le modÃƒÂ¨le TensorFlow existe.")
         return
 
-    print(f"Chargement du modele TensorFlow depuis {model_path}...")
-    # Define the custom object mapping
-    custom_objects = {'mse': MeanSquaredError()}
-    model = load_model(model_path,custom_objects=custom_objects,compile=False)
+    print(f"Chargement du modele TensorFlow depuis {path}...")
+    # Backend choisi par CLEMAP_INFERENCE_BACKEND (numpy par defaut, tflite ou keras)
+    model = load_backend(path)
+    print(f"Modele charge avec le backend '{model.name}'")
     return model
 
 def predict(input_data,model):
@@ -100,184 +90,180 @@ def predict(input_data,model):
     print(f"Prediction de la prochaine puissance (sum_p) : {prediction[0][0]}")
     return prediction
 
-def create_error_report (db_path) :
-    # Connect to the SQLite database
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    # Initialize a list to store the sums
-    sums = []
-    
-    # Repeat the sum calculation 100 times
-    for _ in range(100):
-        query = """
-        SELECT time, l1_p, l2_p, l3_p
-        FROM meter_data
-        ORDER BY time DESC
-        LIMIT 10
-        """
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        
-        # Sum the powers of the three phases
-        data = [row[1] + row[2] + row[3] for row in rows]  # l1_p + l2_p + l3_p
-        
-        # Append the sum of the data (sum of all rows' sums)
-        sums.append(sum(data))
-    
-    # Close the database connection
-    conn.close()
-    
-    # Convert the sums list to a numpy array
-    sums_array = np.array(sums)
-    
-    # Save the sums to a CSV file with one column named 'target'
-    np.savetxt('/tmp/Clemap_train.csv', sums_array, delimiter=',', header='target', comments='', fmt='%f')
+# Un exportateur (et donc un watermark) par base de donnees
+dataset_exporters = {}
+
+def get_dataset_exporter(path, name="Clemap_train"):
+    exporter = dataset_exporters.get(path)
+    if exporter is None:
+        exporter = dataset_exporters[path] = DatasetExporter(path, output_dir=export_dir, name=name, fmt=export_format)
+    return exporter
+
+def create_error_report (db_path, name="Clemap_train") :
+    """Exports the rows added since the last successful upload. Returns an ExportResult or None."""
+    return get_dataset_exporter(db_path, name).export()
+
+def submit_error_report(report, logger=None):
+    """Starts uploading ``report`` to data/ in S3 without waiting. Returns a Future resolved with True on success.
+
+    The watermark of the report's database is moved as soon as the upload succeeds.
+    """
+    if report is None:
+        return None
+    logger = logger or logging.getLogger()
+    submitted = time.perf_counter()
+    future = get_s3_exporter().submit(report.path, "data/" + os.path.basename(report.path))
+
+    def on_done(done):
+        # Duree de l'upload complet (jusqu'au statut Success/Failure de Stream Manager)
+        metrics.UPLOAD.observe(time.perf_counter() - submitted)
+        if done.exception() is not None:
+            metrics.UPLOAD_FAILURES.inc()
+            logger.error("Upload of %s failed", report.path, exc_info=done.exception())
+        elif done.result():
+            get_dataset_exporter(report.db_path).commit(report)
+        else:
+            metrics.UPLOAD_FAILURES.inc()
+    future.add_done_callback(on_done)
+    return future
+
+def request_retrain(report, model_manager, db_path=db_path, logger=None):
+    """Sends ``report`` for a cloud retrain and, depending on CLEMAP_LOCAL_RETRAIN, fine-tunes locally too.
+
+    Never waits for the upload: offline, the local fine-tuning is the only way to get a new model.
+    """
+    try:
+        future = submit_error_report(report, logger)
+    except Exception:
+        if not local_trainer.enabled:
+            raise
+        (logger or logging.getLogger()).exception("Unable to send the retrain report")
+        future = None
+    if local_trainer.enabled:
+        local_trainer.request(report.db_path if report is not None else db_path, model_manager, future)
+    return future
 
 logging.basicConfig(level=logging.INFO)
 
 # Fonction principale pour les prÃƒÂ©dictions
 def predict_next_value():
-    model = download_model()
+    # Le modele est recharge en arriere-plan (inotify ou polling) des que model.h5 change
+    manager = ModelManager(model_path, download_model, timesteps=timesteps)
+    metrics.start_http_server()
+    manager.load_initial()
+    manager.start()
+    # Statistiques d'erreur glissantes : un seul echantillon bruite ne declenche plus de reentrainement
+    drift = DriftDetector(DriftConfig.from_env())
+    # Cadence alignee sur la colonne time (CLEMAP_PREDICTION_INTERVAL) au lieu de deux time.sleep(60)
+    schedule = PredictionSchedule.from_env()
+    # Version du modele au moment de la derniere demande de reentrainement
+    retrain_requested_at = None
+    retrain_deadline = None
+    get_reader()
 
     while True:
-        data = read_data()
+        model = manager.current
+        if model is None:
+            print("Aucun modele disponible, attente de model.h5...")
+            manager.wait_for_update(manager.version, timeout=5)
+            continue
+        if retrain_requested_at is not None and manager.version > retrain_requested_at:
+            print("Le nouveau ML est arrivé")
+            retrain_requested_at = None
+            drift = DriftDetector(drift.config)
+            schedule.reset()
+        elif retrain_requested_at is not None and time.monotonic() >= retrain_deadline:
+            print("Pas de nouveau ML apres la demande de reentrainement, nouvelle demande possible")
+            retrain_requested_at = None
+
+        # Reveil des que le collecteur a commite de nouvelles lignes (au plus 5 s pour revoir le modele)
+        rows = metrics.DB_READ.time_call(wait_for_rows)
+        for row in rows:
+            # Somme des puissances des trois phases
+            actual = row[1] + row[2] + row[3]  # l1_p + l2_p + l3_p
+            # Chaque prediction est comparee a la ligne qu'elle predit, identifiee par sa position apres la fenetre
+            for window_time, predicted, _ in schedule.observe(actual):
+                print(f"Predicted value : {predicted} (window ending {window_time}), Real value : {actual} ({row[0]})")
+                with metrics.DRIFT_CHECK.time():
+                    retrain = drift.update(predicted, actual)
+                if retrain and retrain_requested_at is None:
+                    metrics.RETRAIN_REQUESTS.inc()
+                    print("Trop de valeurs fausses, envoi de donnees pour reentrainement")
+                    report = metrics.REPORT.time_call(create_error_report, db_path)
+                    retrain_requested_at = manager.version
+                    retrain_deadline = time.monotonic() + retrain_timeout
+                    try:
+                        metrics.EXPORT.time_call(request_retrain, report, manager)
+                    except Exception:
+                        # Stream Manager indisponible : on continue, la prochaine derive refera une demande
+                        logging.getLogger().exception("Unable to send the retrain report")
+                        retrain_requested_at = None
+                        continue
+                    # Les predictions continuent avec l'ancien modele jusqu'a l'arrivee du nouveau
+                    print("On attend que le nouveau model arrive")
+            window.append(actual)
 
         # VÃƒÂ©rifier qu'il y a assez de donnÃƒÂ©es pour le modÃƒÂ¨le
-        if len(data) < 10:
-            print("Pas assez de donnÃƒÂ©es pour prÃƒÂ©dire. Attente de nouvelles donnÃƒÂ©es...")
-            time.sleep(5)
+        if not rows or len(window) < timesteps:
+            if rows:
+                print("Pas assez de donnÃƒÂ©es pour prÃƒÂ©dire. Attente de nouvelles donnÃƒÂ©es...")
+            continue
+        # Une seule prediction par creneau, sur la fenetre qui finit a la ligne la plus recente
+        if not schedule.due(rows[-1][0]):
             continue
 
         # PrÃƒÂ©parer les donnÃƒÂ©es et exÃƒÂ©cuter une prÃƒÂ©diction
-        input_data = prepare_data(data)
-        predict_value = predict(input_data,model)
-        time.sleep(60)
-        next_value = read_next_val()
-        print(f"Predicted value : {predict_value}, Real value : {next_value}")
-        if np.isnan(predict_value) or (abs(predict_value-next_value)>0.05):
-            print("Trop de valeurs fausses, envoi de donnees pour reentrainement")
-            create_error_report(db_path)
-            """Check if the file has been modified."""
-            past_modified_time = os.path.getmtime(model_path)
-            send_data_to_cloud(logger=logging.getLogger())
-            print("On attend que le nouveau model arrive")
-            while True :
-                current_modified_time = os.path.getmtime(model_path)
-                time.sleep(5)
-                if (current_modified_time!=past_modified_time) :
-                    break
-            print("Le nouveau ML est arrivé")
-            model = download_model()
-        # Attendre avant la prochaine prÃƒÂ©diction
-        time.sleep(60)
+        input_data = metrics.PREPARE.time_call(prepare_data, window)
+        predict_value = metrics.PREDICT.time_call(predict, input_data, model)
+        metrics.PREDICTIONS.inc()
+        if np.isnan(predict_value[0][0]):
+            metrics.NAN_PREDICTIONS.inc()
+        schedule.expect(rows[-1][0], float(predict_value[0][0]))
 
-# This example creates a local stream named "SomeStream", and a status stream named "SomeStatusStream.
-# It adds 1 S3 Export task into the "SomeStream" stream and then stream manager automatically exports
-# the data to a customer-created S3 bucket named "SomeBucket".
-# This example runs until the customer-created file at URL "SomeURL" has been uploaded to the S3 bucket.
+# Un seul client Stream Manager et des flux persistants pour toute la duree du process
+s3_exporter = None
 
+def get_s3_exporter():
+    global s3_exporter
+    if s3_exporter is None:
+        s3_exporter = S3Exporter(bucket_name="clemapbucket").open()
+    return s3_exporter
 
-def send_data_to_cloud(logger):
+# Runtime asyncio : lecture, prediction, detection de derive et export en taches concurrentes
+def run_runtime():
+    """Runs the asyncio runtime (tailer, predictor, drift evaluator, exporter) until SIGINT/SIGTERM."""
+    bank = MeterBank.from_paths(db_paths, timesteps=timesteps, features=features)
+    manager = ModelManager(model_path, download_model, timesteps=timesteps, features=bank.n_features)
+    # Endpoint Prometheus local (CLEMAP_METRICS_PORT, 0 pour le desactiver)
+    metrics.start_http_server()
+    manager.load_initial()
+    drift = DriftMonitor()
+    # Nouveau modele : les statistiques d'erreur de l'ancien ne sont plus pertinentes
+    manager.add_listener(drift.reset)
+    manager.start()
+    edge_runtime = EdgeRuntime(
+        bank=bank,
+        model_manager=manager,
+        # Un fichier par compteur quand il y en a plusieurs : Clemap_train_<compteur>_<debut>_<fin>.csv.gz
+        report_fn=lambda meter: create_error_report(
+            meter.reader.db_path, "Clemap_train" if len(bank) == 1 else "Clemap_train_" + meter.name
+        ),
+        export_fn=lambda report: request_retrain(report, manager),
+        should_retrain=drift,
+        poll_interval=poll_interval,
+        retrain_timeout=retrain_timeout,
+    )
     try:
-        stream_name = "SomeStream"
-        status_stream_name = "SomeStatusStreamName"
-        bucket_name = "clemapbucket"
-        key_name = "data/Clemap_train.csv"
-        file_url = "file:/tmp/Clemap_train.csv"
-        client = StreamManagerClient()
-
-        # Try deleting the status stream (if it exists) so that we have a fresh start
-        try:
-            client.delete_message_stream(stream_name=status_stream_name)
-        except ResourceNotFoundException:
-            pass
-
-        # Try deleting the stream (if it exists) so that we have a fresh start
-        try:
-            client.delete_message_stream(stream_name=stream_name)
-        except ResourceNotFoundException:
-            pass
-
-        exports = ExportDefinition(
-            s3_task_executor=[
-                S3ExportTaskExecutorConfig(
-                    identifier="S3TaskExecutor" + stream_name,  # Required
-                    # Optional. Add an export status stream to add statuses for all S3 upload tasks.
-                    status_config=StatusConfig(
-                        status_level=StatusLevel.INFO,  # Default is INFO level statuses.
-                        # Status Stream should be created before specifying in S3 Export Config.
-                        status_stream_name=status_stream_name,
-                    ),
-                )
-            ]
-        )
-
-        # Create the Status Stream.
-        client.create_message_stream(
-            MessageStreamDefinition(name=status_stream_name, strategy_on_full=StrategyOnFull.OverwriteOldestData)
-        )
-
-        # Create the message stream with the S3 Export definition.
-        client.create_message_stream(
-            MessageStreamDefinition(
-                name=stream_name, strategy_on_full=StrategyOnFull.OverwriteOldestData, export_definition=exports
-            )
-        )
-
-        # Append a S3 Task definition and print the sequence number
-        s3_export_task_definition = S3ExportTaskDefinition(input_url=file_url, bucket=bucket_name, key=key_name)
-        logger.info(
-            "Successfully appended S3 Task Definition to stream with sequence number %d",
-            client.append_message(stream_name, Util.validate_and_serialize_to_json_bytes(s3_export_task_definition)),
-        )
-
-        # Read the statuses from the export status stream
-        stop_checking = False
-        next_seq = 0
-        while not stop_checking:
-            try:
-                messages_list = client.read_messages(
-                    status_stream_name,
-                    ReadMessagesOptions(
-                        desired_start_sequence_number=next_seq, min_message_count=1, read_timeout_millis=1000
-                    ),
-                )
-                for message in messages_list:
-                    # Deserialize the status message first.
-                    status_message = Util.deserialize_json_bytes_to_obj(message.payload, StatusMessage)
-
-                    # Check the status of the status message. If the status is "Success",
-                    # the file was successfully uploaded to S3.
-                    # If the status was either "Failure" or "Cancelled", the server was unable to upload the file to S3.
-                    # We will print the message for why the upload to S3 failed from the status message.
-                    # If the status was "InProgress", the status indicates that the server has started uploading
-                    # the S3 task.
-                    if status_message.status == Status.Success:
-                        logger.info("Successfully uploaded file at path " + file_url + " to S3.")
-                        stop_checking = True
-                    elif status_message.status == Status.InProgress:
-                        logger.info("File upload is in Progress.")
-                        next_seq = message.sequence_number + 1
-                    elif status_message.status == Status.Failure or status_message.status == Status.Canceled:
-                        logger.info(
-                            "Unable to upload file at path " + file_url + " to S3. Message: " + status_message.message
-                        )
-                        stop_checking = True
-                if not stop_checking:
-                    time.sleep(5)
-            except StreamManagerException:
-                logger.exception("Exception while running")
-                time.sleep(5)
-    except asyncio.TimeoutError:
-        logger.exception("Timed out while executing")
-    except Exception:
-        logger.exception("Exception while running")
+        asyncio.run(edge_runtime.run())
     finally:
-        if client:
-            client.close()
+        local_trainer.stop()
+        if s3_exporter is not None:
+            s3_exporter.close()
 
 # Point d'entrÃƒÂ©e principal
 if __name__ == "__main__":
-    # Start up this sample code
-    predict_next_value()
+    # CLEMAP_RUNTIME=sequential pour revenir a l'ancienne boucle read/predict/sleep
+    if os.environ.get("CLEMAP_RUNTIME", "asyncio") == "sequential":
+        predict_next_value()
+    else:
+        run_runtime()
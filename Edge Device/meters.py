@@ -0,0 +1,87 @@
+"""
+Multi-meter batching for the edge predictor.
+
+Each Clemap meter writes to its own ``data_gathering.db``. A ``MeterBank``
+keeps one reader and one ring buffer per meter and copies every window into a
+single preallocated ``(n_meters, timesteps, features)`` array, so all meters are
+predicted in one forward pass instead of one process per meter.
+"""
+
+import numpy as np
+
+from reader import MeterReader
+from ring_buffer import RingBuffer
+
+# Nombre de valeurs par echantillon pour chaque mode d'entree du modele
+FEATURE_SIZES = {"sum": 1, "phases": 3}
+
+
+def extract_features(row, features):
+    """Turns a ``(time, l1_p, l2_p, l3_p)`` row into the model input for one time step."""
+    if features == "phases":
+        return row[1:4]
+    # Somme des puissances des trois phases
+    return row[1] + row[2] + row[3]  # l1_p + l2_p + l3_p
+
+
+class Meter:
+    """One meter: its reader and its sliding window."""
+
+    def __init__(self, name, reader, timesteps=10, features="sum"):
+        self.name = name
+        self.reader = reader
+        self.features = features
+        self.window = RingBuffer(timesteps, FEATURE_SIZES[features])
+
+    def push(self, row):
+        self.window.append(extract_features(row, self.features))
+
+
+class MeterBank:
+    """Fixed set of meters predicted together."""
+
+    def __init__(self, meters):
+        if not meters:
+            raise ValueError("MeterBank needs at least one meter")
+        self.meters = list(meters)
+        first = self.meters[0].window
+        self.timesteps = first.capacity
+        self.n_features = first.features
+        self._batch = np.zeros((len(self.meters), self.timesteps, self.n_features), dtype=np.float32)
+
+    @classmethod
+    def from_paths(cls, db_paths, timesteps=10, features="sum"):
+        """Builds one meter per database; entries are ``path`` or ``name=path``."""
+        meters = []
+        for entry in db_paths:
+            name, _, path = entry.rpartition("=")
+            meters.append(Meter(name or path, MeterReader(path), timesteps, features))
+        return cls(meters)
+
+    def __len__(self):
+        return len(self.meters)
+
+    def __iter__(self):
+        return iter(self.meters)
+
+    @property
+    def ready(self):
+        return all(meter.window.full for meter in self.meters)
+
+    def batch(self):
+        """Copies every window into the shared batch array (one copy, no allocation) and returns it.
+
+        The array is reused by the next call: consume it before batching again.
+        """
+        for i, meter in enumerate(self.meters):
+            np.copyto(self._batch[i], meter.window.as_input()[0])
+        return self._batch
+
+    def split_outputs(self, outputs):
+        """Reshapes ``(n_meters, horizon * features)`` model outputs to ``(n_meters, horizon, features)``."""
+        outputs = np.asarray(outputs)
+        return outputs.reshape((len(self.meters), -1, self.n_features))
+
+    def close(self):
+        for meter in self.meters:
+            meter.reader.close()
@@ -0,0 +1,250 @@
+"""
+In-process metrics for the edge predictor, exposed in the Prometheus text format.
+
+    curl http://127.0.0.1:9108/metrics
+
+Stage timings (DB read, window preparation, inference, drift check, report
+export, upload, model reload) go to the ``clemap_stage_seconds`` histogram;
+retrain requests, predictions and NaN predictions are counters; model version
+and RSS are gauges. The registry is dependency-free: an observation is one
+``perf_counter()`` pair, a ``bisect`` and two additions under an uncontended
+lock, a few microseconds per prediction (see ``benchmark_metrics.py``).
+
+``CLEMAP_METRICS_PORT`` sets the port of the endpoint (``0`` disables it) and
+``CLEMAP_METRICS_ADDR`` its address, 127.0.0.1 by default.
+"""
+
+import bisect
+import logging
+import os
+import resource
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Secondes : de 50 us (une prediction NumPy) a 30 s (upload ou rechargement lent)
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """Returns the child metric for these label values (create it once, then keep the reference)."""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        return type(self)(self.name, self.documentation)
+
+    def _series(self):
+        if self.labelnames:
+            return [(tuple(zip(self.labelnames, values)), child) for values, child in sorted(self._children.items())]
+        return [((), self)]
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, child in self._series():
+            lines.extend(child._samples(labels))
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def _samples(self, labels):
+        return [f"{self.name}{_format_labels(labels)} {self.value}"]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.value = 0
+        # Valeur lue au moment du scrape (version du modele, RSS) plutot que mise a jour a chaque prediction
+        self.function = function
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def _samples(self, labels):
+        value = self.value
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception:
+                logger.exception("Gauge %s callback failed", self.name)
+        return [f"{self.name}{_format_labels(labels)} {value}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def _new_child(self):
+        return Histogram(self.name, self.documentation, buckets=self.buckets)
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        return _Timer(self)
+
+    def time_call(self, function, *args):
+        """Calls ``function(*args)`` and observes its duration (usable as an executor target)."""
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def _samples(self, labels):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+        lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def expose(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+def rss_bytes():
+    """Current resident set size (``/proc/self/statm``), or the peak RSS where /proc is missing."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "clemap_stage_seconds", "Duration of each stage of the edge predictor.", ("stage",)))
+# Enfants resolus une fois : pas de recherche de labels sur le chemin chaud
+DB_READ = STAGE_SECONDS.labels("db_read")
+PREPARE = STAGE_SECONDS.labels("prepare_data")
+PREDICT = STAGE_SECONDS.labels("predict")
+DRIFT_CHECK = STAGE_SECONDS.labels("drift_check")
+REPORT = STAGE_SECONDS.labels("report")
+EXPORT = STAGE_SECONDS.labels("export")
+UPLOAD = STAGE_SECONDS.labels("upload")
+MODEL_LOAD = STAGE_SECONDS.labels("model_load")
+
+PREDICTIONS = REGISTRY.register(Counter("clemap_predictions_total", "Forecasts produced, one per meter."))
+NAN_PREDICTIONS = REGISTRY.register(Counter("clemap_nan_predictions_total", "Forecasts containing NaN."))
+RETRAIN_REQUESTS = REGISTRY.register(Counter("clemap_retrain_requests_total", "Retraining requested by drift."))
+UPLOAD_FAILURES = REGISTRY.register(Counter("clemap_upload_failures_total", "Retrain reports not uploaded to S3."))
+MODEL_REJECTED = REGISTRY.register(Counter("clemap_model_rejected_total", "New model files rejected at load."))
+MODEL_VERSION = REGISTRY.register(Gauge("clemap_model_version", "Version of the model in use (0: none)."))
+RSS = REGISTRY.register(Gauge("clemap_process_resident_memory_bytes", "Resident memory of the process.",
+                              function=rss_bytes))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = self.registry.expose().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Pas une ligne de log par scrape
+        pass
+
+
+def start_http_server(port=None, addr=None, registry=REGISTRY):
+    """Serves ``/metrics`` from a daemon thread. Returns the server, or None when disabled."""
+    port = int(os.environ.get("CLEMAP_METRICS_PORT", "9108") if port is None else port)
+    addr = addr or os.environ.get("CLEMAP_METRICS_ADDR", "127.0.0.1")
+    if not port:
+        return None
+    handler = type("MetricsHandler", (_Handler,), {"registry": registry})
+    try:
+        server = ThreadingHTTPServer((addr, port), handler)
+    except OSError as e:
+        logger.warning("Metrics endpoint disabled, cannot listen on %s:%d: %s", addr, port, e)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info("Metrics on http://%s:%d/metrics", addr, server.server_address[1])
+    return server
@@ -0,0 +1,178 @@
+"""
+Background model hot-swap for the edge predictor.
+
+``ModelManager`` watches ``model.h5`` (inotify through the optional
+``inotify_simple`` package, mtime polling otherwise), loads and validates a new
+model in a background thread and swaps it in with a single reference
+assignment. Predictions keep using the previous model until the new one is
+ready, instead of blocking in a polling loop.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+import metrics
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:  # pragma: no cover - depends on the device image
+    INotify = None
+
+logger = logging.getLogger(__name__)
+
+
+def _file_signature(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class ModelManager:
+    """Owns the current model and replaces it when ``model_path`` changes on disk."""
+
+    def __init__(self, model_path, loader, timesteps=10, features=1, poll_interval=5.0, settle_time=1.0,
+                 use_inotify=True):
+        self.model_path = model_path
+        self.loader = loader
+        self.timesteps = timesteps
+        self.features = features
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+        self.use_inotify = use_inotify and INotify is not None
+        self._model = None
+        self._signature = None
+        self._version = 0
+        self._lock = threading.Lock()
+        self._swapped = threading.Condition(self._lock)
+        self._stop = threading.Event()
+        self._thread = None
+        self._listeners = []
+
+    @property
+    def current(self):
+        """The model to use for the next prediction (may be None before the first load)."""
+        return self._model
+
+    @property
+    def version(self):
+        """Incremented on every successful swap."""
+        return self._version
+
+    def add_listener(self, callback):
+        """Registers ``callback(model, version)`` to be called after each swap."""
+        self._listeners.append(callback)
+
+    def load_initial(self):
+        """Loads the model synchronously if it exists. Returns the model or None."""
+        signature = _file_signature(self.model_path)
+        if signature is None:
+            return None
+        model = metrics.MODEL_LOAD.time_call(self.loader, self.model_path)
+        if model is not None:
+            self._swap(model, signature)
+        return model
+
+    def start(self):
+        if self._thread is not None:
+            return self
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="model-manager", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def wait_for_update(self, version, timeout=None):
+        """Blocks until the version is newer than ``version``. Returns True if it is."""
+        with self._swapped:
+            return self._swapped.wait_for(lambda: self._version > version, timeout)
+
+    def check_now(self):
+        """Reloads the model if the file changed since the last swap. Returns True on swap."""
+        signature = _file_signature(self.model_path)
+        if signature is None or signature == self._signature:
+            return False
+        signature = self._wait_until_stable(signature)
+        if signature is None or signature == self._signature:
+            return False
+        try:
+            with metrics.MODEL_LOAD.time():
+                model = self.loader(self.model_path)
+                self.validate(model)
+        except Exception:
+            metrics.MODEL_REJECTED.inc()
+            logger.exception("Rejected new model at %s, keeping the current one", self.model_path)
+            # Ne pas reessayer tant que le fichier n'a pas encore change
+            self._signature = signature
+            return False
+        self._swap(model, signature)
+        return True
+
+    def validate(self, model):
+        """Runs one prediction on a dummy window; raises if the output is unusable."""
+        if model is None:
+            raise ValueError("loader returned no model")
+        output = np.asarray(model.predict(np.zeros((1, self.timesteps, self.features), dtype=np.float32)))
+        if output.ndim != 2 or output.shape[0] != 1:
+            raise ValueError(f"unexpected output shape {output.shape}")
+        if not np.all(np.isfinite(output)):
+            raise ValueError("model produces non-finite predictions")
+
+    def _swap(self, model, signature):
+        with self._swapped:
+            self._model = model
+            self._signature = signature
+            self._version += 1
+            version = self._version
+            self._swapped.notify_all()
+        metrics.MODEL_VERSION.set(version)
+        logger.info("Model %s loaded (version %d)", self.model_path, version)
+        for callback in self._listeners:
+            try:
+                callback(model, version)
+            except Exception:
+                logger.exception("Model swap listener failed")
+
+    def _wait_until_stable(self, signature):
+        # tar --overwrite ecrit le fichier en place : attendre qu'il ne bouge plus
+        while not self._stop.is_set():
+            time.sleep(self.settle_time)
+            current = _file_signature(self.model_path)
+            if current == signature:
+                return current
+            signature = current
+        return None
+
+    def _run(self):
+        if self.use_inotify:
+            try:
+                self._run_inotify()
+                return
+            except OSError:
+                logger.exception("inotify unavailable, falling back to polling")
+        self._run_polling()
+
+    def _run_polling(self):
+        while not self._stop.wait(self.poll_interval):
+            self.check_now()
+
+    def _run_inotify(self):
+        directory, name = os.path.split(os.path.abspath(self.model_path))
+        with INotify() as inotify:
+            inotify.add_watch(directory, flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE)
+            # Un changement peut avoir eu lieu entre load_initial() et add_watch()
+            self.check_now()
+            while not self._stop.is_set():
+                events = inotify.read(timeout=int(self.poll_interval * 1000))
+                if any(event.name == name for event in events):
+                    self.check_now()
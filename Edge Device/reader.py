@@ -0,0 +1,155 @@
+"""
+Incremental reader for the Clemap ``meter_data`` table.
+
+The edge loop used to open a new connection and run ``ORDER BY time DESC LIMIT N``
+on every tick. ``MeterReader`` keeps a single read-only connection open and only
+asks SQLite for the rows that come after the last ``(time, rowid)`` it has seen,
+so rows sharing a timestamp with the end of a page are not skipped.
+``PRAGMA data_version`` tells it when the collector has committed anything, so
+waiting for new rows costs one pragma per poll instead of a query.
+"""
+
+import logging
+import os
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+# Index recommande sur meter_data(time) pour que les requetes incrementales restent en O(log n)
+TIME_INDEX_NAME = "idx_meter_data_time"
+
+
+def ensure_time_index(db_path):
+    """Creates the ``meter_data(time)`` index if it is missing. Returns True when the index exists."""
+    try:
+        conn = sqlite3.connect(db_path, timeout=5)
+    except sqlite3.Error as e:
+        logger.warning("Unable to open %s to check the time index: %s", db_path, e)
+        return False
+    try:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {TIME_INDEX_NAME} ON meter_data(time)")
+        conn.commit()
+        return True
+    except sqlite3.Error as e:
+        # Base en lecture seule ou verrouillee par le collecteur : on continue sans index
+        logger.warning("Could not create index %s on meter_data(time): %s", TIME_INDEX_NAME, e)
+        return False
+    finally:
+        conn.close()
+
+
+class MeterReader:
+    """Tails ``meter_data`` through one persistent read-only connection."""
+
+    LATEST_QUERY = """
+    SELECT time, l1_p, l2_p, l3_p, rowid
+    FROM meter_data
+    ORDER BY time DESC, rowid DESC
+    LIMIT ?
+    """
+
+    # Pagination sur (time, rowid) : une ligne de meme time que la fin de page n'est pas sautee
+    TAIL_QUERY = """
+    SELECT time, l1_p, l2_p, l3_p, rowid
+    FROM meter_data
+    WHERE time >= ? AND (time > ? OR rowid > ?)
+    ORDER BY time ASC, rowid ASC
+    LIMIT ?
+    """
+
+    def __init__(self, db_path, batch_size=1000, create_index=True):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.create_index = create_index
+        self.last_time = None
+        self.last_rowid = None
+        self._conn = None
+        self._data_version = None
+
+    def connect(self):
+        """Opens the shared connection (idempotent)."""
+        if self._conn is not None:
+            return self._conn
+        print("Database exists:", os.path.exists(self.db_path))
+        print("Database permissions:", oct(os.stat(self.db_path).st_mode))
+        if self.create_index:
+            ensure_time_index(self.db_path)
+        # mode=ro : le collecteur reste le seul ecrivain, en WAL les lectures ne le bloquent pas
+        self._conn = sqlite3.connect(
+            f"file:{self.db_path}?mode=ro",
+            uri=True,
+            check_same_thread=False,
+            cached_statements=16,
+        )
+        self._conn.execute("PRAGMA query_only = ON")
+        journal_mode = self._conn.execute("PRAGMA journal_mode").fetchone()[0]
+        if journal_mode.lower() != "wal":
+            logger.info("meter_data database is in %s journal mode, WAL is recommended", journal_mode)
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+            self._data_version = None
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def latest(self, n):
+        """Returns the ``n`` most recent rows in chronological order and moves the cursor to the newest one."""
+        rows = self.connect().execute(self.LATEST_QUERY, (n,)).fetchall()
+        rows.reverse()
+        if rows:
+            self._advance(rows[-1])
+        return [row[:-1] for row in rows]
+
+    def fetch_new(self):
+        """Returns the rows added since the last call, oldest first."""
+        if self.last_time is None:
+            return self.latest(self.batch_size)
+        conn = self.connect()
+        rows = []
+        while True:
+            batch = conn.execute(
+                self.TAIL_QUERY, (self.last_time, self.last_time, self.last_rowid, self.batch_size)
+            ).fetchall()
+            if not batch:
+                break
+            rows.extend(row[:-1] for row in batch)
+            self._advance(batch[-1])
+            if len(batch) < self.batch_size:
+                break
+        return rows
+
+    def has_changed(self):
+        """True when another connection committed since the last call (always True on the first one)."""
+        # data_version ne change que sur un commit d'une autre connexion : le collecteur
+        version = self.connect().execute("PRAGMA data_version").fetchone()[0]
+        changed = version != self._data_version
+        self._data_version = version
+        return changed
+
+    def wait_for_rows(self, timeout=None, poll_interval=0.5):
+        """Blocks until new rows are committed or ``timeout`` s have passed. Returns the new rows, oldest first."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            # Version lue avant la requete : un commit pendant fetch_new() sera vu au tour suivant
+            if self.has_changed():
+                rows = self.fetch_new()
+                if rows:
+                    return rows
+            if deadline is not None and time.monotonic() >= deadline:
+                return []
+            time.sleep(poll_interval)
+
+    def _advance(self, row):
+        # row se termine par le rowid
+        key = (row[0], row[-1])
+        if self.last_time is None or key > (self.last_time, self.last_rowid):
+            self.last_time, self.last_rowid = key
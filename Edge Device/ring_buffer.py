@@ -0,0 +1,73 @@
+"""
+Fixed-size float32 ring buffer for the sliding prediction window.
+"""
+
+import numpy as np
+
+
+class RingBuffer:
+    """Preallocated sliding window returning contiguous ``(1, timesteps, features)`` views.
+
+    Every sample is written twice, at ``pos`` and ``pos + capacity``, so the last
+    ``capacity`` samples are always contiguous in memory and ``as_input()`` is a
+    plain slice of the backing array. The returned view is overwritten by the
+    next ``append``: copy it if it has to outlive the current tick.
+    """
+
+    def __init__(self, capacity=10, features=1, dtype=np.float32):
+        if capacity <= 0:
+            raise ValueError("capacity must be a positive integer")
+        self.capacity = capacity
+        self.features = features
+        # Un echantillon scalaire par pas de temps si features == 1, une ligne (l1_p, l2_p, l3_p) sinon
+        shape = (2 * capacity,) if features == 1 else (2 * capacity, features)
+        self._buf = np.zeros(shape, dtype=dtype)
+        self._pos = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def full(self):
+        return self._count == self.capacity
+
+    def append(self, value):
+        pos = self._pos
+        self._buf[pos] = value
+        self._buf[pos + self.capacity] = value
+        self._pos = pos + 1 if pos + 1 < self.capacity else 0
+        if self._count < self.capacity:
+            self._count += 1
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self._buf.dtype).reshape((-1,) + self._buf.shape[1:])
+        if len(values) > self.capacity:
+            values = values[-self.capacity:]
+        n = len(values)
+        if n == 0:
+            return
+        idx = (self._pos + np.arange(n)) % self.capacity
+        self._buf[idx] = values
+        self._buf[idx + self.capacity] = values
+        self._pos = (self._pos + n) % self.capacity
+        self._count = min(self._count + n, self.capacity)
+
+    def clear(self):
+        self._pos = 0
+        self._count = 0
+
+    def values(self):
+        """Returns the buffered samples in chronological order (no copy)."""
+        end = self._pos + self.capacity
+        return self._buf[end - self._count:end]
+
+    def last(self):
+        """Returns the most recent sample."""
+        if not self._count:
+            raise IndexError("last() on an empty RingBuffer")
+        return self._buf[self._pos + self.capacity - 1]
+
+    def as_input(self):
+        """Returns the window as a ``(1, timesteps, features)`` view ready for the model."""
+        return self.values().reshape((1, self._count, self.features))
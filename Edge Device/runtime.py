@@ -0,0 +1,204 @@
+"""
+asyncio runtime for the edge device.
+
+The sequential loop (read, predict, sleep, read, maybe upload, sleep) is split
+into four tasks joined by bounded queues, for every meter of a ``MeterBank``:
+
+    tailer -> samples -> predictor -> evaluations -> drift evaluator -> exports -> exporter
+
+Blocking work runs in dedicated executors: SQLite reads on a single "db" thread
+(the connection is never used concurrently), retrain reports on a "report"
+thread with their own connection, inference on an "inference" thread and
+Stream Manager uploads on an "export" thread, so a slow report or S3 export can
+never delay ingestion or prediction. SIGINT/SIGTERM stop every
+task cleanly. Every stage is timed in ``metrics.STAGE_SECONDS``.
+
+All meters are predicted together in one ``(n_meters, timesteps, features)``
+forward pass. Each meter has its own ``PredictionSchedule``: a pass runs when
+a meter's newest row enters a new ``CLEMAP_PREDICTION_INTERVAL`` slot (every
+new row by default), and the first forecast step is compared with the row
+``CLEMAP_PREDICTION_STRIDE`` rows after the window.
+"""
+
+import asyncio
+import logging
+import signal
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from drift import DriftMonitor
+from scheduler import PredictionSchedule
+
+logger = logging.getLogger(__name__)
+
+
+def sum_phases(row):
+    # Somme des puissances des trois phases : l1_p + l2_p + l3_p
+    return row[1] + row[2] + row[3]
+
+
+class EdgeRuntime:
+    """Runs ingestion, inference, drift evaluation and export as concurrent tasks."""
+
+    def __init__(self, bank, model_manager, report_fn, export_fn,
+                 should_retrain=None, poll_interval=0.5, queue_size=1024, retrain_timeout=3600.0,
+                 schedule_factory=None):
+        self.bank = bank
+        self.model_manager = model_manager
+        self.report_fn = report_fn
+        self.export_fn = export_fn
+        # should_retrain(meter_name, predicted, actual) -> bool ; DriftMonitor par defaut
+        self.should_retrain = should_retrain or DriftMonitor()
+        # Attente entre deux verifications de PRAGMA data_version quand aucune base n'a change
+        self.poll_interval = poll_interval
+        # Sans nouveau modele apres ce delai (upload perdu, modele refuse), la derive est de nouveau surveillee
+        self.retrain_timeout = retrain_timeout
+        # Cadence et pas de verification par compteur ; sans CLEMAP_PREDICTION_INTERVAL, une prediction par ligne
+        schedule_factory = schedule_factory or (lambda: PredictionSchedule.from_env(interval=0))
+        self.schedules = [schedule_factory() for _ in bank]
+        # time de la derniere ligne de chaque compteur : fin de la fenetre predite
+        self._last_times = [None] * len(bank)
+        self.samples = asyncio.Queue(maxsize=queue_size)
+        self.evaluations = asyncio.Queue(maxsize=queue_size)
+        # Une seule exportation en attente : les demandes suivantes sont ignorees tant qu'elle n'est pas partie
+        self.exports = asyncio.Queue(maxsize=1)
+        self._stop = asyncio.Event()
+        self._retrain_requested_at = None
+        self._retrain_deadline = None
+        self._db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="edge-db")
+        self._inference_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="edge-inference")
+        self._export_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="edge-export")
+        # Rapport de reentrainement (jusqu'a 100 000 lignes en gzip) sur sa propre connexion : le tailer continue
+        self._report_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="edge-report")
+
+    def stop(self):
+        self._stop.set()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        for index, meter in enumerate(self.bank):
+            rows = await loop.run_in_executor(self._db_executor, meter.reader.latest, meter.window.capacity)
+            for row in rows:
+                meter.push(row)
+            if rows:
+                self._last_times[index] = rows[-1][0]
+
+        tasks = [
+            asyncio.create_task(self._tail(), name="tailer"),
+            asyncio.create_task(self._predict(), name="predictor"),
+            asyncio.create_task(self._evaluate(), name="drift-evaluator"),
+            asyncio.create_task(self._export(), name="exporter"),
+        ]
+        stop_task = asyncio.create_task(self._stop.wait())
+        try:
+            done, _ = await asyncio.wait(tasks + [stop_task], return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task is not stop_task and task.exception() is not None:
+                    logger.error("Task %s failed", task.get_name(), exc_info=task.exception())
+        finally:
+            logger.info("Stopping edge runtime")
+            for task in tasks + [stop_task]:
+                task.cancel()
+            await asyncio.gather(*tasks, stop_task, return_exceptions=True)
+            self.model_manager.stop()
+            for executor in (self._db_executor, self._inference_executor, self._export_executor,
+                             self._report_executor):
+                executor.shutdown(wait=False, cancel_futures=True)
+            await loop.run_in_executor(None, self.bank.close)
+
+    async def _tail(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            received = 0
+            for index, meter in enumerate(self.bank):
+                # Une pragma par base et par tour ; la requete de lecture ne part que si le collecteur a commite
+                if not await loop.run_in_executor(self._db_executor, meter.reader.has_changed):
+                    continue
+                rows = await loop.run_in_executor(self._db_executor, metrics.DB_READ.time_call, meter.reader.fetch_new)
+                for row in rows:
+                    await self.samples.put((index, row))
+                received += len(rows)
+            if not received:
+                await asyncio.sleep(self.poll_interval)
+
+    async def _predict(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            index, row = await self.samples.get()
+            meter = self.bank.meters[index]
+            # Chaque prediction est comparee a la ligne qu'elle predit, `stride` lignes apres sa fenetre
+            for _, predicted, actual in self.schedules[index].observe(sum_phases(row)):
+                await self.evaluations.put((index, row[0], predicted, actual))
+            meter.push(row)
+            self._last_times[index] = row[0]
+
+            model = self.model_manager.current
+            if model is None or not self.bank.ready or not self.samples.empty():
+                # Pas de prediction sur une fenetre deja depassee par des lignes en attente
+                continue
+            due = [i for i, (schedule, last_time) in enumerate(zip(self.schedules, self._last_times))
+                   if last_time is not None and schedule.due(last_time)]
+            if not due:
+                continue
+            # Une seule passe pour tous les compteurs ; batch() copie les fenetres dans un tableau reutilise
+            input_data = metrics.PREPARE.time_call(self.bank.batch)
+            prediction = await loop.run_in_executor(
+                self._inference_executor, metrics.PREDICT.time_call, model.predict, input_data
+            )
+            forecasts = self.bank.split_outputs(prediction)
+            metrics.PREDICTIONS.inc(len(due))
+            for i in due:
+                forecast = forecasts[i]
+                predicted = float(forecast[0].sum())
+                if predicted != predicted:
+                    metrics.NAN_PREDICTIONS.inc()
+                self.schedules[i].expect(self._last_times[i], predicted)
+                logger.info("Prediction %s (%d pas) : %s", self.bank.meters[i].name, len(forecast), forecast.tolist())
+
+    async def _evaluate(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            index, sample_time, predicted, actual = await self.evaluations.get()
+            if self._retrain_requested_at is not None:
+                if self.model_manager.version > self._retrain_requested_at:
+                    logger.info("Le nouveau ML est arrivé")
+                elif loop.time() >= self._retrain_deadline:
+                    logger.info("No new model %.0f s after the retrain request, monitoring drift again",
+                                self.retrain_timeout)
+                else:
+                    continue
+                self._retrain_requested_at = None
+            meter = self.bank.meters[index]
+            with metrics.DRIFT_CHECK.time():
+                retrain = self.should_retrain(meter.name, predicted, actual)
+            if not retrain:
+                continue
+            metrics.RETRAIN_REQUESTS.inc()
+            logger.info("Drift on %s at %s (predicted %s, real %s), requesting retraining",
+                        meter.name, sample_time, predicted, actual)
+            # report_fn(meter) prepare les donnees de reentrainement, export_fn(report) les envoie
+            report = await loop.run_in_executor(self._report_executor, metrics.REPORT.time_call, self.report_fn, meter)
+            if report is None:
+                logger.info("No new rows to export for %s", meter.name)
+                continue
+            try:
+                self.exports.put_nowait(report)
+                self._retrain_requested_at = self.model_manager.version
+                self._retrain_deadline = loop.time() + self.retrain_timeout
+            except asyncio.QueueFull:
+                logger.info("An export is already queued, skipping this retrain request")
+
+    async def _export(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            report = await self.exports.get()
+            try:
+                await loop.run_in_executor(self._export_executor, metrics.EXPORT.time_call, self.export_fn, report)
+            except Exception:
+                logger.exception("Export to the cloud failed")
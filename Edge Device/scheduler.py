@@ -0,0 +1,92 @@
+"""
+Prediction cadence aligned on the ``time`` column of ``meter_data``.
+
+The sequential loop used to predict, ``time.sleep(60)``, and compare with
+whatever row was the newest at that point, then sleep again: the real
+sampling rate and the timestamps were ignored, the sleeps drifted, and the
+comparison was not made with the value the model was asked for.
+
+``PredictionSchedule`` works on rows instead of wall-clock time. A prediction
+is due when the newest row enters a new ``interval``-second slot of the
+``time`` column (slots are aligned on multiples of ``interval``, so the
+cadence does not drift), and it is checked against the row that comes
+``stride`` rows after the end of its window, i.e. the value the model was
+trained to predict.
+
+Both edge loops use it: the sequential loop predicts once a minute by default,
+the asyncio runtime (``runtime.py``) on every new row unless
+``CLEMAP_PREDICTION_INTERVAL`` is set.
+"""
+
+import math
+import os
+from collections import deque
+from datetime import datetime, timezone
+
+
+def parse_time(value):
+    """Seconds since the epoch of a ``time`` value: epoch seconds or milliseconds, or an ISO 8601 string."""
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+            if parsed.tzinfo is None:
+                parsed = parsed.replace(tzinfo=timezone.utc)
+            return parsed.timestamp()
+    value = float(value)
+    # Horodatage en millisecondes (apres 1973 en ms, ou apres l'an 5000 en s)
+    return value / 1000 if value > 1e11 else value
+
+
+class PredictionSchedule:
+    """Decides when to predict and which row checks each pending prediction."""
+
+    def __init__(self, interval=60.0, stride=1):
+        if stride < 1:
+            raise ValueError("stride must be at least 1 row")
+        self.interval = interval
+        self.stride = stride
+        self._slot = None
+        # [lignes restantes avant la valeur reelle, time de fin de fenetre, prediction]
+        self._pending = deque()
+
+    @classmethod
+    def from_env(cls, interval=60.0):
+        """Reads ``CLEMAP_PREDICTION_INTERVAL`` and ``CLEMAP_PREDICTION_STRIDE``; ``interval`` is the default."""
+        return cls(
+            interval=float(os.environ.get("CLEMAP_PREDICTION_INTERVAL", interval)),
+            stride=int(os.environ.get("CLEMAP_PREDICTION_STRIDE", "1")),
+        )
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def _slot_of(self, row_time):
+        if self.interval <= 0:
+            return parse_time(row_time)
+        return math.floor(parse_time(row_time) / self.interval)
+
+    def due(self, row_time):
+        """True when the window ending at the row ``row_time`` should be predicted."""
+        return self._slot is None or self._slot_of(row_time) > self._slot
+
+    def expect(self, row_time, predicted):
+        """Records a prediction made on the window ending at ``row_time``."""
+        self._slot = self._slot_of(row_time)
+        self._pending.append([self.stride, row_time, predicted])
+
+    def observe(self, actual):
+        """Feeds the next row. Returns the ``(window_time, predicted, actual)`` it checks, oldest first."""
+        for pending in self._pending:
+            pending[0] -= 1
+        resolved = []
+        while self._pending and self._pending[0][0] <= 0:
+            _, window_time, predicted = self._pending.popleft()
+            resolved.append((window_time, predicted, actual))
+        return resolved
+
+    def reset(self):
+        """Drops the pending predictions, e.g. after a model swap."""
+        self._pending.clear()
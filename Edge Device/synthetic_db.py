@@ -0,0 +1,130 @@
+"""
+Synthetic Clemap ``meter_data`` databases for offline benchmarks and replays.
+
+    python synthetic_db.py /tmp/meter.db --rows 100000 --period 1 --drift-at 0.8
+
+Each phase follows a daily load profile plus seeded noise; from row
+``drift_at`` on, the level and the shape change, so the drift detector has
+something to find. Rows are written with ``executemany`` in WAL mode,
+like the collector, and ``SyntheticMeter.append`` keeps writing live rows
+(see ``benchmark_pipeline.py``).
+"""
+
+import argparse
+import os
+import sqlite3
+
+import numpy as np
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meter_data (
+    time TEXT NOT NULL,
+    l1_p REAL,
+    l2_p REAL,
+    l3_p REAL
+)
+"""
+
+INSERT = "INSERT INTO meter_data (time, l1_p, l2_p, l3_p) VALUES (?, ?, ?, ?)"
+
+# 2024-01-01T00:00:00Z
+DEFAULT_START = 1704067200.0
+
+
+class SyntheticMeter:
+    """Writes deterministic synthetic rows to one ``meter_data`` database."""
+
+    def __init__(self, db_path, period=1.0, start=DEFAULT_START, seed=0, drift_at=None,
+                 base=0.1, amplitude=0.05, noise=0.002, drift_scale=1.5):
+        self.db_path = db_path
+        self.period = period
+        self.start = start
+        self.drift_at = drift_at
+        self.base = base
+        self.amplitude = amplitude
+        self.noise = noise
+        self.drift_scale = drift_scale
+        self.written = 0
+        self._rng = np.random.default_rng(seed)
+        # Dephasage propre a chaque phase et a chaque compteur
+        self._phases = self._rng.uniform(0, 2 * np.pi, size=3)
+        self._conn = None
+
+    def connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode = WAL")
+            self._conn.execute(SCHEMA)
+            self._conn.commit()
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    @property
+    def last_time(self):
+        """``time`` of the last row written, or None."""
+        return _format_times(self._seconds(self.written - 1, 1))[0] if self.written else None
+
+    def _seconds(self, first, count):
+        return self.start + (first + np.arange(count)) * self.period
+
+    def rows(self, count):
+        """Returns the next ``count`` rows as ``(time, l1_p, l2_p, l3_p)`` tuples, without writing them."""
+        index = self.written + np.arange(count)
+        seconds = self._seconds(self.written, count)
+        day = 2 * np.pi * (seconds % 86400) / 86400
+        values = self.base + self.amplitude * np.sin(day[:, None] + self._phases)
+        if self.drift_at is not None:
+            # Apres la derive : niveau plus haut et profil deux fois plus rapide
+            drifted = index >= self.drift_at
+            values[drifted] = self.drift_scale * (self.base + self.amplitude * np.sin(2 * day[drifted, None] + self._phases))
+        values += self._rng.normal(0, self.noise, size=values.shape)
+        times = _format_times(seconds)
+        return list(zip(times, *(values[:, i].tolist() for i in range(3))))
+
+    def append(self, count):
+        """Writes the next ``count`` rows in one transaction. Returns them."""
+        rows = self.rows(count)
+        conn = self.connect()
+        with conn:
+            conn.executemany(INSERT, rows)
+        self.written += count
+        return rows
+
+
+def _format_times(seconds):
+    # Horodatage ISO 8601 en millisecondes : l'ordre lexicographique est l'ordre chronologique
+    return np.datetime_as_string(np.asarray(seconds * 1000, dtype="int64").astype("datetime64[ms]")).tolist()
+
+
+def create_meter_db(db_path, rows, period=1.0, seed=0, drift_at=None, chunk_size=50000, **kwargs):
+    """Creates (or replaces) a database with ``rows`` rows; ``drift_at`` is a row index. Returns the meter."""
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    meter = SyntheticMeter(db_path, period=period, seed=seed, drift_at=drift_at, **kwargs)
+    while meter.written < rows:
+        meter.append(min(chunk_size, rows - meter.written))
+    return meter
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("db")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--period", type=float, default=1.0, help="Seconds between two rows")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--drift-at", type=float, default=None, help="Fraction of the rows after which the load drifts")
+    args = parser.parse_args()
+
+    drift_at = None if args.drift_at is None else int(args.drift_at * args.rows)
+    meter = create_meter_db(args.db, args.rows, args.period, args.seed, drift_at)
+    meter.close()
+    print(f"{args.db}: {args.rows} rows up to {meter.last_time} ({os.path.getsize(args.db) / 2**20:.1f} MiB)")
+
+
+if __name__ == "__main__":
+    main()
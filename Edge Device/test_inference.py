@@ -0,0 +1,156 @@
+"""
+Parity of the NumPy inference backend with an independent LSTM reference.
+
+    python -m pytest test_inference.py
+
+The reference below is written gate by gate, one sample and one time step at a
+time in float64, from the Keras LSTM equations; it shares no code with
+``inference.py``. The Keras comparison only runs when TensorFlow is installed.
+"""
+
+import json
+
+import numpy as np
+import pytest
+
+from inference import DenseLayer, LSTMLayer, NumpyBackend
+
+TIMESTEPS = 10
+FEATURES = 1
+UNITS = 32
+
+
+def reference_lstm(x, kernel, recurrent_kernel, bias, activation, return_sequences=False):
+    """h_t = o * act(c_t), c_t = f * c_{t-1} + i * act(W_c x + U_c h + b_c), gates i, f, c, o in that order."""
+    sigmoid = lambda z: 1.0 / (1.0 + np.exp(-z))  # noqa: E731
+    w_i, w_f, w_c, w_o = np.split(kernel.astype(np.float64), 4, axis=1)
+    u_i, u_f, u_c, u_o = np.split(recurrent_kernel.astype(np.float64), 4, axis=1)
+    b_i, b_f, b_c, b_o = np.split(bias.astype(np.float64), 4)
+    units = recurrent_kernel.shape[0]
+    outputs = np.zeros((x.shape[0], x.shape[1], units))
+    for n, sample in enumerate(x.astype(np.float64)):
+        h, c = np.zeros(units), np.zeros(units)
+        for t, x_t in enumerate(sample):
+            i = sigmoid(x_t @ w_i + h @ u_i + b_i)
+            f = sigmoid(x_t @ w_f + h @ u_f + b_f)
+            candidate = activation(x_t @ w_c + h @ u_c + b_c)
+            o = sigmoid(x_t @ w_o + h @ u_o + b_o)
+            c = f * c + i * candidate
+            h = o * activation(c)
+            outputs[n, t] = h
+    return outputs if return_sequences else outputs[:, -1]
+
+
+def seeded_weights(seed=0, units=UNITS, features=FEATURES, outputs=1):
+    rng = np.random.default_rng(seed)
+    return {
+        "kernel": rng.normal(0, 0.3, (features, 4 * units)).astype(np.float32),
+        "recurrent_kernel": rng.normal(0, 0.3, (units, 4 * units)).astype(np.float32),
+        "bias": rng.normal(0, 0.1, 4 * units).astype(np.float32),
+        "dense_kernel": rng.normal(0, 0.3, (units, outputs)).astype(np.float32),
+        "dense_bias": rng.normal(0, 0.1, outputs).astype(np.float32),
+    }
+
+
+def seeded_inputs(batch=16, seed=1):
+    return np.random.default_rng(seed).uniform(0.0, 1.0, (batch, TIMESTEPS, FEATURES)).astype(np.float32)
+
+
+def layer_specs(weights, activation="relu"):
+    # Meme architecture que create_model() de train_lstm.py : LSTM(units, activation='relu') puis Dense
+    return [
+        ("LSTM", {"activation": activation, "recurrent_activation": "sigmoid"},
+         [weights["kernel"], weights["recurrent_kernel"], weights["bias"]]),
+        ("Dense", {"activation": "linear"}, [weights["dense_kernel"], weights["dense_bias"]]),
+    ]
+
+
+@pytest.mark.parametrize("activation", ["relu", "tanh"])
+def test_lstm_layer_matches_reference(activation):
+    w = seeded_weights()
+    x = seeded_inputs()
+    layer = LSTMLayer(w["kernel"], w["recurrent_kernel"], w["bias"], activation=activation)
+    act = (lambda z: np.maximum(z, 0.0)) if activation == "relu" else np.tanh
+    expected = reference_lstm(x, w["kernel"], w["recurrent_kernel"], w["bias"], act)
+    np.testing.assert_allclose(layer(x), expected, rtol=1e-4, atol=1e-5)
+
+
+def test_lstm_layer_return_sequences():
+    w = seeded_weights(seed=2)
+    x = seeded_inputs(batch=4)
+    layer = LSTMLayer(w["kernel"], w["recurrent_kernel"], w["bias"], return_sequences=True)
+    expected = reference_lstm(x, w["kernel"], w["recurrent_kernel"], w["bias"], np.tanh, return_sequences=True)
+    assert layer(x).shape == (4, TIMESTEPS, UNITS)
+    np.testing.assert_allclose(layer(x), expected, rtol=1e-4, atol=1e-5)
+
+
+def test_dense_layer():
+    w = seeded_weights()
+    h = np.random.default_rng(3).normal(size=(5, UNITS)).astype(np.float32)
+    expected = h.astype(np.float64) @ w["dense_kernel"] + w["dense_bias"]
+    np.testing.assert_allclose(DenseLayer(w["dense_kernel"], w["dense_bias"])(h), expected, rtol=1e-5, atol=1e-6)
+
+
+def test_numpy_backend_matches_reference():
+    w = seeded_weights(outputs=3)
+    x = seeded_inputs(batch=32)
+    hidden = reference_lstm(x, w["kernel"], w["recurrent_kernel"], w["bias"], lambda z: np.maximum(z, 0.0))
+    expected = hidden @ w["dense_kernel"] + w["dense_bias"]
+    prediction = NumpyBackend(layer_specs(w)).predict(x)
+    assert prediction.shape == (32, 3)
+    np.testing.assert_allclose(prediction, expected, rtol=1e-4, atol=1e-5)
+    # Un lot donne les memes sorties que les fenetres predites une par une
+    single = np.concatenate([NumpyBackend(layer_specs(w)).predict(x[i:i + 1]) for i in range(len(x))])
+    np.testing.assert_allclose(prediction, single, rtol=1e-6, atol=1e-6)
+
+
+def write_keras_h5(path, weights, activation="relu"):
+    """Minimal Keras 2 style ``.h5`` (model_config + model_weights) as read by ``read_h5_layers``."""
+    h5py = pytest.importorskip("h5py")
+    config = {"class_name": "Sequential", "config": {"layers": [
+        {"class_name": "InputLayer", "config": {"name": "input"}},
+        {"class_name": "LSTM", "config": {"name": "lstm", "activation": activation,
+                                          "recurrent_activation": "sigmoid", "return_sequences": False}},
+        {"class_name": "Dense", "config": {"name": "dense", "activation": "linear"}},
+    ]}}
+    layers = {
+        "lstm": [("lstm/lstm_cell/kernel:0", weights["kernel"]),
+                 ("lstm/lstm_cell/recurrent_kernel:0", weights["recurrent_kernel"]),
+                 ("lstm/lstm_cell/bias:0", weights["bias"])],
+        "dense": [("dense/kernel:0", weights["dense_kernel"]), ("dense/bias:0", weights["dense_bias"])],
+    }
+    with h5py.File(path, "w") as f:
+        f.attrs["model_config"] = json.dumps(config)
+        group = f.create_group("model_weights")
+        for name, named_weights in layers.items():
+            layer = group.create_group(name)
+            layer.attrs["weight_names"] = [n.encode("utf-8") for n, _ in named_weights]
+            for n, value in named_weights:
+                layer.create_dataset(n, data=value)
+
+
+def test_numpy_backend_from_h5_and_cache(tmp_path):
+    w = seeded_weights(seed=4)
+    x = seeded_inputs()
+    path = str(tmp_path / "model.h5")
+    write_keras_h5(path, w)
+    cache_dir = str(tmp_path / "cache")
+    expected = NumpyBackend(layer_specs(w)).predict(x)
+    # Premier chargement depuis le .h5, second depuis le cache .npz
+    for _ in range(2):
+        backend = NumpyBackend.from_h5(path, cache_dir=cache_dir)
+        np.testing.assert_allclose(backend.predict(x), expected, rtol=1e-6, atol=1e-7)
+
+
+def test_numpy_backend_matches_keras():
+    tf = pytest.importorskip("tensorflow")
+    w = seeded_weights(seed=5)
+    x = seeded_inputs()
+    model = tf.keras.Sequential([
+        tf.keras.layers.Input(shape=(TIMESTEPS, FEATURES)),
+        tf.keras.layers.LSTM(UNITS, activation="relu"),
+        tf.keras.layers.Dense(1),
+    ])
+    model.set_weights([w["kernel"], w["recurrent_kernel"], w["bias"], w["dense_kernel"], w["dense_bias"]])
+    np.testing.assert_allclose(NumpyBackend(layer_specs(w)).predict(x), model.predict(x, verbose=0),
+                               rtol=1e-4, atol=1e-5)